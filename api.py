@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from libs import coherence, queries as q
+from libs.auth import authenticate, client_address, get_user_by_id
+from libs.db import get_read_conn
+from libs.ics import etag_matches, get_feed
+from libs.sessions import check_feed_key, create_session, resolve_session, token_tenant
+from libs.storage import storage_for
+from libs.tenancy import DEFAULT_TENANT, TENANT_PARAM, activate, current_tenant, ensure_tenant, is_served, tenant_exists
+
+# Lightweight HTTP API running next to the Streamlit app.
+#
+# Serves what does not need a full Streamlit session (ICS feed, match list,
+# attendance toggles) on plain threads, with the same libs, session tokens and
+# pooled connections as the app. A player's attendance is read and written
+# through the storage repositories (libs/storage.py):
+#
+#   uv run python api.py            # BARBARAPP_API_HOST / BARBARAPP_API_PORT
+#
+#   POST /api/login       {"username", "password", "team"?}  -> {"token", "user"}
+#   GET  /api/matches     ?all=1 for past matches too        (Authorization: Bearer <token>)
+#   POST /api/attendance  {"match_id", "confirmed": bool}    (Authorization: Bearer <token>)
+#   GET  /calendar.ics    ?team=&key=
+
+log = logging.getLogger("barbarapp.api")
+
+API_HOST = os.environ.get("BARBARAPP_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("BARBARAPP_API_PORT", 8502))
+MAX_BODY_BYTES = 64 * 1024
+
+_match_lists = {}  # (team, from date) -> (generations, rows)
+_match_lists_lock = threading.Lock()
+
+
+def _json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def upcoming_matches(team: str, since: str) -> list:
+    """Matches from `since` on with confirmation counts, cached until matches or attendance change."""
+    gens = (coherence.generation(coherence.MATCHES), coherence.generation(coherence.ATTENDANCE))
+    key = (team, since)
+    with _match_lists_lock:
+        cached = _match_lists.get(key)
+    if cached and cached[0] == gens:
+        return cached[1]
+    conn = get_read_conn()
+    try:
+        rows = [
+            {
+                "id": r["id"],
+                "match_number": r["match_number"],
+                "date": r["date"],
+                "opponent": r["opponents_team"],
+                "home_or_away": r["home_or_away"],
+                "place": r["place_display"] or r["place_text"],
+                "place_url": r["place_parsed_url"],
+                "confirmed": r["confirmed"],
+            }
+            for r in q.fetch_all(conn, q.MATCHES_WITH_COUNTS, (since,))
+        ]
+    finally:
+        conn.close()
+    with _match_lists_lock:
+        # one entry per team and day; older days are dropped
+        for k in [k for k in _match_lists if k[0] == team and k[1] != since]:
+            del _match_lists[k]
+        _match_lists[key] = (gens, rows)
+    return rows
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "BarbarApp"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        log.info("%s %s", self.address_string(), fmt % args)
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "text/plain; charset=utf-8", headers=None):
+        self.send_response(status)
+        if body or status != 304:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_json(self, status: int, data, headers=None):
+        self._send(status, _json(data), "application/json; charset=utf-8", headers)
+
+    def _error(self, status: int, message: str):
+        self._send_json(status, {"error": message})
+
+    def _team(self, params):
+        """Team named by ?team= (default team when absent), or None when not served here."""
+        team = (params.get(TENANT_PARAM) or [DEFAULT_TENANT])[0]
+        if not is_served(team) or not tenant_exists(team):
+            return None
+        ensure_tenant(team)
+        return team
+
+    def _read_body(self) -> bool:
+        """Read the request body before any response, so keep-alive connections stay in step.
+
+        A body that cannot be read (bad or oversized Content-Length) closes the
+        connection after the response instead; returns False then.
+        """
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY_BYTES:
+            self.close_connection = True
+            self._raw_body = b""
+            return False
+        self._raw_body = self.rfile.read(length) if length else b""
+        return True
+
+    def _body(self):
+        try:
+            data = json.loads(self._raw_body or b"{}")
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    def _user(self):
+        """Authenticate the bearer token and activate its team; returns the user or None."""
+        auth = self.headers.get("Authorization") or ""
+        token = auth[7:].strip() if auth.lower().startswith("bearer ") else ""
+        team = token_tenant(token)
+        if team is None:
+            return None
+        activate(team)
+        user_id = resolve_session(token)
+        return get_user_by_id(user_id) if user_id is not None else None
+
+    def _dispatch(self):
+        if not self._read_body():
+            return self._error(413, "request body too large or invalid Content-Length")
+        url = urlparse(self.path)
+        route = ROUTES.get((self.command if self.command != "HEAD" else "GET", url.path))
+        if route is None:
+            return self._error(404, "not found")
+        try:
+            route(self, parse_qs(url.query))
+        except Exception:
+            log.exception("request failed: %s %s", self.command, self.path)
+            self._error(500, "internal error")
+
+    do_GET = do_HEAD = do_POST = _dispatch
+
+    def calendar_ics(self, params):
+        team = self._team(params)
+        if team is None:
+            return self._send(404, b"unknown team")
+        if not check_feed_key(team, (params.get("key") or [""])[0]):
+            return self._send(403, b"invalid key")
+        body, etag = get_feed(team)
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            return self._send(304, headers=headers)
+        self._send(200, body, "text/calendar; charset=utf-8", headers)
+
+    def login(self, params):
+        data = self._body()
+        if data is None:
+            return self._error(400, "invalid JSON body")
+        team = data.get("team") or DEFAULT_TENANT
+        if not isinstance(team, str) or not is_served(team) or not tenant_exists(team):
+            return self._error(404, "unknown team")
+        activate(team)
+        client = client_address(self.client_address[0], self.headers)
+        user, error = authenticate(str(data.get("username") or ""), str(data.get("password") or ""), client=client)
+        if error == "throttled":
+            return self._error(429, "too many attempts")
+        if user is None:
+            return self._error(401, "invalid credentials")
+        token = create_session(user["id"])
+        self._send_json(200, {"token": token, "user": {k: user[k] for k in ("id", "username", "nickname", "role")}})
+
+    def matches(self, params):
+        user = self._user()
+        if user is None:
+            return self._error(401, "invalid or expired token")
+        from_all = (params.get("all") or ["0"])[0] == "1"
+        rows = upcoming_matches(current_tenant(), "" if from_all else date.today().isoformat())
+        mine = storage_for().attendance.confirmed_match_ids(user["id"])
+        body = _json({"matches": [dict(r, confirmed_by_me=r["id"] in mine) for r in rows]})
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            return self._send(304, headers=headers)
+        self._send(200, body, "application/json; charset=utf-8", headers)
+
+    def attendance(self, params):
+        user = self._user()
+        if user is None:
+            return self._error(401, "invalid or expired token")
+        data = self._body()
+        if data is None or not isinstance(data.get("confirmed"), bool):
+            return self._error(400, 'expected {"match_id": int, "confirmed": bool}')
+        try:
+            match_id = int(data.get("match_id"))
+        except (TypeError, ValueError):
+            return self._error(400, "match_id must be an integer")
+        storage = storage_for()
+        if storage.matches.get(match_id) is None:
+            return self._error(404, "unknown match")
+        inserted, deleted = storage.attendance.set_confirmations(user, {match_id: data["confirmed"]})
+        self._send_json(200, {"match_id": match_id, "confirmed": data["confirmed"], "changed": bool(inserted or deleted)})
+
+ROUTES = {
+    ("GET", "/calendar.ics"): ApiHandler.calendar_ics,
+    ("POST", "/api/login"): ApiHandler.login,
+    ("GET", "/api/matches"): ApiHandler.matches,
+    ("POST", "/api/attendance"): ApiHandler.attendance,
+}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    server = ThreadingHTTPServer((API_HOST, API_PORT), ApiHandler)
+    log.info("listening on http://%s:%s", API_HOST, API_PORT)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,18 @@
 import os
 from pathlib import Path
 import streamlit as st
-from libs.db import init_db, get_db_path
-from libs.auth import current_user, is_admin
+from libs.maintenance import start_maintenance
+from libs.auth import current_user, is_admin, end_session, select_tenant
+from libs.state import track_current_session
+from libs.tenancy import DEFAULT_TENANT, current_tenant
 
 # ensure data dir and DB exist
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
-DB_PATH = get_db_path()
-init_db(DB_PATH)
+# one SQLite file per team: route this run to the team of the session (or ?team=)
+DB_PATH = select_tenant()
+# background SQLite maintenance (checkpoint, optimize, vacuum); started once per process and team
+start_maintenance(DB_PATH)
 
 st.set_page_config(page_title="Darts Planner", layout="centered")
 
@@ -18,6 +22,8 @@ st.session_state.setdefault("user", None)
 # Page-specific editor versioning for calendar (page-prefixed as recommended)
 st.session_state.setdefault("calendar.matches_editor_version", 0)
 st.session_state.setdefault("calendar.matches_editor_key", f"matches_confirm_editor_{st.session_state['calendar.matches_editor_version']}")
+# drop stale editor keys and expired preview handles, and account this session's state size
+track_current_session()
 
 # Shared app title(shown in each page when enabled)
 # st.title("🏹 Darts Planner")
@@ -28,9 +34,12 @@ with st.sidebar:
     if cu:
         # Logged in - Show user info
         st.info(f"Welcome, {cu.get('nickname') or cu.get('username')}!")
+        if current_tenant() != DEFAULT_TENANT:
+            st.caption(f"Squadra: {current_tenant()}")
         
         if st.button("Logout", use_container_width=True):
-            # clear session and rerun
+            # revoke the server-side session, clear session state and rerun
+            end_session()
             for k in list(st.session_state.keys()):
                 st.session_state.pop(k, None)
             st.rerun()
@@ -60,6 +69,7 @@ if current_user():
     if is_admin():
         pages.append(st.Page("app_pages/admin.py", title="Amministrazione", icon="⚙️"))
         pages.append(st.Page("app_pages/audit.py", title="Cronologia", icon="📝"))
+        pages.append(st.Page("app_pages/analytics.py", title="Statistiche", icon="📊"))
 # Render navigation in sidebar (good for many pages)
 page = st.navigation(pages, position="top")
 
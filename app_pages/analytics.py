@@ -0,0 +1,5 @@
+import streamlit as st
+from views import analytics
+
+# Analytics page wrapper
+analytics.show()
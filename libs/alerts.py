@@ -0,0 +1,237 @@
+import argparse
+import logging
+import os
+import smtplib
+from datetime import date, datetime, timedelta
+from email.message import EmailMessage
+from typing import NamedTuple
+from libs import queries as q
+from libs.attendance import CONFIRM_THRESHOLD
+from libs.db import OUTBOX_FAILED, OUTBOX_PENDING, OUTBOX_SENT, get_conn, now_epoch
+from libs.tenancy import activate, tenant_for_path
+
+# Threshold alerts delivered through a notification outbox.
+#
+# The evaluator (maintenance job "alerts") enqueues a message per recipient when
+#   - a match within ALERT_LEAD_DAYS has fewer than CONFIRM_THRESHOLD
+#     confirmations (once per match and date), or
+#   - a cancellation takes an upcoming match below the threshold (once per
+#     cancellation; the events logged since the previous run are scanned from a
+#     watermark, like the analytics rollups).
+# Messages are rows of `outbox` with a unique dedup key, so evaluating again never
+# enqueues twice. The "outbox" job sends due messages in batches of OUTBOX_BATCH
+# over one transport connection, retries failures with exponential backoff and
+# gives up after OUTBOX_MAX_ATTEMPTS. Both run in the maintenance thread, so
+# saving a confirmation does no extra work.
+
+log = logging.getLogger(__name__)
+
+# comma-separated addresses alerted for every team (captains)
+ALERT_RECIPIENTS = [a.strip() for a in os.environ.get("BARBARAPP_ALERT_RECIPIENTS", "").split(",") if a.strip()]
+ALERT_LEAD_DAYS = int(os.environ.get("BARBARAPP_ALERT_LEAD_DAYS", 3))
+ALERT_INTERVAL = float(os.environ.get("BARBARAPP_ALERT_INTERVAL", 300))
+OUTBOX_INTERVAL = float(os.environ.get("BARBARAPP_OUTBOX_INTERVAL", 60))
+OUTBOX_BATCH = int(os.environ.get("BARBARAPP_OUTBOX_BATCH", 50))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("BARBARAPP_OUTBOX_MAX_ATTEMPTS", 6))
+# delay before the first retry, doubled after each failed attempt
+OUTBOX_RETRY_SECONDS = float(os.environ.get("BARBARAPP_OUTBOX_RETRY_SECONDS", 60))
+
+SMTP_HOST = os.environ.get("BARBARAPP_SMTP_HOST", "")
+SMTP_PORT = int(os.environ.get("BARBARAPP_SMTP_PORT", 587))
+SMTP_USER = os.environ.get("BARBARAPP_SMTP_USER", "")
+SMTP_PASSWORD = os.environ.get("BARBARAPP_SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.environ.get("BARBARAPP_SMTP_STARTTLS", "1") != "0"
+SMTP_SENDER = os.environ.get("BARBARAPP_SMTP_SENDER", "barbarapp@localhost")
+SMTP_TIMEOUT = float(os.environ.get("BARBARAPP_SMTP_TIMEOUT", 10))
+
+WATERMARK = "alerts"
+STATUS_LABELS = {OUTBOX_PENDING: "pending", OUTBOX_SENT: "sent", OUTBOX_FAILED: "failed"}
+
+
+class Message(NamedTuple):
+    id: int
+    recipient: str
+    subject: str
+    body: str
+
+
+class SmtpTransport:
+    """Sends each batch over a single SMTP connection."""
+
+    def __init__(self, host: str, port: int = 25, sender: str = SMTP_SENDER, user: str = None,
+                 password: str = None, starttls: bool = False, timeout: float = SMTP_TIMEOUT):
+        self.host, self.port, self.sender = host, port, sender
+        self.user, self.password, self.starttls, self.timeout = user, password, starttls, timeout
+
+    def send(self, messages: list) -> dict:
+        """Send messages; returns {id: error} for those not accepted by the server."""
+        sent, failed = set(), {}
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+                if self.starttls:
+                    smtp.starttls()
+                if self.user:
+                    smtp.login(self.user, self.password)
+                for m in messages:
+                    mail = EmailMessage()
+                    mail["From"], mail["To"], mail["Subject"] = self.sender, m.recipient, m.subject
+                    mail.set_content(m.body)
+                    try:
+                        smtp.send_message(mail)
+                        sent.add(m.id)
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                        failed[m.id] = str(e)
+        except (OSError, smtplib.SMTPException) as e:
+            # the connection failed: whatever was not accepted yet goes back to the queue
+            failed.update({m.id: str(e) for m in messages if m.id not in sent and m.id not in failed})
+        return failed
+
+
+class LogTransport:
+    """Writes messages to the log instead of sending them (no BARBARAPP_SMTP_HOST)."""
+
+    def send(self, messages: list) -> dict:
+        for m in messages:
+            log.info("alert to %s: %s", m.recipient, m.subject)
+        return {}
+
+
+_transport = None
+
+
+def set_transport(transport=None):
+    """Use transport (any object with send(messages) -> {id: error}) for deliveries; None restores the default."""
+    global _transport
+    _transport = transport
+
+
+def get_transport():
+    if _transport is not None:
+        return _transport
+    if SMTP_HOST:
+        return SmtpTransport(SMTP_HOST, SMTP_PORT, SMTP_SENDER, SMTP_USER or None, SMTP_PASSWORD or None,
+                             SMTP_STARTTLS)
+    return LogTransport()
+
+
+def _text(team: str, match, reason: str) -> tuple:
+    day = datetime.strptime(match["date"], "%Y-%m-%d").strftime("%d/%m/%Y")
+    subject = f"🔴 Partita {match['match_number']} del {day}: {match['confirmed']}/{CONFIRM_THRESHOLD} conferme"
+    body = "\n".join([
+        reason,
+        "",
+        f"Squadra: {team}",
+        f"Partita {match['match_number']} del {day} contro {match['opponents_team']} ({match['home_or_away']})",
+        f"Luogo: {match['place_display'] or '-'}",
+        f"Conferme: {match['confirmed']} su {CONFIRM_THRESHOLD} necessarie",
+    ])
+    return subject, body
+
+
+def evaluate(conn=None, today: date = None, recipients: list = None) -> dict:
+    """Enqueue alerts for matches below the threshold (one transaction); returns counts."""
+    recipients = ALERT_RECIPIENTS if recipients is None else recipients
+    today = today or date.today()
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        team = tenant_for_path(conn.execute("PRAGMA database_list").fetchone()[2])
+        # IMMEDIATE: a concurrent evaluator must not scan the same events
+        conn.execute("BEGIN IMMEDIATE")
+        row = q.fetch_one(conn, q.ROLLUP_WATERMARK, (WATERMARK,))
+        upto = q.fetch_one(conn, q.EVENTS_MAX_ID)["m"]
+        # first run: cancellations logged before alerts were enabled are not news
+        after = row["last_event_id"] if row else upto
+        below = q.fetch_all(conn, q.ALERT_MATCHES_BELOW, (
+            today.isoformat(), (today + timedelta(days=ALERT_LEAD_DAYS)).isoformat(), CONFIRM_THRESHOLD))
+        dropped = q.fetch_all(conn, q.ALERT_MATCHES_DROPPED, (
+            after, upto, today.isoformat(), CONFIRM_THRESHOLD, CONFIRM_THRESHOLD)) if upto > after else []
+        now = now_epoch()
+        rows = []
+        for key, match, reason in (
+            [(f"below:{m['id']}:{m['date']}", m, f"Mancano meno di {ALERT_LEAD_DAYS} giorni e la partita "
+              "non ha ancora abbastanza conferme.") for m in below]
+            + [(f"dropped:{m['id']}:{m['last_cancel']}", m, "Una cancellazione ha portato la partita "
+                "sotto la soglia di conferme.") for m in dropped]
+        ):
+            subject, body = _text(team, match, reason)
+            rows += [(f"{key}:{r}", match["id"], r, subject, body, now, now) for r in recipients]
+        enqueued = q.executemany(conn, q.OUTBOX_ENQUEUE, rows).rowcount if rows else 0
+        q.execute(conn, q.ROLLUP_WATERMARK_SET, (WATERMARK, max(upto, after)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own:
+            conn.close()
+    return {"alerts_below": len(below), "alerts_dropped": len(dropped), "outbox_enqueued": enqueued}
+
+
+def deliver(conn=None, now: int = None, transport=None) -> dict:
+    """Send one batch of due outbox messages and record the outcome; returns counts."""
+    now = now or now_epoch()
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        due = q.fetch_all(conn, q.OUTBOX_DUE, (now, OUTBOX_BATCH))
+        if not due:
+            return {"outbox_sent": 0, "outbox_retry": 0}
+        failed = (transport or get_transport()).send(
+            [Message(r["id"], r["recipient"], r["subject"], r["body"]) for r in due])
+        sent = [r["id"] for r in due if r["id"] not in failed]
+        if sent:
+            q.execute(conn, q.OUTBOX_MARK_SENT, (now_epoch(), q.json_list(sent)))
+        if failed:
+            q.executemany(conn, q.OUTBOX_MARK_RETRY, [
+                (failed[r["id"]][:500], now + int(OUTBOX_RETRY_SECONDS * 2 ** r["attempts"]), OUTBOX_MAX_ATTEMPTS, r["id"])
+                for r in due if r["id"] in failed
+            ])
+        conn.commit()
+    finally:
+        if own:
+            conn.close()
+    return {"outbox_sent": len(sent), "outbox_retry": len(failed)}
+
+
+def outbox_stats(conn=None) -> dict:
+    """Outbox messages per status, e.g. {"pending": 2, "sent": 10, "failed": 0}."""
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        counts = {r["status"]: r["c"] for r in q.fetch_all(conn, q.OUTBOX_COUNTS)}
+    finally:
+        if own:
+            conn.close()
+    return {label: counts.get(status, 0) for status, label in STATUS_LABELS.items()}
+
+
+def _scheduled_alerts(conn):
+    return evaluate(conn) if ALERT_RECIPIENTS else {"note": "no BARBARAPP_ALERT_RECIPIENTS"}
+
+
+def _scheduled_outbox(conn):
+    # own connection: sending can outlast the maintenance budget, whose progress
+    # handler on `conn` would then interrupt recording what was sent
+    own = get_conn(conn.execute("PRAGMA database_list").fetchone()[2])
+    try:
+        return deliver(own)
+    finally:
+        own.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m libs.alerts", description="Threshold alerts and outbox")
+    parser.add_argument("command", choices=["status", "evaluate", "deliver"])
+    parser.add_argument("--team", default="default")
+    args = parser.parse_args(argv)
+    activate(args.team)
+    if args.command == "evaluate":
+        print(evaluate())
+    elif args.command == "deliver":
+        print(deliver())
+    print(outbox_stats())
+
+
+if __name__ == "__main__":
+    main()
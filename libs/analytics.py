@@ -0,0 +1,109 @@
+import os
+from libs import frames, queries as q
+from libs.attendance import CONFIRM_THRESHOLD
+from libs.db import get_conn, get_read_conn
+
+# Attendance analytics.
+#
+# Rollup tables (per player per season, per match) are updated incrementally
+# from the attendance events logged since a stored watermark, so opening
+# the dashboard costs one GROUP BY over new events instead of a scan of the
+# whole history. The maintenance thread also folds new events periodically.
+
+# seasons run from September to August, labelled "2025/26"
+SEASON_START_MONTH = int(os.environ.get("BARBARAPP_SEASON_START_MONTH", 9))
+# a cancellation closer than this to the match day counts as late (a likely no-show)
+LATE_CANCEL_DAYS = float(os.environ.get("BARBARAPP_LATE_CANCEL_DAYS", 2))
+ROLLUP_INTERVAL = float(os.environ.get("BARBARAPP_ROLLUP_INTERVAL", 300))
+WATERMARK = "events"
+
+PLAYER_SEASON_SCHEMA = {
+    "user_id": frames.INT,
+    "player": frames.TEXT,
+    "season": frames.TEXT,
+    "confirmations": frames.INT,
+    "cancellations": frames.INT,
+    "late_cancellations": frames.INT,
+}
+MATCH_SCHEMA = {
+    "match_id": frames.INT,
+    "match_number": frames.INT,
+    "date": frames.TEXT,
+    "opponents_team": frames.CATEGORY,
+    "home_or_away": frames.CATEGORY,
+    "confirmations": frames.INT,
+    "cancellations": frames.INT,
+}
+
+
+def season_of(day) -> str:
+    """Season label of an ISO date, e.g. '2025-10-03' -> '2025/26'."""
+    try:
+        year, month = int(str(day)[:4]), int(str(day)[5:7])
+    except (TypeError, ValueError):
+        return None
+    start = year if month >= SEASON_START_MONTH else year - 1
+    return f"{start}/{(start + 1) % 100:02d}"
+
+
+def season_series(dates):
+    """Vectorized season_of for a pandas Series of ISO dates."""
+    import pandas as pd
+    d = pd.to_datetime(dates, errors="coerce")
+    start = d.dt.year - (d.dt.month < SEASON_START_MONTH).astype("Int64")
+    return start.astype("Int64").astype(str) + "/" + ((start + 1) % 100).astype("Int64").astype(str).str.zfill(2)
+
+
+def refresh_rollups(conn=None) -> dict:
+    """Fold attendance events newer than the watermark into the rollups (one transaction)."""
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        conn.create_function("season", 1, season_of, deterministic=True)
+        # IMMEDIATE: two refreshers (page, maintenance, another worker) must not fold the same events
+        conn.execute("BEGIN IMMEDIATE")
+        row = q.fetch_one(conn, q.ROLLUP_WATERMARK, (WATERMARK,))
+        after = row["last_event_id"] if row else 0
+        upto = q.fetch_one(conn, q.EVENTS_MAX_ID)["m"]
+        if upto > after:
+            q.execute(conn, q.ROLLUP_PLAYER_SEASON_APPLY, (LATE_CANCEL_DAYS, after, upto))
+            q.execute(conn, q.ROLLUP_MATCH_APPLY, (after, upto))
+            q.execute(conn, q.ROLLUP_WATERMARK_SET, (WATERMARK, upto))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own:
+            conn.close()
+    return {"events_scanned": max(0, upto - after), "watermark": max(upto, after)}
+
+
+def _scheduled_rollups(conn):
+    return refresh_rollups(conn)
+
+
+def load_rollups():
+    """(players, matches) DataFrames with derived columns, shaped with vectorized pandas.
+
+    players: one row per player and season with confirmed (net), rate over the
+    season's matches, cancellations and late cancellations.
+    matches: one row per match with its season, confirmed count and whether it
+    reached CONFIRM_THRESHOLD.
+    """
+    conn = get_read_conn()
+    try:
+        players = frames.typed_frame(q.fetch_all(conn, q.ROLLUP_PLAYER_SEASONS), PLAYER_SEASON_SCHEMA)
+        matches = frames.typed_frame(q.fetch_all(conn, q.ROLLUP_MATCHES), MATCH_SCHEMA)
+    finally:
+        conn.close()
+
+    matches["season"] = season_series(matches["date"])
+    matches["confirmed"] = (matches["confirmations"] - matches["cancellations"]).clip(lower=0)
+    matches["reached"] = matches["confirmed"] >= CONFIRM_THRESHOLD
+
+    per_season = matches.groupby("season").size().rename("season_matches")
+    players = players.join(per_season, on="season")
+    players["confirmed"] = (players["confirmations"] - players["cancellations"]).clip(lower=0)
+    players["rate"] = (players["confirmed"] / players["season_matches"]).fillna(0.0).clip(upper=1.0)
+    return players, matches
@@ -0,0 +1,41 @@
+from libs import coherence, queries as q
+from libs.db import EVENT_CANCELLED, EVENT_CONFIRMED, STATUS_CONFIRMED
+from libs.events import EventBatch
+
+# Attendance writes shared by the calendar page and the JSON API.
+#
+# A confirmation is an `attendance` row with status STATUS_CONFIRMED; cancelling
+# deletes it. Every change is recorded in the event log (libs/events.py).
+
+# confirmations a match needs to be playable (green mark on the calendar)
+CONFIRM_THRESHOLD = 4
+
+
+def set_confirmation(conn, events: EventBatch, user: dict, match_id: int, confirmed: bool):
+    """Confirm or cancel user's attendance to match_id within the caller's transaction.
+
+    Returns 'inserted', 'deleted' or None when nothing changed; the change is
+    added to events. The caller flushes events and commits (and bumps the
+    "attendance" generation, see save_confirmations).
+    """
+    exists = q.fetch_one(conn, q.ATTENDANCE_CONFIRMED_ID, (match_id, user['id']))
+    if confirmed and not exists:
+        q.execute(conn, q.ATTENDANCE_INSERT, (match_id, user['id'], STATUS_CONFIRMED, events.ts, user['id'], user.get('nickname')))
+        events.add(EVENT_CONFIRMED, entity=match_id, subject=user['id'])
+        return 'inserted'
+    if not confirmed and exists:
+        q.execute(conn, q.ATTENDANCE_DELETE, (exists['id'],))
+        events.add(EVENT_CANCELLED, entity=match_id, subject=user['id'])
+        return 'deleted'
+    return None
+
+
+def save_confirmations(conn, user: dict, wanted: dict):
+    """Apply {match_id: confirmed} for user and commit; returns (inserted, deleted)."""
+    with EventBatch(conn, actor=user['id']) as events:
+        results = [set_confirmation(conn, events, user, int(mid), bool(want)) for mid, want in wanted.items()]
+    inserted, deleted = results.count('inserted'), results.count('deleted')
+    if inserted or deleted:
+        coherence.bump(conn, coherence.ATTENDANCE)
+    conn.commit()
+    return inserted, deleted
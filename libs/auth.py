@@ -1,8 +1,28 @@
 from passlib.hash import argon2
+import ipaddress
+import os
 import secrets
-import sqlite3
-from libs.db import get_conn
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from libs import coherence, queries as q
+from libs.db import (
+    EVENT_USER_CREATED, EVENT_USER_DELETED, EVENT_USER_PASSWORD_RESET, EVENT_USER_ROLE_CHANGED,
+    get_conn, get_read_conn, now_epoch,
+)
+from libs.events import EventBatch
+from libs.sessions import create_session, resolve_session, revoke_session, revoke_user_sessions, revoke_users_sessions
+from libs.sessions import RESUME_TTL, exchange_resume, issue_resume, resume_tenant, token_tenant
+from libs.state import slim_user
+from libs.tenancy import TENANT_PARAM, activate, current_tenant, default_tenant, is_served, tenant_exists
+
+# query parameter carrying a one-time resume token (libs/sessions.py), so a
+# reconnect or a new tab can resume the session without asking for the password
+# again; the session token itself only lives in st.session_state
+SESSION_PARAM = "s"
+
+
 def hash_password(password: str) -> str:
     return argon2.hash(password)
 
@@ -15,58 +35,530 @@ def generate_temp_password(length: int = 10) -> str:
     return secrets.token_urlsafe(length)[:length]
 
 
+def hash_passwords(passwords, max_workers: int = None) -> list:
+    """Hash many passwords in parallel across cores (argon2 is CPU bound).
+
+    Small batches are hashed inline; spinning up a process pool is not worth it.
+    """
+    passwords = list(passwords)
+    if len(passwords) < 4:
+        return [hash_password(p) for p in passwords]
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(hash_password, passwords, chunksize=chunksize))
+
+
 def create_user(username: str, password: str, role: str = "giocatore"):
     conn = get_conn()
     try:
         # prevent duplicate usernames
-        existing = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+        existing = q.fetch_one(conn, q.USER_ID_BY_USERNAME, (username,))
         if existing:
             return existing["id"]
-        now = datetime.utcnow().isoformat()
+        now = now_epoch()
         pw = hash_password(password)
-        cur = conn.execute(
-            "INSERT INTO users (username, password_hash, role, created_at, updated_at) VALUES (?,?,?,?,?)",
-            (username, pw, role, now, now),
-        )
+        cur = q.execute(conn, q.USER_INSERT, (username, pw, None, role, 0, now, now))
+        with EventBatch(conn, ts=now) as events:
+            events.add(EVENT_USER_CREATED, entity=cur.lastrowid, data={"role": role})
         conn.commit()
         return cur.lastrowid
     finally:
         conn.close()
 
 
-def find_user_by_username(username: str):
+def create_users_bulk(entries, admin_id: int = None) -> list:
+    """Create many users at once with generated temporary passwords.
+
+    entries is a list of dicts with `username`, `role` and `nickname`. Usernames
+    that already exist (or repeat within the batch) are skipped. Passwords are
+    hashed in parallel, then all users and their events are inserted
+    with executemany in a single transaction.
+
+    Returns one dict per entry with `username`, `role`, `nickname`,
+    `temp_password` and `status` ('created' or 'exists').
+    """
+    results = []
+    seen = set()
+    for e in entries:
+        username = (e.get("username") or "").strip()
+        results.append({
+            "username": username,
+            "role": e.get("role") or "giocatore",
+            "nickname": e.get("nickname") or None,
+            "temp_password": None,
+            "status": "exists" if username in seen else "created",
+        })
+        seen.add(username)
+
     conn = get_conn()
-    row = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    try:
+        existing = {
+            r["username"] for r in q.fetch_all(conn, q.USERNAMES_EXISTING, (q.json_list(sorted(seen)),))
+        }
+        todo = [r for r in results if r["status"] == "created" and r["username"] not in existing]
+        for r in results:
+            if r["username"] in existing:
+                r["status"] = "exists"
+        if not todo:
+            return results
+
+        for r in todo:
+            r["temp_password"] = generate_temp_password()
+        hashes = hash_passwords([r["temp_password"] for r in todo])
+
+        now = now_epoch()
+        q.executemany(
+            conn, q.USER_INSERT,
+            [(r["username"], h, r["nickname"], r["role"], 1, now, now) for r, h in zip(todo, hashes)],
+        )
+        ids = dict(q.fetch_all(conn, q.USER_IDS_BY_USERNAMES, (q.json_list(r["username"] for r in todo),)))
+        with EventBatch(conn, actor=admin_id, ts=now) as events:
+            for r in todo:
+                events.add(EVENT_USER_CREATED, entity=ids[r["username"]], data={"role": r["role"], "source": "bulk"})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return results
+
+
+def find_user_by_username(username: str):
+    conn = get_read_conn()
+    row = q.fetch_one(conn, q.USER_BY_USERNAME, (username,))
     conn.close()
     return dict(row) if row else None
 
 
 def get_user_by_id(user_id: int):
-    conn = get_conn()
-    row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    conn = get_read_conn()
+    row = q.fetch_one(conn, q.USER_BY_ID, (user_id,))
     conn.close()
     return dict(row) if row else None
 
 
 def list_users():
-    conn = get_conn()
-    rows = conn.execute("SELECT id, username, role, nickname, created_at FROM users ORDER BY id").fetchall()
+    conn = get_read_conn()
+    rows = q.fetch_all(conn, q.USERS_LIST)
     conn.close()
     return [dict(r) for r in rows]
 
 
 def update_password(user_id: int, new_password: str):
     conn = get_conn()
-    now = datetime.utcnow().isoformat()
+    now = now_epoch()
     pw = hash_password(new_password)
-    conn.execute("UPDATE users SET password_hash = ?, force_password_change = 0, updated_at = ? WHERE id = ?", (pw, now, user_id))
+    q.execute(conn, q.USER_SET_PASSWORD, (pw, 0, now, user_id))
+    # a password change invalidates every existing login of that user
+    revoke_user_sessions(user_id, conn)
     conn.commit()
     conn.close()
 
 
+def _user_filter(query: str, role: str) -> tuple:
+    """Parameters for the fixed users_search statements."""
+    text = (query or "").strip()
+    pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return (text, pattern, pattern, role, role)
+
+
+def count_users(query: str = "", role: str = None) -> int:
+    conn = get_read_conn()
+    try:
+        return q.fetch_one(conn, q.USERS_SEARCH_COUNT, _user_filter(query, role))["c"]
+    finally:
+        conn.close()
+
+
+def search_users(query: str = "", role: str = None, limit: int = 50, offset: int = 0):
+    """Filter users by username/nickname substring and role, paginated in SQL."""
+    conn = get_read_conn()
+    try:
+        rows = q.fetch_all(conn, q.USERS_SEARCH, _user_filter(query, role) + (limit, offset))
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+
+def _users_by_ids(conn, user_ids):
+    return [dict(r) for r in q.fetch_all(conn, q.USERS_BY_IDS, (q.json_list(int(u) for u in user_ids),))]
+
+
+def reset_passwords_bulk(user_ids, admin_id: int = None) -> list:
+    """Reset passwords of several users in one transaction.
+
+    Temporary passwords are hashed in parallel; existing sessions of those users
+    are revoked. Returns dicts with `id`, `username` and `temp_password`.
+    """
+    conn = get_conn()
+    try:
+        users = _users_by_ids(conn, user_ids)
+        if not users:
+            return []
+        for u in users:
+            u["temp_password"] = generate_temp_password()
+        hashes = hash_passwords([u["temp_password"] for u in users])
+        now = now_epoch()
+        q.executemany(conn, q.USER_SET_PASSWORD, [(h, 1, now, u["id"]) for u, h in zip(users, hashes)])
+        coherence.bump(conn, coherence.USERS)
+        revoke_users_sessions([u["id"] for u in users], conn)
+        with EventBatch(conn, actor=admin_id, ts=now) as events:
+            for u in users:
+                events.add(EVENT_USER_PASSWORD_RESET, entity=u["id"])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return users
+
+
+def _remaining_admins(conn, excluded_ids) -> int:
+    return q.fetch_one(conn, q.ADMINS_REMAINING, (q.json_list(int(u) for u in excluded_ids),))["c"]
+
+
+def delete_users_bulk(user_ids, admin_id: int = None):
+    """Delete several users in one transaction.
+
+    Refuses to delete the acting admin or to remove every administrator.
+    Returns (deleted_users, error_message).
+    """
+    conn = get_conn()
+    try:
+        users = _users_by_ids(conn, user_ids)
+        if admin_id is not None and any(u["id"] == admin_id for u in users):
+            return [], "Non puoi eliminare il tuo account mentre sei loggato."
+        if any(u["role"] == "admin" for u in users) and _remaining_admins(conn, [u["id"] for u in users]) == 0:
+            return [], "Impossibile eliminare l'ultimo amministratore."
+        ids = [u["id"] for u in users]
+        q.execute(conn, q.USERS_DELETE, (q.json_list(ids),))
+        revoke_users_sessions(ids, conn)
+        coherence.bump(conn, coherence.USERS)
+        # the username is kept in the event: the users row is gone
+        with EventBatch(conn, actor=admin_id) as events:
+            for u in users:
+                events.add(EVENT_USER_DELETED, entity=u["id"], data={"username": u["username"]})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return users, None
+
+
+def set_role_bulk(user_ids, role: str, admin_id: int = None):
+    """Change the role of several users in one transaction.
+
+    Refuses to demote every administrator. Returns (changed_users, error_message).
+    """
+    conn = get_conn()
+    try:
+        users = [u for u in _users_by_ids(conn, user_ids) if u["role"] != role]
+        if admin_id is not None and any(u["id"] == admin_id for u in users):
+            return [], "Non puoi cambiare il tuo ruolo mentre sei loggato."
+        if role != "admin" and any(u["role"] == "admin" for u in users):
+            if _remaining_admins(conn, [u["id"] for u in users]) == 0:
+                return [], "Impossibile rimuovere l'ultimo amministratore."
+        if not users:
+            return [], None
+        now = now_epoch()
+        q.executemany(conn, q.USER_SET_ROLE, [(role, now, u["id"]) for u in users])
+        coherence.bump(conn, coherence.USERS)
+        with EventBatch(conn, actor=admin_id, ts=now) as events:
+            for u in users:
+                events.add(EVENT_USER_ROLE_CHANGED, entity=u["id"], data={"from": u["role"], "to": role})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return users, None
+
+
+# Login throttling.
+#
+# Every login attempt costs an argon2 verification, so attempts are rate limited
+# with token buckets per username and per client before any hashing happens.
+# Buckets live in a bounded in-memory LRU that refuses throttled attempts
+# without a write. Allowed attempts then take their tokens in the
+# `login_throttle` table with one conditional upsert per bucket, so processes
+# sharing the database cannot overspend a bucket and a restart does not hand out
+# fresh budgets. A cached bucket another process has spent is corrected by the
+# failed take itself; only an admin unlock (reset) bumps the "login_throttle"
+# generation, so other processes drop their cached buckets of the team.
+
+LOGIN_USER_CAPACITY = float(os.environ.get("BARBARAPP_LOGIN_USER_BURST", 5))
+LOGIN_USER_REFILL = float(os.environ.get("BARBARAPP_LOGIN_USER_REFILL", 1 / 60))  # tokens per second
+LOGIN_CLIENT_CAPACITY = float(os.environ.get("BARBARAPP_LOGIN_CLIENT_BURST", 20))
+LOGIN_CLIENT_REFILL = float(os.environ.get("BARBARAPP_LOGIN_CLIENT_REFILL", 1 / 6))
+# at most this many argon2 verifications run at once; the rest wait briefly or are refused
+LOGIN_HASH_SLOTS = int(os.environ.get("BARBARAPP_LOGIN_HASH_SLOTS", max(1, (os.cpu_count() or 2) // 2)))
+
+# reverse proxies (addresses or networks, comma-separated) whose X-Forwarded-For
+# and X-Real-IP headers are believed, e.g. "127.0.0.1,::1" behind deploy/nginx.conf
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False)
+    for p in os.environ.get("BARBARAPP_TRUSTED_PROXIES", "").split(",") if p.strip()
+]
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_address(peer: str, headers=None) -> str:
+    """Address of the client behind a connection from peer, keying its login throttle bucket.
+
+    Forwarding headers are only read when peer is a trusted proxy: the
+    X-Forwarded-For hops are then walked from the nearest one and the first
+    address that is not a trusted proxy is the client. Whatever the client wrote
+    further left is ignored, so it cannot choose its own bucket.
+    """
+    if not peer:
+        return "unknown"
+    if headers is None or not _is_trusted_proxy(peer):
+        return peer
+    hops = [h.strip() for h in (headers.get("X-Forwarded-For") or "").split(",") if h.strip()]
+    if not hops and headers.get("X-Real-IP"):
+        hops = [headers.get("X-Real-IP").strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+class TokenBucketLimiter:
+    """Token buckets kept in a bounded LRU and persisted in `login_throttle`."""
+
+    def __init__(self, capacity: float, refill_per_sec: float, max_entries: int = 10000):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def _load(self, key: str):
+        conn = get_read_conn()
+        try:
+            row = q.fetch_one(conn, q.THROTTLE_GET, (key,))
+        finally:
+            conn.close()
+        return [row["tokens"], row["updated_at"]] if row else [self.capacity, time.time()]
+
+    def _bucket(self, key: str, now: float):
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._load(key)
+            self._buckets[key] = b
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        b[0] = min(self.capacity, b[0] + (now - b[1]) * self.refill_per_sec)
+        b[1] = now
+        return b
+
+    def try_consume(self, key: str) -> bool:
+        """Take one token from key if it has one; False leaves the bucket untouched."""
+        with self._lock:
+            b = self._bucket(key, time.time())
+            if b[0] < 1:
+                return False
+            b[0] -= 1
+            return True
+
+    def refund(self, key: str):
+        """Give back a token taken by try_consume() for an attempt that did not happen."""
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is not None:
+                b[0] = min(self.capacity, b[0] + 1)
+
+    def take_persisted(self, conn, key: str):
+        """Take one token from the persisted bucket in conn's transaction (atomic across processes).
+
+        Returns the bucket after the take as [tokens, updated_at], or None when it is empty.
+        """
+        row = q.fetch_one(conn, q.THROTTLE_TAKE, (key, self.capacity, time.time(), self.refill_per_sec,
+                                                  self.refill_per_sec))
+        return [row["tokens"], row["updated_at"]] if row else None
+
+    def store(self, key: str, bucket=None):
+        """Replace the cached bucket of key with a persisted one; None reloads it on next use."""
+        with self._lock:
+            if bucket is None:
+                self._buckets.pop(key, None)
+            elif key in self._buckets:
+                self._buckets[key] = bucket
+
+    def forget(self, prefix: str = ""):
+        """Drop cached buckets whose key starts with prefix; they reload from the table."""
+        with self._lock:
+            for key in [k for k in self._buckets if k.startswith(prefix)]:
+                del self._buckets[key]
+
+    def reset(self, key: str):
+        with self._lock:
+            self._buckets.pop(key, None)
+        conn = get_conn()
+        try:
+            q.execute(conn, q.THROTTLE_DELETE, (key,))
+            coherence.bump(conn, coherence.LOGIN_THROTTLE)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+_user_limiter = TokenBucketLimiter(LOGIN_USER_CAPACITY, LOGIN_USER_REFILL)
+_client_limiter = TokenBucketLimiter(LOGIN_CLIENT_CAPACITY, LOGIN_CLIENT_REFILL)
+_hash_slots = threading.BoundedSemaphore(LOGIN_HASH_SLOTS)
+_dummy_hash = None
+
+
+def _take_persisted(takes) -> bool:
+    """Take a token from every (limiter, key) in the table, all or none, in one transaction."""
+    conn = get_conn()
+    try:
+        buckets = []
+        for limiter, key in takes:
+            bucket = limiter.take_persisted(conn, key)
+            if bucket is None:
+                # another process spent the budget since this one loaded it
+                conn.rollback()
+                break
+            buckets.append(bucket)
+        else:
+            conn.commit()
+    finally:
+        conn.close()
+    taken = len(buckets) == len(takes)
+    for (limiter, key), bucket in zip(takes, buckets if taken else [None] * len(takes)):
+        limiter.store(key, bucket)
+    return taken
+
+
+def _get_dummy_hash() -> str:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_urlsafe(16))
+    return _dummy_hash
+
+
+def authenticate(username: str, password: str, client: str = None):
+    """Check credentials behind the login rate limiter.
+
+    Returns (user, error) where error is None on success, 'throttled' when the
+    username or client is out of attempts (or all hashing slots are busy) and
+    'invalid' for wrong credentials. Throttled attempts are refused before any
+    hashing or database write; unknown usernames are verified against a dummy
+    hash so they cost the same as a wrong password.
+    """
+    username = (username or "").strip()
+    # buckets are persisted in the team's database, so their keys are per team too
+    tenant = current_tenant()
+    user_key = f"{tenant}:user:{username.lower()}"
+    client_key = f"{tenant}:client:{client or 'unknown'}"
+    if coherence.changed(coherence.LOGIN_THROTTLE):
+        _user_limiter.forget(f"{tenant}:")
+        _client_limiter.forget(f"{tenant}:")
+    # check-and-take in memory first, so throttled attempts cost no database write,
+    # then in the table, which stays authoritative when several processes share it
+    if not _client_limiter.try_consume(client_key):
+        return None, "throttled"
+    if not _user_limiter.try_consume(user_key):
+        _client_limiter.refund(client_key)
+        return None, "throttled"
+    if not _take_persisted([(_client_limiter, client_key), (_user_limiter, user_key)]):
+        return None, "throttled"
+
+    if not _hash_slots.acquire(timeout=2):
+        return None, "throttled"
+    try:
+        user = find_user_by_username(username) if username else None
+        if user is None:
+            verify_password(password or "", _get_dummy_hash())
+            return None, "invalid"
+        if not verify_password(password or "", user["password_hash"]):
+            return None, "invalid"
+    finally:
+        _hash_slots.release()
+    _user_limiter.reset(user_key)
+    return user, None
+
+
+def select_tenant() -> str:
+    """Activate the team for this run and return its database path.
+
+    A logged-in session always stays in the team its token was issued for;
+    before login the team comes from ?team= (or the last choice in this
+    browser session), falling back to the first team served by this process.
+    """
+    import streamlit as st
+    token = st.session_state.get("session_token")
+    resume = st.query_params.get(SESSION_PARAM)
+    tenant = token_tenant(token) if token else resume_tenant(resume) if resume else None
+    if tenant is None:
+        tenant = st.query_params.get(TENANT_PARAM) or st.session_state.get("tenant")
+        if not tenant or not is_served(tenant) or not tenant_exists(tenant):
+            tenant = default_tenant()
+    st.session_state.tenant = tenant
+    return activate(tenant)
+
+
+def public_user(user: dict) -> dict:
+    """Return the slim user record kept in session state (no secrets)."""
+    return slim_user(user)
+
+
+def start_session(user: dict):
+    """Open a server-side session for an authenticated user."""
+    import streamlit as st
+    token = create_session(user["id"])
+    st.session_state.user = public_user(user)
+    st.session_state.session_token = token
+    # a resume token still in the URL points at the previous session (revoked on a password change)
+    previous = st.session_state.pop("resume_token", None)
+    st.session_state.pop("_resume_issued_at", None)
+    _keep_resume_token(token, previous)
+
+
+def end_session():
+    import streamlit as st
+    token = st.session_state.pop("session_token", None)
+    if token:
+        revoke_session(token)
+    st.session_state.pop("resume_token", None)
+    st.session_state.pop("_resume_issued_at", None)
+    st.query_params.pop(SESSION_PARAM, None)
+
+
+def _keep_resume_token(token: str, previous: str = None):
+    """Keep a valid resume token for session `token` in the URL, renewed every RESUME_TTL / 2.
+
+    previous is a resume token of another session to revoke along with issuing one.
+    """
+    import streamlit as st
+    resume = st.session_state.get("resume_token")
+    if not resume or time.time() - st.session_state.get("_resume_issued_at", 0) > RESUME_TTL / 2:
+        resume = issue_resume(token, previous=resume or previous)
+        st.session_state.resume_token = resume
+        st.session_state._resume_issued_at = time.time()
+    # page switches drop query params
+    if st.query_params.get(SESSION_PARAM) != resume:
+        st.query_params[SESSION_PARAM] = resume
+
+
 def require_login():
     import streamlit as st
-    if "user" not in st.session_state:
+    if not current_user():
         st.warning("Please log in")
         from views import login
         login.show()
@@ -74,8 +566,43 @@ def require_login():
 
 
 def current_user():
+    """Return the logged-in user, resuming or invalidating the session token.
+
+    Tokens are resolved through the in-memory session cache, so this is cheap
+    enough to call several times per rerun.
+    """
     import streamlit as st
-    return st.session_state.get("user")
+    token = st.session_state.get("session_token")
+    if not token:
+        # a new browser session: exchange the resume token in the URL, once
+        resume = st.query_params.get(SESSION_PARAM)
+        token = exchange_resume(resume) if resume else None
+        if token is None:
+            st.query_params.pop(SESSION_PARAM, None)
+            return None
+        st.session_state.session_token = token
+        st.session_state.pop("resume_token", None)
+    user_id = resolve_session(token)
+    if user_id is None:
+        # expired, revoked (password change, deleted user) or forged
+        st.session_state.user = None
+        st.session_state.pop("session_token", None)
+        st.session_state.pop("resume_token", None)
+        st.query_params.pop(SESSION_PARAM, None)
+        return None
+    user = st.session_state.get("user")
+    # reload the record when any user changed (role, nickname), possibly in another process
+    users_generation = coherence.generation(coherence.USERS)
+    if not user or user.get("id") != user_id or st.session_state.get("_users_generation") != users_generation:
+        row = get_user_by_id(user_id)
+        if not row:
+            return None
+        user = public_user(row)
+        st.session_state.user = user
+        st.session_state.session_token = token
+        st.session_state._users_generation = users_generation
+    _keep_resume_token(token)
+    return user
 
 
 def is_admin():
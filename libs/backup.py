@@ -0,0 +1,191 @@
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from libs.db import DEFAULT_DB, get_db_path
+
+# Online backups built on the sqlite3 backup API.
+#
+# Pages are copied a few at a time with a short sleep in between, so writers on
+# the live database are never blocked for long (copying the file while WAL
+# writers are active is not safe). Snapshots are verified with
+# PRAGMA integrity_check before they are kept, and rotated. Team databases
+# (libs/tenancy.py) get their own subfolder so rotation never mixes teams.
+
+BACKUP_DIR = Path(os.environ.get("BARBARAPP_BACKUP_DIR", DEFAULT_DB.parent / "backups"))
+BACKUP_KEEP = int(os.environ.get("BARBARAPP_BACKUP_KEEP", 7))
+BACKUP_INTERVAL = float(os.environ.get("BARBARAPP_BACKUP_INTERVAL", 86400))
+BACKUP_PAGES_PER_STEP = int(os.environ.get("BARBARAPP_BACKUP_PAGES_PER_STEP", 64))
+BACKUP_STEP_SLEEP = float(os.environ.get("BARBARAPP_BACKUP_STEP_SLEEP", 0.005))
+SNAPSHOT_PREFIX = "data-"
+
+
+def backup_db(dest, source=None, pages: int = BACKUP_PAGES_PER_STEP, sleep: float = BACKUP_STEP_SLEEP) -> dict:
+    """Copy the database into dest page by page and report duration/throughput.
+
+    source can be a path or an open sqlite3 connection (the maintenance thread
+    passes its own).
+    """
+    own = not isinstance(source, sqlite3.Connection)
+    src = sqlite3.connect(source or get_db_path()) if own else source
+    dst = sqlite3.connect(str(dest))
+    steps = 0
+
+    def _progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+
+    started = time.perf_counter()
+    try:
+        src.backup(dst, pages=pages, progress=_progress, sleep=sleep)
+        page_size = dst.execute("PRAGMA page_size").fetchone()[0]
+        page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        dst.close()
+        if own:
+            src.close()
+    duration = time.perf_counter() - started
+    size = page_count * page_size
+    return {
+        "path": str(dest),
+        "pages": page_count,
+        "bytes": size,
+        "steps": steps,
+        "duration_s": round(duration, 3),
+        "throughput_mb_s": round(size / 1e6 / duration, 2) if duration > 0 else None,
+    }
+
+
+def backup_dir_for(db_path) -> Path:
+    """Snapshot folder of a database: BACKUP_DIR for data/data.db, BACKUP_DIR/<name> otherwise."""
+    p = Path(db_path).resolve()
+    return BACKUP_DIR if p == DEFAULT_DB.resolve() else BACKUP_DIR / p.stem
+
+
+def _source_path(source) -> str:
+    if isinstance(source, sqlite3.Connection):
+        return source.execute("PRAGMA database_list").fetchone()[2]
+    return str(source or get_db_path())
+
+
+def verify_snapshot(path) -> str:
+    """Run PRAGMA integrity_check on a snapshot; returns 'ok' or the first problem."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def list_snapshots(backup_dir=None) -> list:
+    """Snapshot paths, oldest first (default: those of the active database)."""
+    d = Path(backup_dir or backup_dir_for(get_db_path()))
+    return sorted(d.glob(f"{SNAPSHOT_PREFIX}*.db")) if d.exists() else []
+
+
+def rotate_snapshots(keep: int = BACKUP_KEEP, backup_dir=None) -> list:
+    """Delete all but the newest `keep` snapshots (keep <= 0 deletes nothing)."""
+    snapshots = list_snapshots(backup_dir)
+    removed = snapshots[:-keep] if keep > 0 else []
+    for p in removed:
+        p.unlink(missing_ok=True)
+    return removed
+
+
+def snapshot(source=None, keep: int = BACKUP_KEEP, backup_dir=None) -> dict:
+    """Take a verified, timestamped snapshot and rotate old ones.
+
+    The copy is written under a temporary name and only renamed into place once
+    integrity_check passes, so a failed run never replaces a good snapshot.
+    """
+    d = Path(backup_dir or backup_dir_for(_source_path(source)))
+    d.mkdir(parents=True, exist_ok=True)
+    name = f"{SNAPSHOT_PREFIX}{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}.db"
+    tmp = d / f".{name}.partial"
+    stats = backup_db(tmp, source=source)
+    stats["integrity"] = verify_snapshot(tmp)
+    if stats["integrity"] != "ok":
+        tmp.unlink(missing_ok=True)
+        raise RuntimeError(f"snapshot failed integrity check: {stats['integrity']}")
+    final = d / name
+    tmp.rename(final)
+    stats["path"] = str(final)
+    stats["rotated"] = [str(p) for p in rotate_snapshots(keep, d)]
+    return stats
+
+
+def restore_db(snapshot_path, path=None, safety_snapshot: bool = True) -> dict:
+    """Restore the live database from a snapshot through the backup API.
+
+    The snapshot is verified first and, unless disabled, the current database is
+    snapshotted so a restore can itself be undone. Running app processes see the
+    restored content on their next query.
+    """
+    snapshot_path = Path(snapshot_path)
+    if not snapshot_path.exists():
+        raise FileNotFoundError(snapshot_path)
+    integrity = verify_snapshot(snapshot_path)
+    if integrity != "ok":
+        raise RuntimeError(f"snapshot failed integrity check: {integrity}")
+    target = path or get_db_path()
+    safety = None
+    if safety_snapshot and Path(target).exists():
+        # keep=0 skips rotation, which could otherwise delete the snapshot being restored
+        safety = snapshot(source=target, keep=0)
+    src = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    started = time.perf_counter()
+    try:
+        # copy in one step: the target is locked for the duration, but readers
+        # never observe a half-restored database
+        src.backup(dst, pages=-1)
+    finally:
+        src.close()
+        dst.close()
+    return {
+        "restored_from": str(snapshot_path),
+        "duration_s": round(time.perf_counter() - started, 3),
+        "safety_snapshot": safety["path"] if safety else None,
+    }
+
+
+def _scheduled_snapshot(conn):
+    stats = snapshot(source=conn)
+    return {
+        "snapshot": stats["path"],
+        "snapshot_bytes": stats["bytes"],
+        "snapshot_throughput_mb_s": stats["throughput_mb_s"],
+        "integrity": stats["integrity"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m libs.backup", description="Online SQLite backups")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("snapshot", help="take a verified snapshot and rotate old ones")
+    sub.add_parser("list", help="list snapshots")
+    v = sub.add_parser("verify", help="run integrity_check on a snapshot")
+    v.add_argument("file")
+    r = sub.add_parser("restore", help="restore the database from a snapshot")
+    r.add_argument("file", nargs="?", help="snapshot to restore (default: latest)")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "snapshot":
+        print(snapshot())
+    elif args.cmd == "list":
+        for p in list_snapshots():
+            print(f"{p}  {p.stat().st_size} bytes")
+    elif args.cmd == "verify":
+        print(verify_snapshot(args.file))
+    elif args.cmd == "restore":
+        snapshots = list_snapshots()
+        target = args.file or (snapshots[-1] if snapshots else None)
+        if not target:
+            parser.error("no snapshots found")
+        print(restore_db(target))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from libs import queries as q
+from libs.db import get_db_path, get_read_conn
+
+# Cross-process cache coherence.
+#
+# When several app processes share one database, an in-process cache (session
+# cache, throttle buckets, the user record kept in session state) can go stale
+# after another process writes. Writers bump a named generation counter in the
+# `cache_generations` table inside the same transaction as their change; readers
+# compare it with the generation they last saw and drop their cached entries
+# when it moved. The counters are read at most every COHERENCE_POLL seconds per
+# process and database, so a change is visible everywhere within that delay.
+
+COHERENCE_POLL = float(os.environ.get("BARBARAPP_COHERENCE_POLL", 0.25))
+
+# generation names
+SESSIONS = "sessions"
+USERS = "users"
+LOGIN_THROTTLE = "login_throttle"
+MATCHES = "matches"
+ATTENDANCE = "attendance"
+
+_snapshots = {}  # db path -> (read_at, {name: generation})
+_seen = {}  # (db path, name) -> generation last acted upon by this process
+_lock = threading.Lock()
+
+
+def bump(conn, *names):
+    """Advance the generations of names; commits with the caller's transaction."""
+    q.executemany(conn, q.GENERATION_BUMP, [(n,) for n in names])
+
+
+def generations(path: str = None) -> dict:
+    """Current generations of a database, re-read at most every COHERENCE_POLL seconds."""
+    p = path or get_db_path()
+    now = time.monotonic()
+    with _lock:
+        snap = _snapshots.get(p)
+        if snap and now - snap[0] < COHERENCE_POLL:
+            return snap[1]
+    conn = get_read_conn(p)
+    try:
+        current = {r["name"]: r["generation"] for r in q.fetch_all(conn, q.GENERATIONS_ALL)}
+    finally:
+        conn.close()
+    with _lock:
+        _snapshots[p] = (now, current)
+    return current
+
+
+def expire_snapshots():
+    """Forget the cached reads, so the next generations() call reads every database again."""
+    with _lock:
+        _snapshots.clear()
+
+
+def generation(name: str, path: str = None) -> int:
+    return generations(path).get(name, 0)
+
+
+def changed(name: str, path: str = None) -> bool:
+    """True once per change of name since this process last asked (False on the first call)."""
+    p = path or get_db_path()
+    current = generation(name, p)
+    with _lock:
+        previous = _seen.get((p, name))
+        _seen[(p, name)] = current
+    return previous is not None and previous != current
@@ -97,3 +97,56 @@ def validate_row(row: Dict) -> List[str]:
         except Exception:
             errs.append('match_number must be an integer')
     return errs
+
+
+USER_COLUMNS = ["username", "role", "nickname"]
+USER_ROLES = ["giocatore", "admin"]
+
+USER_ALIASES = {
+    'user': 'username',
+    'user_name': 'username',
+    'nome_utente': 'username',
+    'ruolo': 'role',
+    'nick': 'nickname',
+    'soprannome': 'nickname',
+}
+
+
+def parse_users_csv(text: str) -> List[Dict]:
+    """Parse a pasted user roster (username, role, nickname) into normalized dicts.
+
+    Only `username` is required; `role` defaults to 'giocatore'.
+    """
+    if not text or not text.strip():
+        return []
+    reader = csv.DictReader(StringIO(text.strip()))
+    rows = []
+    for raw in reader:
+        row = {}
+        for k, v in raw.items():
+            if k is None:
+                continue
+            key = re.sub(r"[^a-z0-9]+", "_", k.strip().lower()).strip("_")
+            key = USER_ALIASES.get(key, key)
+            row[key] = v.strip() if isinstance(v, str) else v
+        row['role'] = (row.get('role') or 'giocatore').lower()
+        rows.append(row)
+    return rows
+
+
+def validate_user_row(row: Dict) -> List[str]:
+    errs = []
+    if not row.get('username'):
+        errs.append("Missing username")
+    if row.get('role') not in USER_ROLES:
+        errs.append(f"role must be one of {USER_ROLES}")
+    return errs
+
+
+def to_csv_text(rows: List[Dict], columns: List[str]) -> str:
+    """Serialize dict rows to CSV text with the given column order."""
+    f = StringIO()
+    writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+    return f.getvalue()
@@ -1,9 +1,50 @@
+import contextvars
+import os
+import queue
 import sqlite3
+import threading
+import time
 from pathlib import Path
-from datetime import datetime
 
 DEFAULT_DB = Path("data") / "data.db"
 
+# read-only pool tuning: idle connections kept per database, page cache (KiB) and mmap size
+READ_POOL_SIZE = int(os.environ.get("BARBARAPP_READ_POOL_SIZE", 8))
+READ_CACHE_KIB = int(os.environ.get("BARBARAPP_READ_CACHE_KIB", 16384))
+READ_MMAP_BYTES = int(os.environ.get("BARBARAPP_READ_MMAP_BYTES", 256 * 1024 * 1024))
+# prepared statements cached per connection; large enough for every statement in libs/queries.py
+STATEMENT_CACHE_SIZE = int(os.environ.get("BARBARAPP_STATEMENT_CACHE_SIZE", 256))
+
+# attendance.status codes
+STATUS_CONFIRMED = 1
+# outbox.status codes
+OUTBOX_PENDING = 0
+OUTBOX_SENT = 1
+OUTBOX_FAILED = 2
+# events.kind codes (see libs/events.py for labels)
+EVENT_CONFIRMED = 1
+EVENT_CANCELLED = 2
+EVENT_MATCH_CREATED = 10
+EVENT_MATCH_UPDATED = 11
+EVENT_MATCH_DELETED = 12
+EVENT_MATCHES_IMPORTED = 13
+EVENT_USER_CREATED = 20
+EVENT_USER_PASSWORD_RESET = 21
+EVENT_USER_DELETED = 22
+EVENT_USER_ROLE_CHANGED = 23
+EVENT_USER_OTHER = 29
+
+# indexes the text values of an event's JSON details; details that are not JSON
+# (NULL or plain text from other writers) are stored but not indexed
+_EVENTS_FTS_INSERT = """
+    CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events WHEN json_valid(new.data) BEGIN
+        INSERT INTO events_fts (rowid, text)
+        SELECT new.id, group_concat(value, ' ') FROM json_each(new.data) WHERE type = 'text';
+    END;
+"""
+
+# Tables are STRICT: timestamps are INTEGER epoch seconds (UTC, see now_epoch()),
+# statuses are integer codes, and a value of the wrong type is rejected on write.
 CREATE_TABLES_SQL = [
     """
     CREATE TABLE IF NOT EXISTS users (
@@ -13,9 +54,9 @@ CREATE_TABLES_SQL = [
         nickname TEXT,
         role TEXT NOT NULL DEFAULT 'giocatore',
         force_password_change INTEGER DEFAULT 0,
-        created_at DATETIME,
-        updated_at DATETIME
-    );
+        created_at INTEGER,
+        updated_at INTEGER
+    ) STRICT;
     """,
     """
     CREATE TABLE IF NOT EXISTS matches (
@@ -26,72 +67,291 @@ CREATE_TABLES_SQL = [
         home_or_away TEXT NOT NULL,
         place_text TEXT,
         place_parsed_url TEXT,
+        place_display TEXT,
+        place_host TEXT,
         source_import TEXT,
         created_by INTEGER,
-        created_at DATETIME,
-        updated_at DATETIME
-    );
+        created_at INTEGER,
+        updated_at INTEGER,
+        fingerprint TEXT
+    ) STRICT;
     """,
     """
     CREATE TABLE IF NOT EXISTS attendance (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         match_id INTEGER NOT NULL,
         user_id INTEGER NOT NULL,
-        status TEXT NOT NULL,
+        status INTEGER NOT NULL,
         comment TEXT,
         nickname_at_time TEXT,
-        updated_at DATETIME,
+        updated_at INTEGER,
         updated_by INTEGER,
         FOREIGN KEY(match_id) REFERENCES matches(id),
         FOREIGN KEY(user_id) REFERENCES users(id)
-    );
-    """,
-    """
-    CREATE TABLE IF NOT EXISTS attendance_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        attendance_id INTEGER,
-        match_id INTEGER,
-        user_id INTEGER,
-        old_status TEXT,
-        new_status TEXT,
-        comment TEXT,
-        changed_at DATETIME,
-        changed_by INTEGER
-    );
+    ) STRICT;
+    CREATE INDEX IF NOT EXISTS idx_attendance_match ON attendance(match_id, status);
     """,
     """
-    CREATE TABLE IF NOT EXISTS user_audit (
+    -- append-only log of every change (libs/events.py): entity is the match or
+    -- user the event is about, subject the player of an attendance change,
+    -- actor the user who made it, data optional JSON details
+    CREATE TABLE IF NOT EXISTS events (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        admin_id INTEGER,
-        target_user_id INTEGER,
-        action TEXT,
-        details TEXT,
-        created_at DATETIME
-    );
+        ts INTEGER NOT NULL,
+        kind INTEGER NOT NULL,
+        entity INTEGER,
+        subject INTEGER,
+        actor INTEGER,
+        data TEXT
+    ) STRICT;
+    CREATE INDEX IF NOT EXISTS idx_events_timeline ON events(ts, kind, entity);
+    CREATE INDEX IF NOT EXISTS idx_events_entity ON events(entity, kind, ts);
+    CREATE TRIGGER IF NOT EXISTS events_no_update BEFORE UPDATE ON events
+    BEGIN SELECT RAISE(ABORT, 'events are append-only'); END;
+    CREATE TRIGGER IF NOT EXISTS events_no_delete BEFORE DELETE ON events
+    BEGIN SELECT RAISE(ABORT, 'events are append-only'); END;
     """,
     """
+    -- applied CSV imports (libs/fingerprints.py); index and matches trigger are in _migrate_fingerprints
     CREATE TABLE IF NOT EXISTS imports (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         uploader_id INTEGER,
         source_text TEXT,
         row_count INTEGER,
-        created_at DATETIME
-    );
+        created_at INTEGER,
+        source_hash TEXT,
+        matches_generation INTEGER
+    ) STRICT;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL,
+        expires_at INTEGER NOT NULL,
+        revoked_at INTEGER,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    ) STRICT;
+    CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id);
+    -- one-time tokens in the app URL standing in for a session (libs/sessions.py)
+    CREATE TABLE IF NOT EXISTS session_resumes (
+        id TEXT PRIMARY KEY,
+        session_id TEXT NOT NULL,
+        expires_at INTEGER NOT NULL
+    ) STRICT;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS login_throttle (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    ) STRICT;
+    """,
     """
+    CREATE TABLE IF NOT EXISTS cache_generations (
+        name TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL DEFAULT 0
+    ) STRICT;
+    """,
+    """
+    -- analytics rollups (libs/analytics.py), fed incrementally from events
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name TEXT PRIMARY KEY,
+        last_event_id INTEGER NOT NULL
+    ) STRICT;
+    CREATE TABLE IF NOT EXISTS rollup_player_season (
+        user_id INTEGER NOT NULL,
+        season TEXT NOT NULL,
+        confirmations INTEGER NOT NULL DEFAULT 0,
+        cancellations INTEGER NOT NULL DEFAULT 0,
+        late_cancellations INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, season)
+    ) STRICT;
+    CREATE TABLE IF NOT EXISTS rollup_match (
+        match_id INTEGER PRIMARY KEY,
+        confirmations INTEGER NOT NULL DEFAULT 0,
+        cancellations INTEGER NOT NULL DEFAULT 0,
+        last_change_at INTEGER
+    ) STRICT;
+    """,
+    """
+    -- watermarks of incremental exports (libs/export.py): last row id written per dataset
+    CREATE TABLE IF NOT EXISTS export_state (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        exported_at INTEGER NOT NULL
+    ) STRICT;
+    """,
+    """
+    -- notifications waiting for delivery (libs/alerts.py); dedup_key makes enqueueing idempotent
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dedup_key TEXT UNIQUE NOT NULL,
+        match_id INTEGER,
+        recipient TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        status INTEGER NOT NULL DEFAULT 0,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at INTEGER NOT NULL,
+        last_error TEXT,
+        created_at INTEGER NOT NULL,
+        sent_at INTEGER
+    ) STRICT;
+    CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at) WHERE status = 0;
+    """,
+    """
+    -- full-text search (libs/search.py): trigram indexes match any substring of
+    -- 3+ characters, kept in sync with their tables by triggers
+    CREATE VIRTUAL TABLE IF NOT EXISTS matches_fts USING fts5(
+        opponents_team, place_text, content='matches', content_rowid='id', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS matches_fts_insert AFTER INSERT ON matches BEGIN
+        INSERT INTO matches_fts (rowid, opponents_team, place_text) VALUES (new.id, new.opponents_team, new.place_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS matches_fts_delete AFTER DELETE ON matches BEGIN
+        INSERT INTO matches_fts (matches_fts, rowid, opponents_team, place_text)
+        VALUES ('delete', old.id, old.opponents_team, old.place_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS matches_fts_update AFTER UPDATE OF opponents_team, place_text ON matches BEGIN
+        INSERT INTO matches_fts (matches_fts, rowid, opponents_team, place_text)
+        VALUES ('delete', old.id, old.opponents_team, old.place_text);
+        INSERT INTO matches_fts (rowid, opponents_team, place_text) VALUES (new.id, new.opponents_team, new.place_text);
+    END;
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        username, nickname, content='users', content_rowid='id', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts (rowid, username, nickname) VALUES (new.id, new.username, new.nickname);
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username, nickname) VALUES ('delete', old.id, old.username, old.nickname);
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username, nickname ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username, nickname) VALUES ('delete', old.id, old.username, old.nickname);
+        INSERT INTO users_fts (rowid, username, nickname) VALUES (new.id, new.username, new.nickname);
+    END;
+    -- events are never updated or deleted: a contentless index of the text in their details
+    CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(text, content='', tokenize='trigram');
+    """ + _EVENTS_FTS_INSERT,
 ]
 
 
+# database file of the tenant active in this thread (see libs/tenancy.py); None = DEFAULT_DB
+_active_db = contextvars.ContextVar("active_db", default=None)
+
+
+def set_active_db(path: str = None):
+    """Route get_db_path() (and so get_conn/get_read_conn) to path in this context."""
+    _active_db.set(str(path) if path else None)
+
+
+def now_epoch() -> int:
+    """Current time as stored in timestamp columns (UTC epoch seconds)."""
+    return int(time.time())
+
+
 def get_db_path() -> str:
+    active = _active_db.get()
+    if active:
+        return active
     DEFAULT_DB.parent.mkdir(exist_ok=True)
     return str(DEFAULT_DB)
 
 
+# optional callback receiving the text of every statement run on get_conn() and
+# get_read_conn() connections (scripts/page_budgets.py counts queries with it)
+_statement_tracer = None
+
+
+def set_statement_tracer(callback=None):
+    """Install (or remove, with None) the per-statement callback for new and pooled connections."""
+    global _statement_tracer
+    _statement_tracer = callback
+
+
 def get_conn(path: str = None):
     p = path or get_db_path()
-    conn = sqlite3.connect(p, check_same_thread=False)
+    conn = sqlite3.connect(p, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
     # set a busy timeout to avoid "database is locked" on concurrent writes
     conn.execute("PRAGMA busy_timeout = 5000;")
+    if _statement_tracer is not None:
+        conn.set_trace_callback(_statement_tracer)
+    return conn
+
+
+class ReadOnlyConnection(sqlite3.Connection):
+    """Connection handed out by ReadConnectionPool; close() returns it to the pool."""
+
+    _pool = None
+
+    def close(self):
+        pool = self._pool
+        if pool is not None and pool.release(self):
+            return
+        super().close()
+
+
+class ReadConnectionPool:
+    """Pool of read-only connections to one database file.
+
+    Connections are opened with a `mode=ro` URI and `query_only`, and get a
+    larger page cache plus mmap, so long scans (audit, dashboards) never hold
+    write locks or compete with the read-write connections used by writers.
+    """
+
+    def __init__(self, path: str, size: int = READ_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            f"file:{Path(self.path).resolve()}?mode=ro", uri=True, check_same_thread=False,
+            factory=ReadOnlyConnection, cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout = 5000;")
+        conn.execute("PRAGMA query_only = 1;")
+        conn.execute(f"PRAGMA cache_size = -{READ_CACHE_KIB};")
+        conn.execute(f"PRAGMA mmap_size = {READ_MMAP_BYTES};")
+        conn._pool = self
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+
+    def release(self, conn) -> bool:
+        """Keep conn for reuse; returns False when the pool is full (caller closes it)."""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._idle.qsize() >= self.size:
+            return False
+        self._idle.put(conn)
+        return True
+
+
+_read_pools = {}
+_read_pools_lock = threading.Lock()
+
+
+def get_read_conn(path: str = None):
+    """Return a pooled read-only connection; call close() to give it back.
+
+    Use for pure-read views; anything that writes must use get_conn().
+    """
+    p = path or get_db_path()
+    pool = _read_pools.get(p)
+    if pool is None:
+        with _read_pools_lock:
+            pool = _read_pools.setdefault(p, ReadConnectionPool(p))
+    conn = pool.acquire()
+    # pooled connections may outlive a tracer: (re)set it on every checkout
+    conn.set_trace_callback(_statement_tracer)
     return conn
 
 
@@ -100,9 +360,6 @@ def with_retry(func, retries: int = 5, base_delay: float = 0.05):
 
     func should be a callable with no arguments; the result will be returned.
     """
-    import time
-    import sqlite3
-
     for i in range(retries):
         try:
             return func()
@@ -116,15 +373,243 @@ def with_retry(func, retries: int = 5, base_delay: float = 0.05):
             raise
 
 
+def _column_names(conn, table: str) -> set:
+    return {r["name"] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _column_names_ordered(conn, table: str) -> list:
+    return [r["name"] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _add_column_if_missing(conn, table: str, column: str, decl: str):
+    if column not in _column_names(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _migrate_place_display(conn):
+    """Add precomputed place columns to matches and backfill existing rows."""
+    from libs.places import normalize_place
+
+    _add_column_if_missing(conn, "matches", "place_display", "TEXT")
+    _add_column_if_missing(conn, "matches", "place_host", "TEXT")
+    rows = conn.execute(
+        "SELECT id, place_text, place_parsed_url FROM matches WHERE place_display IS NULL"
+    ).fetchall()
+    updates = []
+    for r in rows:
+        np = normalize_place(r["place_parsed_url"] or r["place_text"])
+        updates.append((np.url, np.display, np.host, r["id"]))
+    conn.executemany(
+        "UPDATE matches SET place_parsed_url = ?, place_display = ?, place_host = ? WHERE id = ?",
+        updates,
+    )
+
+
+def _sql_statements(script: str):
+    """Split a CREATE_TABLES_SQL entry into statements (executescript would commit)."""
+    stmt = ""
+    for line in script.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            yield stmt
+            stmt = ""
+
+
+_EPOCH = "CAST(strftime('%s', {0}) AS INTEGER)"
+# legacy column -> expression producing the STRICT value; unlisted columns are copied as-is
+_STRICT_COPY = {
+    "users": {"created_at": _EPOCH.format("created_at"), "updated_at": _EPOCH.format("updated_at"),
+              "force_password_change": "CAST(COALESCE(force_password_change, 0) AS INTEGER)"},
+    "matches": {"created_at": _EPOCH.format("created_at"), "updated_at": _EPOCH.format("updated_at")},
+    "attendance": {"status": f"CASE status WHEN 'confirmed' THEN {STATUS_CONFIRMED} ELSE 0 END",
+                   "updated_at": _EPOCH.format("updated_at")},
+    "imports": {"created_at": _EPOCH.format("created_at")},
+    "sessions": {},
+    "login_throttle": {},
+    "cache_generations": {},
+    # rollups are derived data: recreated empty, refolded from the converted history
+    "rollup_state": None,
+    "rollup_player_season": None,
+    "rollup_match": None,
+}
+
+
+def _migrate_strict_tables(conn):
+    """Rebuild pre-STRICT tables with epoch timestamps, integer statuses and the compact history."""
+    legacy = [
+        r["name"] for r in conn.execute("PRAGMA main.table_list")
+        if r["name"] in _STRICT_COPY and not r["strict"]
+    ]
+    if not legacy:
+        return
+    conn.commit()
+    # foreign_keys can only change outside a transaction; legacy_alter_table keeps the
+    # FOREIGN KEY clauses of other tables pointing at the original names while renaming
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in legacy:
+            conn.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+        for script in CREATE_TABLES_SQL:
+            for stmt in _sql_statements(script):
+                if "CREATE TABLE" in stmt:
+                    conn.execute(stmt)
+        for table in legacy:
+            overrides = _STRICT_COPY[table]
+            if overrides is not None:
+                old = _column_names(conn, f"legacy_{table}")
+                cols = [c for c in _column_names_ordered(conn, table) if c in old or c in overrides]
+                exprs = [overrides.get(c, c) for c in cols]
+                conn.execute(
+                    f"INSERT INTO {table} ({', '.join(cols)}) SELECT {', '.join(exprs)} FROM legacy_{table}"
+                )
+            conn.execute(f"DROP TABLE legacy_{table}")
+        # indexes and triggers moved to the legacy tables with the rename and were dropped with them
+        for script in CREATE_TABLES_SQL:
+            for stmt in _sql_statements(script):
+                if "CREATE INDEX" in stmt or "CREATE TRIGGER" in stmt:
+                    conn.execute(stmt)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA legacy_alter_table = OFF")
+        conn.execute("PRAGMA foreign_keys = ON")
+
+
+def _as_epoch(col: str) -> str:
+    """Epoch seconds from a column holding either epoch integers or ISO text."""
+    return f"CASE WHEN typeof({col}) = 'integer' THEN {col} ELSE {_EPOCH.format(col)} END"
+
+
+# user_audit.action text -> events.kind
+_AUDIT_KINDS = {
+    "create_user": EVENT_USER_CREATED,
+    "password_reset": EVENT_USER_PASSWORD_RESET,
+    "delete_user": EVENT_USER_DELETED,
+    "change_role": EVENT_USER_ROLE_CHANGED,
+}
+
+
+def _migrate_event_log(conn):
+    """Move attendance_history and user_audit into the unified events log."""
+    if "last_history_id" in _column_names(conn, "rollup_state"):
+        conn.execute("ALTER TABLE rollup_state RENAME COLUMN last_history_id TO last_event_id")
+    tables = {r["name"] for r in conn.execute("PRAGMA main.table_list")}
+    selects = []
+    if "attendance_history" in tables:
+        cols = _column_names(conn, "attendance_history")
+        if "action" in cols:
+            kind = "action"
+        else:
+            kind = (f"CASE WHEN new_status = 'confirmed' THEN {EVENT_CONFIRMED} "
+                    f"WHEN old_status = 'confirmed' THEN {EVENT_CANCELLED} ELSE 0 END")
+        selects.append(
+            f"SELECT {_as_epoch('changed_at')} AS ts, {kind} AS kind, match_id AS entity, "
+            "user_id AS subject, changed_by AS actor, "
+            "CASE WHEN comment IS NOT NULL THEN json_object('comment', comment) END AS data "
+            "FROM attendance_history"
+        )
+    if "user_audit" in tables:
+        kinds = " ".join(f"WHEN '{action}' THEN {kind}" for action, kind in _AUDIT_KINDS.items())
+        selects.append(
+            f"SELECT {_as_epoch('created_at')}, CASE action {kinds} ELSE {EVENT_USER_OTHER} END, "
+            "target_user_id, NULL, admin_id, json_object('action', action, 'details', details) "
+            "FROM user_audit"
+        )
+    if not selects:
+        return
+    conn.execute(
+        "INSERT INTO events (ts, kind, entity, subject, actor, data) "
+        f"SELECT * FROM ({' UNION ALL '.join(selects)}) WHERE ts IS NOT NULL ORDER BY ts"
+    )
+    for table in ("attendance_history", "user_audit"):
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    # rollup watermarks pointed at history ids: refold everything from the log
+    for table in ("rollup_state", "rollup_player_season", "rollup_match"):
+        conn.execute(f"DELETE FROM {table}")
+
+
+def _migrate_search_index(conn):
+    """Fill the full-text indexes with the rows written before their triggers existed."""
+    conn.execute("INSERT INTO matches_fts (matches_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO events_fts (events_fts) VALUES ('delete-all')")
+    conn.execute(
+        "INSERT INTO events_fts (rowid, text) "
+        "SELECT e.id, (SELECT group_concat(j.value, ' ') FROM json_each(e.data) j WHERE j.type = 'text') "
+        "FROM events e WHERE json_valid(e.data)"
+    )
+
+
+_FINGERPRINT_FIELDS = ("match_number", "date", "opponents_team", "home_or_away", "place_text", "place_parsed_url")
+
+
+def _migrate_fingerprints(conn):
+    """Add match fingerprints and import source hashes; backfill the fingerprints."""
+    from libs.fingerprints import row_fingerprint
+
+    _add_column_if_missing(conn, "matches", "fingerprint", "TEXT")
+    _add_column_if_missing(conn, "imports", "source_hash", "TEXT")
+    _add_column_if_missing(conn, "imports", "matches_generation", "INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_imports_hash ON imports(source_hash)")
+    # a writer changing the fingerprinted fields without a new fingerprint leaves a stale
+    # one behind: clear it, MatchIndex recomputes missing fingerprints
+    changed = " OR ".join(f"new.{c} IS NOT old.{c}" for c in _FINGERPRINT_FIELDS)
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS matches_fingerprint_stale AFTER UPDATE OF {', '.join(_FINGERPRINT_FIELDS)} "
+        f"ON matches WHEN new.fingerprint IS old.fingerprint AND ({changed}) "
+        "BEGIN UPDATE matches SET fingerprint = NULL WHERE id = new.id; END"
+    )
+    rows = conn.execute(f"SELECT id, {', '.join(_FINGERPRINT_FIELDS)} FROM matches WHERE fingerprint IS NULL").fetchall()
+    conn.executemany("UPDATE matches SET fingerprint = ? WHERE id = ?", [(row_fingerprint(r), r["id"]) for r in rows])
+
+
+def _migrate_events_fts_guard(conn):
+    """Replace the events_fts trigger that rejected events with non-JSON details."""
+    conn.execute("DROP TRIGGER IF EXISTS events_fts_insert")
+    conn.execute(_EVENTS_FTS_INSERT)
+
+
+# Schema migrations, applied in order and tracked through PRAGMA user_version.
+# Each migration must be safe to run on a freshly created schema as well.
+MIGRATIONS = [
+    _migrate_place_display,
+    _migrate_strict_tables,
+    _migrate_event_log,
+    _migrate_search_index,
+    _migrate_fingerprints,
+    _migrate_events_fts_guard,
+]
+
+
+def run_migrations(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {i}")
+
+
+def apply_schema(conn):
+    """Create the tables and run pending migrations on a sqlite3 connection returning sqlite3.Row rows."""
+    for sql in CREATE_TABLES_SQL:
+        conn.executescript(sql)
+    run_migrations(conn)
+
+
 def init_db(path: str = None):
     p = path or get_db_path()
     conn = get_conn(p)
     try:
+        # incremental vacuum lets the maintenance thread reclaim free pages;
+        # this only takes effect on a brand-new database file
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
         # enable WAL for better concurrency
         conn.execute("PRAGMA journal_mode=WAL;")
         conn.execute("PRAGMA foreign_keys = ON;")
-        for sql in CREATE_TABLES_SQL:
-            conn.executescript(sql)
+        apply_schema(conn)
 
         conn.commit()
     finally:
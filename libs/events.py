@@ -0,0 +1,81 @@
+import json
+from libs import queries as q
+from libs.db import (
+    EVENT_CANCELLED, EVENT_CONFIRMED, EVENT_MATCH_CREATED, EVENT_MATCH_DELETED, EVENT_MATCH_UPDATED,
+    EVENT_MATCHES_IMPORTED, EVENT_USER_CREATED, EVENT_USER_DELETED, EVENT_USER_OTHER,
+    EVENT_USER_PASSWORD_RESET, EVENT_USER_ROLE_CHANGED, now_epoch,
+)
+
+# Unified append-only event log.
+#
+# Every change worth auditing (attendance confirmations, match edits and
+# imports, user administration) is one row in `events`: a timestamp, a kind
+# code (EVENT_* in libs/db.py), the match or user it is about (entity), the
+# player of an attendance change (subject), who made it (actor) and optional
+# JSON details. Triggers reject UPDATE and DELETE on the table.
+#
+# Writers collect their events in an EventBatch and flush them with a single
+# executemany inside the transaction that makes the change, so a rolled back
+# change leaves no event behind and a bulk operation costs one statement.
+
+EVENT_LABELS = {
+    EVENT_CONFIRMED: '✅ Confermato',
+    EVENT_CANCELLED: '❌ Cancellato',
+    EVENT_MATCH_CREATED: '➕ Partita creata',
+    EVENT_MATCH_UPDATED: '✏️ Partita modificata',
+    EVENT_MATCH_DELETED: '🗑️ Partita eliminata',
+    EVENT_MATCHES_IMPORTED: '📥 Import partite',
+    EVENT_USER_CREATED: '👤 Utente creato',
+    EVENT_USER_PASSWORD_RESET: '🔑 Password reimpostata',
+    EVENT_USER_DELETED: '🚫 Utente eliminato',
+    EVENT_USER_ROLE_CHANGED: '🛡️ Ruolo modificato',
+    EVENT_USER_OTHER: 'Altro (utenti)',
+}
+ATTENDANCE_EVENTS = (EVENT_CONFIRMED, EVENT_CANCELLED)
+MATCH_EVENTS = (EVENT_MATCH_CREATED, EVENT_MATCH_UPDATED, EVENT_MATCH_DELETED, EVENT_MATCHES_IMPORTED)
+USER_EVENTS = (EVENT_USER_CREATED, EVENT_USER_PASSWORD_RESET, EVENT_USER_DELETED, EVENT_USER_ROLE_CHANGED,
+               EVENT_USER_OTHER)
+
+
+def encode_data(data) -> str:
+    """events.data for a details dict: compact JSON, or None without details."""
+    if data is not None and not isinstance(data, dict):
+        raise TypeError(f"event details must be a dict, not {type(data).__name__}")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else None
+
+
+class EventBatch:
+    """Buffer of events written together into the caller's transaction.
+
+    Use as a context manager around the change (events are flushed on success
+    and discarded on error), or call flush() before committing.
+    """
+
+    def __init__(self, conn, actor: int = None, ts: int = None):
+        self.conn = conn
+        self.actor = actor
+        self.ts = ts or now_epoch()
+        self._rows = []
+
+    def add(self, kind: int, entity: int = None, subject: int = None, data: dict = None, actor: int = None):
+        self._rows.append((self.ts, kind, entity, subject, actor if actor is not None else self.actor, encode_data(data)))
+
+    def flush(self) -> int:
+        """Insert the buffered events (one statement); returns how many were written."""
+        rows, self._rows = self._rows, []
+        if rows:
+            q.executemany(self.conn, q.EVENT_INSERT, rows)
+        return len(rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._rows = []
+        return False
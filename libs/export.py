@@ -0,0 +1,242 @@
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from importlib.util import find_spec
+from pathlib import Path
+from typing import NamedTuple
+from libs import frames, queries as q
+from libs.db import DEFAULT_DB, get_conn, get_read_conn, now_epoch
+from libs.tenancy import activate, current_tenant
+
+# Chunked streaming exports of matches, attendance and the event log.
+#
+# An export runs one query on a pooled read-only connection and pulls its rows
+# EXPORT_CHUNK_ROWS at a time (cursor.fetchmany), writing each chunk out before
+# fetching the next, so memory stays bounded by one chunk whatever the table
+# size. Formats are CSV, JSON Lines and, when pyarrow is installed, Parquet
+# (one row group per chunk). An export can be limited to a date range and/or to
+# the rows added since the previous incremental export of the same dataset,
+# tracked as a row-id watermark in `export_state`.
+
+EXPORT_DIR = Path(os.environ.get("BARBARAPP_EXPORT_DIR", DEFAULT_DB.parent / "exports"))
+EXPORT_CHUNK_ROWS = int(os.environ.get("BARBARAPP_EXPORT_CHUNK_ROWS", 1000))
+# files kept per team and dataset in EXPORT_DIR
+EXPORT_KEEP = int(os.environ.get("BARBARAPP_EXPORT_KEEP", 10))
+
+PARQUET_AVAILABLE = find_spec("pyarrow") is not None
+# format -> (file extension, MIME type)
+FORMATS = {"csv": ("csv", "text/csv"), "jsonl": ("jsonl", "application/x-ndjson")}
+if PARQUET_AVAILABLE:
+    FORMATS["parquet"] = ("parquet", "application/vnd.apache.parquet")
+
+
+class Dataset(NamedTuple):
+    stmt: q.Statement
+    count_stmt: q.Statement
+    columns: dict  # column -> frames dtype (Parquet column types)
+    epoch_range: bool  # date range on epoch seconds (events.ts) rather than ISO match dates
+
+
+DATASETS = {
+    "matches": Dataset(q.EXPORT_MATCHES, q.EXPORT_MATCHES_COUNT, {
+        "id": frames.INT, "match_number": frames.INT, "date": frames.TEXT, "opponents_team": frames.TEXT,
+        "home_or_away": frames.TEXT, "place_text": frames.TEXT, "place_parsed_url": frames.TEXT,
+        "place_display": frames.TEXT, "source_import": frames.TEXT, "created_by": frames.INT,
+        "created_at": frames.INT, "updated_at": frames.INT,
+    }, False),
+    "attendance": Dataset(q.EXPORT_ATTENDANCE, q.EXPORT_ATTENDANCE_COUNT, {
+        "id": frames.INT, "match_id": frames.INT, "match_number": frames.INT, "match_date": frames.TEXT,
+        "user_id": frames.INT, "username": frames.TEXT, "nickname_at_time": frames.TEXT, "status": frames.INT,
+        "updated_at": frames.INT, "updated_by": frames.INT,
+    }, False),
+    "events": Dataset(q.EXPORT_EVENTS, q.EXPORT_EVENTS_COUNT, {
+        "id": frames.INT, "ts": frames.INT, "kind": frames.INT, "entity": frames.INT,
+        "subject": frames.INT, "actor": frames.INT, "data": frames.TEXT,
+    }, True),
+}
+
+
+def _day_epoch(d: date) -> int:
+    return int(datetime(d.year, d.month, d.day, tzinfo=timezone.utc).timestamp())
+
+
+def _range(dataset: Dataset, date_from: date = None, date_to: date = None) -> tuple:
+    """(lower, upper) statement parameters for an inclusive range of days."""
+    if dataset.epoch_range:
+        return (_day_epoch(date_from) if date_from else 0,
+                _day_epoch(date_to + timedelta(days=1)) if date_to else 2 ** 62)
+    return (date_from.isoformat() if date_from else "", date_to.isoformat() if date_to else "9999-12-31")
+
+
+class _CsvSink:
+    def __init__(self, out, columns):
+        self._text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(columns)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._text.flush()
+        self._text.detach()  # leave `out` open for the caller
+
+
+class _JsonlSink:
+    def __init__(self, out, columns):
+        self._out = out
+        self._columns = columns
+
+    def write(self, rows):
+        self._out.write("".join(
+            json.dumps(dict(zip(self._columns, r)), ensure_ascii=False, separators=(",", ":")) + "\n" for r in rows
+        ).encode("utf-8"))
+
+    def close(self):
+        pass
+
+
+class _ParquetSink:
+    def __init__(self, out, columns, types):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        arrow = {frames.INT: pa.int64(), frames.TEXT: pa.string()}
+        self._pa = pa
+        self._columns = columns
+        self._schema = pa.schema([(c, arrow[types[c]]) for c in columns])
+        self._writer = pq.ParquetWriter(out, self._schema)
+
+    def write(self, rows):
+        data = {c: list(values) for c, values in zip(self._columns, zip(*rows))}
+        self._writer.write_table(self._pa.Table.from_pydict(data, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def _sink(fmt: str, out, dataset: Dataset):
+    columns = list(dataset.columns)
+    if fmt == "csv":
+        return _CsvSink(out, columns)
+    if fmt == "jsonl":
+        return _JsonlSink(out, columns)
+    if fmt == "parquet" and PARQUET_AVAILABLE:
+        return _ParquetSink(out, columns, dataset.columns)
+    raise ValueError(f"unsupported export format: {fmt!r}")
+
+
+def watermark(name: str):
+    """(last exported id, exported_at) of the incremental exports of a dataset, or None."""
+    conn = get_read_conn()
+    try:
+        row = q.fetch_one(conn, q.EXPORT_WATERMARK, (name,))
+    finally:
+        conn.close()
+    return (row["last_id"], row["exported_at"]) if row else None
+
+
+def export(name: str, fmt: str, out, date_from: date = None, date_to: date = None, incremental: bool = False,
+           progress=None, chunk_rows: int = None) -> dict:
+    """Stream dataset `name` into the binary file object `out`, one chunk of rows at a time.
+
+    incremental exports only rows added since the previous incremental export
+    and moves the watermark once everything was written; it cannot be combined
+    with a date range, whose rows need not be the lowest ids after the
+    watermark. progress(done, total) is called after each chunk.
+    """
+    if incremental and (date_from or date_to):
+        raise ValueError("an incremental export cannot be limited to a date range")
+    dataset = DATASETS[name]
+    chunk_rows = chunk_rows or EXPORT_CHUNK_ROWS
+    after = (watermark(name) or (0, None))[0] if incremental else 0
+    params = _range(dataset, date_from, date_to) + (after,)
+    started = time.perf_counter()
+    done, last_id = 0, after
+    conn = get_read_conn()
+    try:
+        total = q.fetch_one(conn, dataset.count_stmt, params)["c"]
+        cur = q.execute(conn, dataset.stmt, params)
+        sink = _sink(fmt, out, dataset)
+        try:
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                sink.write([tuple(r) for r in rows])
+                done += len(rows)
+                last_id = max(last_id, rows[-1]["id"])
+                if progress:
+                    progress(done, max(total, done))
+        finally:
+            sink.close()
+        cur.close()
+    finally:
+        conn.close()
+    if incremental and done:
+        wconn = get_conn()
+        try:
+            q.execute(wconn, q.EXPORT_WATERMARK_SET, (name, last_id, now_epoch()))
+            wconn.commit()
+        finally:
+            wconn.close()
+    return {
+        "dataset": name,
+        "format": fmt,
+        "rows": done,
+        "first_id": after + 1 if done else None,
+        "last_id": last_id if done else None,
+        "duration_s": round(time.perf_counter() - started, 3),
+    }
+
+
+def export_to_file(name: str, fmt: str, **kwargs) -> dict:
+    """Export into EXPORT_DIR/<team>-<dataset>-<timestamp>.<ext>; returns export() stats plus path and bytes.
+
+    The file appears only once complete; older exports of the same team and
+    dataset beyond EXPORT_KEEP are removed.
+    """
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    prefix = f"{current_tenant()}-{name}-"
+    stamp, ext = datetime.now().strftime('%Y%m%d-%H%M%S'), FORMATS[fmt][0]
+    path = EXPORT_DIR / f"{prefix}{stamp}.{ext}"
+    n = 1
+    while path.exists():  # several exports within the same second
+        n += 1
+        path = EXPORT_DIR / f"{prefix}{stamp}-{n}.{ext}"
+    part = path.with_name(path.name + ".part")
+    try:
+        with open(part, "wb") as out:
+            stats = export(name, fmt, out, **kwargs)
+        part.replace(path)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    for old in sorted(EXPORT_DIR.glob(f"{prefix}*"), key=lambda p: p.stat().st_mtime)[:-EXPORT_KEEP]:
+        if not old.name.endswith(".part"):
+            old.unlink(missing_ok=True)
+    return dict(stats, path=str(path), bytes=path.stat().st_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m libs.export", description="Export a dataset to data/exports/")
+    parser.add_argument("dataset", choices=list(DATASETS))
+    parser.add_argument("--format", choices=list(FORMATS), default="csv")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="last day (YYYY-MM-DD)")
+    parser.add_argument("--incremental", action="store_true", help="only rows added since the last incremental export")
+    parser.add_argument("--team", default="default")
+    args = parser.parse_args(argv)
+    if args.incremental and (args.date_from or args.date_to):
+        parser.error("--incremental cannot be combined with --from/--to")
+    activate(args.team)
+    stats = export_to_file(args.dataset, args.format, date_from=args.date_from, date_to=args.date_to,
+                           incremental=args.incremental)
+    print(f"{stats['path']}  {stats['rows']} rows  {stats['bytes']} bytes  {stats['duration_s']} s")
+
+
+if __name__ == "__main__":
+    main()
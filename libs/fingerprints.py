@@ -0,0 +1,84 @@
+import hashlib
+from libs import coherence, queries as q
+from libs.db import now_epoch
+
+# Content fingerprints for idempotent match imports.
+#
+# Every match stores a fingerprint: a hash of the fields an import writes
+# (number, date, opponents, home/away, place text and link). An import loads
+# the calendar with one query into a MatchIndex and compares the fingerprint of
+# each incoming row with the one of the match it would overwrite, so unchanged
+# rows are skipped without a query or a field-by-field comparison. Writers that
+# change those fields without a new fingerprint get theirs cleared by a trigger
+# (see _migrate_fingerprints in libs/db.py); MatchIndex recomputes missing ones.
+#
+# Each applied import is recorded in `imports` with a hash of its source text
+# and the "matches" generation after it (libs/coherence.py): pasting the same
+# text again while that generation has not moved is recognized before parsing.
+
+
+def match_fingerprint(match_number, date, opponents, home_or_away, place_text, place_url) -> str:
+    values = (match_number, date, opponents, home_or_away, place_text, place_url)
+    canonical = "\x1f".join("" if v is None else str(v) for v in values)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def row_fingerprint(row) -> str:
+    """match_fingerprint() of a matches row (sqlite3.Row or dict)."""
+    return match_fingerprint(row["match_number"], row["date"], row["opponents_team"], row["home_or_away"],
+                             row["place_text"], row["place_parsed_url"])
+
+
+def source_hash(text: str) -> str:
+    """Hash of a pasted CSV, insensitive to line endings and trailing blanks."""
+    lines = [line.rstrip() for line in (text or "").strip().splitlines()]
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+
+
+class MatchIndex:
+    """The calendar in memory, by id, date and match number, each row with its fingerprint."""
+
+    def __init__(self, rows=()):
+        self._by_id, self._by_date, self._by_number = {}, {}, {}
+        for r in rows:
+            self.put(dict(r))
+
+    @classmethod
+    def load(cls, conn) -> "MatchIndex":
+        return cls(q.fetch_all(conn, q.MATCH_FINGERPRINTS))
+
+    def put(self, row: dict):
+        """Add or replace a match (after an insert or update within the same import)."""
+        row["fingerprint"] = row.get("fingerprint") or row_fingerprint(row)
+        old = self._by_id.get(row["id"])
+        if old is not None:
+            self._by_date.pop(old["date"], None)
+            self._by_number.pop(old["match_number"], None)
+        self._by_id[row["id"]] = row
+        self._by_date[row["date"]] = row
+        self._by_number[row["match_number"]] = row
+
+    def find(self, date: str, match_number: int):
+        """The match a row overwrites: same date, otherwise same number (as MatchOperator.apply_row)."""
+        return self._by_date.get(date) or self._by_number.get(match_number)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+def previous_import(conn, text_hash: str):
+    """Latest import of this source text as a dict with `unchanged` (calendar untouched since), or None."""
+    row = q.fetch_one(conn, q.IMPORT_BY_HASH, (coherence.MATCHES, text_hash))
+    if row is None:
+        return None
+    return dict(row, unchanged=row["matches_generation"] == row["current_generation"])
+
+
+def record_import(conn, uploader_id, text: str, row_count: int) -> int:
+    """Record an applied import in the caller's transaction, after its generation bump."""
+    return q.execute(conn, q.IMPORT_INSERT, (
+        uploader_id, text, source_hash(text), row_count, now_epoch(), coherence.MATCHES,
+    )).lastrowid
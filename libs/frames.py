@@ -0,0 +1,72 @@
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+from libs import coherence
+from libs.db import get_db_path
+
+# Typed DataFrames for tables and editors.
+#
+# Streamlit serializes every frame to Arrow on each rerun, and object columns
+# holding Python str/int values are the slowest to convert. typed_frame() loads
+# query rows column by column into explicit dtypes (categoricals for repeated
+# labels, nullable integers, strings, booleans, datetimes from epoch seconds);
+# cached_frame() keeps a built frame between reruns and sessions until one of
+# the coherence generations it depends on moves (libs/coherence.py).
+
+INT = "Int64"
+TEXT = "string"
+CATEGORY = "category"
+BOOL = "boolean"
+EPOCH = "epoch"  # epoch seconds -> datetime64 (naive UTC)
+OBJECT = "object"  # lists and other values kept as-is
+
+FRAME_CACHE_SIZE = int(os.environ.get("BARBARAPP_FRAME_CACHE_SIZE", 64))
+
+_frames = OrderedDict()  # (db path, name) -> (generations, frame)
+_frames_lock = threading.Lock()
+
+
+def _column(values: list, dtype: str) -> pd.Series:
+    if dtype == EPOCH:
+        return pd.to_datetime(pd.Series(values, dtype="float64"), unit="s")
+    if dtype == OBJECT:
+        return pd.Series(values, dtype="object")
+    return pd.Series(values, dtype=dtype)
+
+
+def typed_frame(rows, schema: dict) -> pd.DataFrame:
+    """DataFrame with the schema's columns (in order), each loaded with its dtype.
+
+    rows are sqlite3.Row objects or dicts (read by column name) or plain tuples
+    (read by position, in schema order).
+    """
+    rows = list(rows)
+    names = list(schema)
+    if rows and isinstance(rows[0], tuple):
+        columns = list(zip(*rows)) or [()] * len(names)
+    else:
+        columns = [[r[name] for r in rows] for name in names]
+    return pd.DataFrame({name: _column(list(values), schema[name]) for name, values in zip(names, columns)})
+
+
+def cached_frame(name: str, depends_on: tuple, build) -> pd.DataFrame:
+    """Frame built by build(), reused for the active database until a generation in depends_on moves.
+
+    The frame is shared between sessions: treat it as read-only and derive
+    per-user columns with assign()/copy().
+    """
+    key = (get_db_path(), name)
+    gens = tuple(coherence.generation(g) for g in depends_on)
+    with _frames_lock:
+        cached = _frames.get(key)
+        if cached and cached[0] == gens:
+            _frames.move_to_end(key)
+            return cached[1]
+    frame = build()
+    with _frames_lock:
+        _frames[key] = (gens, frame)
+        _frames.move_to_end(key)
+        while len(_frames) > FRAME_CACHE_SIZE:
+            _frames.popitem(last=False)
+    return frame
@@ -0,0 +1,155 @@
+import argparse
+import hashlib
+import os
+import threading
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import urlencode
+from libs import coherence, queries as q
+from libs.db import DEFAULT_DB, get_read_conn
+from libs.sessions import feed_key
+from libs.tenancy import TENANT_PARAM, list_tenants, tenant_db_path, tenant_for_path
+
+# iCalendar feed of the match calendar.
+#
+# Each team's feed is rebuilt only when its "matches" or "attendance" generation
+# (libs/coherence.py) moves; otherwise the cached body and its ETag (a hash of
+# the content) are returned as-is, so calendar clients polling every few minutes
+# get a 304 without touching the match tables. Rebuilt feeds are also written
+# to data/feeds/<team>.ics for serving as a static file.
+
+FEED_DIR = Path(os.environ.get("BARBARAPP_FEED_DIR", DEFAULT_DB.parent / "feeds"))
+FEED_INTERVAL = float(os.environ.get("BARBARAPP_FEED_INTERVAL", 60))
+# public address of api.py, used for the subscription links shown in the app
+API_URL = os.environ.get("BARBARAPP_API_URL", "http://localhost:8502").rstrip("/")
+HOA_LABELS = {"casa": "🏠", "home": "🏠", "trasferta": "🚗", "away": "🚗"}
+
+_feeds = {}  # team -> (generations, body, etag)
+_lock = threading.Lock()
+
+
+def _escape(text) -> str:
+    text = "" if text is None else str(text)
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    """Fold content lines at 75 octets (RFC 5545, 3.1)."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line
+    parts, start = [], 0
+    while start < len(raw):
+        end = min(start + (75 if not parts else 74), len(raw))
+        while end < len(raw) and (raw[end] & 0xC0) == 0x80:  # never split a UTF-8 sequence
+            end -= 1
+        parts.append(raw[start:end].decode("utf-8"))
+        start = end
+    return "\r\n ".join(parts)
+
+
+def _stamp(value) -> str:
+    try:
+        return datetime.fromtimestamp(int(value), timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    except (TypeError, ValueError, OverflowError):
+        return "20000101T000000Z"
+
+
+def render_ics(rows, team: str) -> str:
+    """VCALENDAR text for match rows from the matches_with_counts statement."""
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//BarbarApp//Calendario//IT",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_escape('Darts ' + team)}",
+    ]
+    for m in rows:
+        try:
+            day = date.fromisoformat(str(m["date"])[:10])
+        except ValueError:
+            continue
+        hoa = HOA_LABELS.get((m["home_or_away"] or "").lower(), m["home_or_away"] or "")
+        summary = f"{hoa} vs {m['opponents_team']} ({m['confirmed']} confermati)".strip()
+        description = f"Partita #{m['match_number']}\nConfermati: {m['confirmed']}"
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:match-{m['id']}@{team}.barbarapp",
+            f"DTSTAMP:{_stamp(m['changed_at'])}",
+            f"DTSTART;VALUE=DATE:{day:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{day + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{_escape(summary)}",
+            f"DESCRIPTION:{_escape(description)}",
+        ]
+        if m["place_text"]:
+            lines.append(f"LOCATION:{_escape(m['place_text'])}")
+        if m["place_parsed_url"]:
+            lines.append(f"URL:{m['place_parsed_url']}")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+
+def _write_static(team: str, body: bytes):
+    FEED_DIR.mkdir(parents=True, exist_ok=True)
+    target = FEED_DIR / f"{team}.ics"
+    tmp = target.with_suffix(".ics.tmp")
+    tmp.write_bytes(body)
+    tmp.replace(target)
+
+
+def get_feed(team: str):
+    """Return (body bytes, etag) of a team's feed, rebuilding it only after a change."""
+    path = tenant_db_path(team)
+    # read the generations before the rows: a concurrent write can only make the
+    # cached feed newer than its key, which triggers one extra rebuild
+    gens = (coherence.generation(coherence.MATCHES, path), coherence.generation(coherence.ATTENDANCE, path))
+    with _lock:
+        cached = _feeds.get(team)
+    if cached and cached[0] == gens:
+        return cached[1], cached[2]
+    conn = get_read_conn(path)
+    try:
+        rows = q.fetch_all(conn, q.MATCHES_WITH_COUNTS, ("",))
+    finally:
+        conn.close()
+    body = render_ics(rows, team).encode("utf-8")
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    if not cached or cached[2] != etag:
+        _write_static(team, body)
+    with _lock:
+        _feeds[team] = (gens, body, etag)
+    return body, etag
+
+
+def feed_url(team: str) -> str:
+    return f"{API_URL}/calendar.ics?{urlencode({TENANT_PARAM: team, 'key': feed_key(team)})}"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """True when an If-None-Match header covers etag."""
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _scheduled_feed(conn):
+    # keeps data/feeds/<team>.ics current for static serving; a no-op without changes
+    team = tenant_for_path(conn.execute("PRAGMA database_list").fetchone()[2])
+    body, etag = get_feed(team)
+    return {"feed": team, "feed_bytes": len(body), "feed_etag": etag}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m libs.ics", description="Write ICS feeds to data/feeds/")
+    parser.add_argument("teams", nargs="*", help="teams to export (default: all)")
+    args = parser.parse_args(argv)
+    for team in args.teams or list_tenants():
+        if Path(tenant_db_path(team)).exists():
+            body, etag = get_feed(team)
+            print(f"{FEED_DIR / (team + '.ics')}  {len(body)} bytes  etag={etag}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+from datetime import datetime
+import pandas as pd
+from libs import frames
+from libs.db import get_read_conn
+from libs.fingerprints import MatchIndex, match_fingerprint
+from libs.places import normalize_place
+
+# Diff of a pasted match CSV against the calendar, for the import preview.
+#
+# build_preview() loads the existing matches with one query (a MatchIndex, see
+# libs/fingerprints.py) and compares them with the parsed rows column by column.
+# Every row gets its action, with the same matching rule as
+# MatchOperator.apply_row (by date, then by match number): insert, error, skip
+# when its fingerprint equals the matched row's, update otherwise, with one
+# changed_<field> flag per compared field. The admin page shows the result as a
+# single paginated table instead of one component per row.
+
+IMPORT_PREVIEW_PAGE_SIZE = int(os.environ.get("BARBARAPP_IMPORT_PREVIEW_PAGE_SIZE", 50))
+
+ACTIONS = ("insert", "update", "skip", "error")
+# compared fields: incoming column -> existing column
+DIFF_FIELDS = {
+    "match_number": "old_match_number",
+    "date": "old_date",
+    "opponents_team": "old_opponents_team",
+    "home_or_away": "old_home_or_away",
+    "place": "old_place",
+}
+
+INCOMING_SCHEMA = {
+    "row_no": frames.INT,
+    "errors": frames.TEXT,
+    "match_number": frames.TEXT,
+    "date": frames.TEXT,
+    "opponents_team": frames.TEXT,
+    "home_or_away": frames.TEXT,
+    "place": frames.TEXT,
+    "place_url": frames.TEXT,
+    "fingerprint": frames.TEXT,
+}
+EXISTING_SCHEMA = {
+    "existing_id": frames.INT,
+    "old_match_number": frames.INT,
+    "old_date": frames.TEXT,
+    "old_opponents_team": frames.TEXT,
+    "old_home_or_away": frames.TEXT,
+    "old_place": frames.TEXT,
+    "old_place_url": frames.TEXT,
+    "old_fingerprint": frames.TEXT,
+}
+
+
+def _norm_date(value):
+    try:
+        return datetime.fromisoformat(str(value)).date().isoformat()
+    except ValueError:
+        return str(value).strip()
+
+
+def _incoming(r: dict) -> tuple:
+    date = _norm_date(r["date"]) if r.get("date") else r.get("date")
+    url = normalize_place(r.get("place")).url
+    fingerprint = None if r["_errors"] else match_fingerprint(
+        int(r["match_number"]), date, r.get("opponents_team"), r.get("home_or_away"), r.get("place"), url)
+    return (r["_row_no"], "; ".join(r["_errors"]), r.get("match_number"), date, r.get("opponents_team"),
+            r.get("home_or_away"), r.get("place"), url, fingerprint)
+
+
+def diff_rows(rows: list, index: MatchIndex) -> pd.DataFrame:
+    """Compare parsed CSV rows (with _row_no and _errors) to the calendar in index.
+
+    One row per incoming row: the incoming values, the matched existing values
+    (old_*), action and changed_<field> for every field in DIFF_FIELDS.
+    """
+    incoming = frames.typed_frame([_incoming(r) for r in rows], INCOMING_SCHEMA)
+    old = frames.typed_frame([
+        (m["id"], m["match_number"], m["date"], m["opponents_team"], m["home_or_away"], m["place_text"],
+         m["place_parsed_url"], m["fingerprint"])
+        for m in index
+    ], EXISTING_SCHEMA)
+
+    valid = incoming["errors"].eq("")
+    number = pd.to_numeric(incoming["match_number"].where(valid), errors="coerce").astype("Int64")
+    by_date = pd.Series(old["existing_id"].array, index=old["old_date"].array)
+    by_number = pd.Series(old["existing_id"].array, index=old["old_match_number"].array)
+    ids = incoming["date"].where(valid).map(by_date).astype("Int64")
+    ids = ids.fillna(number.map(by_number).astype("Int64"))
+    diff = incoming.assign(existing_id=ids).merge(old, on="existing_id", how="left")
+
+    found = diff["existing_id"].notna()
+    changed = {}
+    for new, current in DIFF_FIELDS.items():
+        if new == "match_number":
+            changed[new] = found & number.ne(diff[current]).fillna(True)
+        else:
+            changed[new] = found & diff[new].fillna("").ne(diff[current].fillna(""))
+    # the place also differs when it now resolves to another link
+    changed["place"] |= found & diff["place_url"].fillna("").ne(diff["old_place_url"].fillna(""))
+    same = found & diff["fingerprint"].eq(diff["old_fingerprint"]).fillna(False)
+
+    action = pd.Series("insert", index=diff.index, dtype="string")
+    action = action.mask(found & ~same, "update").mask(same, "skip").mask(~valid, "error")
+    diff["action"] = pd.Categorical(action, categories=ACTIONS)
+    for field, mask in changed.items():
+        diff[f"changed_{field}"] = mask & diff["action"].eq("update")
+    return diff
+
+
+def build_preview(rows: list) -> pd.DataFrame:
+    """diff_rows() of the parsed rows against the current calendar (one query)."""
+    conn = get_read_conn()
+    try:
+        index = MatchIndex.load(conn)
+    finally:
+        conn.close()
+    return diff_rows(rows, index)
+
+
+def action_counts(diff: pd.DataFrame) -> dict:
+    counts = diff["action"].value_counts()
+    return {a: int(counts.get(a, 0)) for a in ACTIONS}
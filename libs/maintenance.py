@@ -0,0 +1,252 @@
+import logging
+import os
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is assumed
+    fcntl = None
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from libs import queries as q
+from libs.db import get_conn, get_db_path
+from libs.backup import BACKUP_INTERVAL, _scheduled_snapshot
+from libs.ics import FEED_INTERVAL, _scheduled_feed
+from libs.analytics import ROLLUP_INTERVAL, _scheduled_rollups
+from libs.alerts import ALERT_INTERVAL, OUTBOX_INTERVAL, _scheduled_alerts, _scheduled_outbox
+
+# In-process background maintenance for the SQLite database.
+#
+# One daemon thread per database file (one per team, see libs/tenancy.py) wakes
+# up every MAINTENANCE_TICK seconds and runs the jobs that are due (WAL checkpoint, PRAGMA optimize,
+# ANALYZE, incremental vacuum, expired-row cleanup) within a time budget. When
+# the WAL is growing fast (steady confirmations) jobs are postponed so they do
+# not compete with writers. When several app processes share a database only
+# the one holding its `<db>.maint.lock` file lock runs the jobs. Every run is logged and kept in a small ring buffer
+# exposed through maintenance_stats().
+
+log = logging.getLogger(__name__)
+
+MAINTENANCE_ENABLED = os.environ.get("BARBARAPP_MAINTENANCE", "1") != "0"
+MAINTENANCE_TICK = float(os.environ.get("BARBARAPP_MAINT_TICK", 30))
+# wall-time budget for all jobs of one tick; a job running past it is interrupted
+MAINTENANCE_BUDGET_MS = float(os.environ.get("BARBARAPP_MAINT_BUDGET_MS", 500))
+# postpone maintenance while the WAL grows faster than this (bytes per second)
+MAINTENANCE_BACKOFF_WAL_RATE = float(os.environ.get("BARBARAPP_MAINT_BACKOFF_WAL_RATE", 256 * 1024))
+# ...or while the WAL was written less than this many seconds ago (the file is
+# reused after a checkpoint, so its size alone does not show steady traffic)
+MAINTENANCE_QUIET_SECONDS = float(os.environ.get("BARBARAPP_MAINT_QUIET_SECONDS", 2))
+# never postpone more than this many seconds in a row
+MAINTENANCE_MAX_BACKOFF = float(os.environ.get("BARBARAPP_MAINT_MAX_BACKOFF", 600))
+INCREMENTAL_VACUUM_PAGES = int(os.environ.get("BARBARAPP_MAINT_VACUUM_PAGES", 256))
+
+_DEFAULT_INTERVALS = {
+    "checkpoint": 300,
+    "optimize": 3600,
+    "analyze": 86400,
+    "incremental_vacuum": 3600,
+    "purge": 3600,
+}
+
+_jobs = {}  # name -> {"func", "interval"}
+_next_run = {}  # (db path, job name) -> timestamp
+_stats = deque(maxlen=200)
+_lock = threading.Lock()
+_threads = {}  # db path -> thread
+_leader_locks = {}  # db path -> open lock file, held for the life of the process
+
+
+def _interval(name: str, default: float) -> float:
+    return float(os.environ.get(f"BARBARAPP_MAINT_{name.upper()}_INTERVAL", default))
+
+
+def register_job(name: str, func, interval: float):
+    """Register func(conn) -> dict as a maintenance job run every `interval` seconds.
+
+    The interval can be overridden with BARBARAPP_MAINT_<NAME>_INTERVAL; an
+    interval <= 0 disables the job. The returned dict is merged into the run's
+    stats record.
+    """
+    interval = _interval(name, interval)
+    with _lock:
+        if interval <= 0:
+            _jobs.pop(name, None)
+            return
+        _jobs[name] = {"func": func, "interval": interval}
+
+
+def _wal_size(path: str) -> int:
+    wal = Path(f"{path}-wal")
+    return wal.stat().st_size if wal.exists() else 0
+
+
+def _wal_idle_seconds(path: str) -> float:
+    wal = Path(f"{path}-wal")
+    return time.time() - wal.stat().st_mtime if wal.exists() else float("inf")
+
+
+def _job_checkpoint(conn):
+    busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    if not busy and log_frames == checkpointed:
+        # every frame is in the database file; rewind the WAL so it stops growing
+        busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return {"wal_frames": log_frames, "wal_pages_checkpointed": checkpointed, "busy": bool(busy)}
+
+
+def _job_optimize(conn):
+    conn.execute("PRAGMA analysis_limit = 400")
+    conn.execute("PRAGMA optimize")
+    return {}
+
+
+def _job_analyze(conn):
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    return {}
+
+
+def _job_incremental_vacuum(conn):
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if mode != 2:
+        # auto_vacuum=INCREMENTAL only takes effect on new databases (or after a VACUUM)
+        return {"freelist_pages": before, "freelist_pages_reclaimed": 0, "note": "auto_vacuum not incremental"}
+    # executescript steps the pragma to completion; execute() frees a single page
+    conn.executescript(f"PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES});")
+    after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {"freelist_pages": after, "freelist_pages_reclaimed": before - after}
+
+
+def _job_purge(conn):
+    now = time.time()
+    sessions = q.execute(conn, q.SESSIONS_PURGE, (int(now),)).rowcount
+    sessions += q.execute(conn, q.RESUMES_PURGE, (int(now),)).rowcount
+    # throttle buckets untouched for a day have long refilled
+    throttle = q.execute(conn, q.THROTTLE_PURGE, (now - 86400,)).rowcount
+    conn.commit()
+    return {"rows_purged": sessions + throttle}
+
+
+for _name, _func in (
+    ("checkpoint", _job_checkpoint),
+    ("optimize", _job_optimize),
+    ("analyze", _job_analyze),
+    ("incremental_vacuum", _job_incremental_vacuum),
+    ("purge", _job_purge),
+):
+    register_job(_name, _func, _DEFAULT_INTERVALS[_name])
+register_job("backup", _scheduled_snapshot, BACKUP_INTERVAL)
+register_job("feeds", _scheduled_feed, FEED_INTERVAL)
+register_job("rollups", _scheduled_rollups, ROLLUP_INTERVAL)
+register_job("alerts", _scheduled_alerts, ALERT_INTERVAL)
+register_job("outbox", _scheduled_outbox, OUTBOX_INTERVAL)
+
+
+def _is_leader(path: str) -> bool:
+    """True when this process runs maintenance for path (non-blocking file lock)."""
+    if fcntl is None or path in _leader_locks:
+        return True
+    f = open(f"{path}.maint.lock", "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _leader_locks[path] = f
+    return True
+
+
+def _record(entry: dict):
+    _stats.append(entry)
+    log.info("maintenance %s", entry)
+
+
+def run_due_jobs(path: str = None, force: bool = False) -> list:
+    """Run the jobs that are due (all jobs when force=True) within the time budget."""
+    p = path or get_db_path()
+    now = time.time()
+    with _lock:
+        for n, j in _jobs.items():
+            _next_run.setdefault((p, n), now + min(j["interval"], MAINTENANCE_TICK))
+        due = [(n, j) for n, j in _jobs.items() if force or _next_run[(p, n)] <= now]
+    if not due:
+        return []
+    conn = get_conn(p)
+    deadline = time.monotonic() + MAINTENANCE_BUDGET_MS / 1000
+    # returning True from the progress handler interrupts the running statement
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+    results = []
+    try:
+        for name, job in sorted(due, key=lambda x: _next_run[(p, x[0])]):
+            if time.monotonic() > deadline:
+                break
+            wal_before = _wal_size(p)
+            started = time.perf_counter()
+            entry = {"job": name, "db": p, "started_at": time.time()}
+            try:
+                entry.update(job["func"](conn) or {})
+                entry["status"] = "ok"
+            except Exception as e:
+                entry["status"] = "interrupted" if "interrupt" in str(e).lower() else "error"
+                entry["error"] = str(e)
+            entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            entry["wal_bytes_before"] = wal_before
+            entry["wal_bytes_after"] = _wal_size(p)
+            with _lock:
+                _next_run[(p, name)] = time.time() + job["interval"]
+            _record(entry)
+            results.append(entry)
+    finally:
+        conn.set_progress_handler(None, 0)
+        conn.close()
+    return results
+
+
+def _loop(path: str):
+    last_wal = _wal_size(path)
+    last_check = time.monotonic()
+    postponed_since = None
+    while True:
+        time.sleep(MAINTENANCE_TICK)
+        try:
+            if not _is_leader(path):
+                # another process maintains this database; retry in case it exits
+                continue
+            wal = _wal_size(path)
+            now = time.monotonic()
+            rate = max(0, wal - last_wal) / max(now - last_check, 1e-6)
+            last_wal, last_check = wal, now
+            idle = _wal_idle_seconds(path)
+            if rate > MAINTENANCE_BACKOFF_WAL_RATE or idle < MAINTENANCE_QUIET_SECONDS:
+                postponed_since = postponed_since or now
+                if now - postponed_since < MAINTENANCE_MAX_BACKOFF:
+                    _record({
+                        "job": "*", "db": path, "status": "backoff", "started_at": time.time(),
+                        "wal_growth_bytes_per_s": round(rate), "wal_idle_s": round(idle, 2),
+                    })
+                    continue
+            postponed_since = None
+            run_due_jobs(path)
+            last_wal = _wal_size(path)
+        except Exception:
+            log.exception("maintenance tick failed")
+
+
+def start_maintenance(path: str = None):
+    """Start the maintenance thread for a database once per server process (idempotent)."""
+    if not MAINTENANCE_ENABLED:
+        return None
+    p = path or get_db_path()
+    with _lock:
+        thread = _threads.get(p)
+        if thread is not None and thread.is_alive():
+            return thread
+        thread = threading.Thread(target=_loop, args=(p,), name=f"db-maintenance:{Path(p).stem}", daemon=True)
+        _threads[p] = thread
+        thread.start()
+        return thread
+
+
+def maintenance_stats() -> list:
+    """Most recent maintenance runs, newest last."""
+    return list(_stats)
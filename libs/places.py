@@ -0,0 +1,59 @@
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from urllib.parse import urlparse
+import validators
+
+DISPLAY_MAX_LEN = 40
+DISPLAY_PART_MAX_LEN = 24
+
+
+class NormalizedPlace(NamedTuple):
+    text: Optional[str]
+    url: Optional[str]
+    host: Optional[str]
+    display: str
+
+
+def _truncate(s: str, n: int) -> str:
+    return s if len(s) <= n else s[:n] + "..."
+
+
+@lru_cache(maxsize=2048)
+def _normalize(s: str) -> NormalizedPlace:
+    display = s
+    url = None
+    host = None
+    try:
+        if validators.url(s):
+            url = s
+            p = urlparse(s)
+            host = p.netloc.replace("www.", "")
+            path = p.path.rstrip("/")
+            if path:
+                display = f"{host}{_truncate(path, DISPLAY_PART_MAX_LEN)}"
+            elif p.query:
+                display = f"{host}?{_truncate(p.query, DISPLAY_PART_MAX_LEN)}"
+            else:
+                display = host
+    except Exception:
+        display = s
+    if len(display) > DISPLAY_MAX_LEN:
+        display = display[:DISPLAY_MAX_LEN - 3] + "..."
+    return NormalizedPlace(s, url, host, display)
+
+
+def normalize_place(place) -> NormalizedPlace:
+    """Normalize a place string (free text or URL) once.
+
+    Returns the original text, the URL (when the text is a valid URL), the parsed
+    host and a short human-friendly display label (domain/path or truncated text).
+    Results are memoized, so ad-hoc callers (CSV preview, editors) can call this
+    freely; the import and edit paths store the result on the `matches` row.
+    """
+    # pandas editors hand back NaN for empty cells
+    if place is None or (isinstance(place, float) and place != place):
+        return NormalizedPlace(None, None, None, "")
+    s = str(place)
+    if not s:
+        return NormalizedPlace(None, None, None, "")
+    return _normalize(s)
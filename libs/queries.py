@@ -0,0 +1,511 @@
+import json
+import threading
+from collections import Counter
+from typing import NamedTuple
+from libs.db import EVENT_CANCELLED, EVENT_CONFIRMED, EVENT_USER_CREATED, OUTBOX_FAILED, OUTBOX_PENDING, OUTBOX_SENT
+from libs.db import STATUS_CONFIRMED
+
+# Every SQL statement used by the app lives here, in a fixed parameterized form.
+#
+# Keeping the text constant lets sqlite3 reuse prepared statements from the
+# per-connection cache (see STATEMENT_CACHE_SIZE in libs/db.py). Variable-length
+# lists are passed as a single JSON array and expanded with json_each() instead
+# of building "IN (?,?,...)" strings. Each call is counted per statement name;
+# statement_counts() exposes the counters. Status and event kind codes are
+# interpolated once at import time, so the text stays constant.
+
+
+class Statement(NamedTuple):
+    name: str
+    sql: str
+
+
+STATEMENTS = {}
+_counts = Counter()
+_counts_lock = threading.Lock()
+
+
+def _stmt(name: str, sql: str) -> Statement:
+    s = Statement(name, " ".join(sql.split()))
+    STATEMENTS[name] = s
+    return s
+
+
+def _count(stmt: Statement, n: int = 1):
+    with _counts_lock:
+        _counts[stmt.name] += n
+
+
+def execute(conn, stmt: Statement, params=()):
+    _count(stmt)
+    return conn.execute(stmt.sql, params)
+
+
+def executemany(conn, stmt: Statement, seq_of_params):
+    _count(stmt)
+    return conn.executemany(stmt.sql, seq_of_params)
+
+
+def fetch_one(conn, stmt: Statement, params=()):
+    return execute(conn, stmt, params).fetchone()
+
+
+def fetch_all(conn, stmt: Statement, params=()):
+    return execute(conn, stmt, params).fetchall()
+
+
+def json_list(values) -> str:
+    """Encode a list parameter for the json_each() forms below."""
+    return json.dumps(list(values))
+
+
+def statement_counts() -> dict:
+    """Calls per statement name since start (or the last reset)."""
+    with _counts_lock:
+        return dict(_counts)
+
+
+def reset_statement_counts():
+    with _counts_lock:
+        _counts.clear()
+
+
+# --- users ------------------------------------------------------------------
+
+USER_COUNT = _stmt("user_count", "SELECT COUNT(1) AS c FROM users")
+USER_BY_ID = _stmt("user_by_id", "SELECT * FROM users WHERE id = ?")
+USER_BY_USERNAME = _stmt("user_by_username", "SELECT * FROM users WHERE username = ?")
+USER_ID_BY_USERNAME = _stmt("user_id_by_username", "SELECT id FROM users WHERE username = ?")
+USERS_LIST = _stmt("users_list", "SELECT id, username, role, nickname, created_at FROM users ORDER BY id")
+USERS_BY_IDS = _stmt(
+    "users_by_ids",
+    "SELECT id, username, role FROM users WHERE id IN (SELECT value FROM json_each(?)) ORDER BY username",
+)
+USERNAMES_EXISTING = _stmt(
+    "usernames_existing", "SELECT username FROM users WHERE username IN (SELECT value FROM json_each(?))"
+)
+USER_IDS_BY_USERNAMES = _stmt(
+    "user_ids_by_usernames", "SELECT username, id FROM users WHERE username IN (SELECT value FROM json_each(?))"
+)
+# params: (query, pattern, pattern, role, role); empty query / NULL role disable a filter
+_USERS_FILTER = (
+    "(? = '' OR username LIKE ? ESCAPE '\\' OR nickname LIKE ? ESCAPE '\\') AND (? IS NULL OR role = ?)"
+)
+USERS_SEARCH_COUNT = _stmt("users_search_count", f"SELECT COUNT(1) AS c FROM users WHERE {_USERS_FILTER}")
+USERS_SEARCH = _stmt(
+    "users_search",
+    f"SELECT id, username, role, nickname, created_at FROM users WHERE {_USERS_FILTER} ORDER BY username LIMIT ? OFFSET ?",
+)
+ADMINS_REMAINING = _stmt(
+    "admins_remaining",
+    "SELECT COUNT(1) AS c FROM users WHERE role = 'admin' AND id NOT IN (SELECT value FROM json_each(?))",
+)
+USER_INSERT = _stmt(
+    "user_insert",
+    "INSERT INTO users (username, password_hash, nickname, role, force_password_change, created_at, updated_at) "
+    "VALUES (?,?,?,?,?,?,?)",
+)
+USER_SET_PASSWORD = _stmt(
+    "user_set_password", "UPDATE users SET password_hash = ?, force_password_change = ?, updated_at = ? WHERE id = ?"
+)
+USER_SET_NICKNAME = _stmt("user_set_nickname", "UPDATE users SET nickname = ?, updated_at = ? WHERE id = ?")
+USER_SET_ROLE = _stmt("user_set_role", "UPDATE users SET role = ?, updated_at = ? WHERE id = ?")
+USERS_DELETE = _stmt("users_delete", "DELETE FROM users WHERE id IN (SELECT value FROM json_each(?))")
+
+# --- sessions and login throttling ------------------------------------------
+
+SESSION_INSERT = _stmt("session_insert", "INSERT INTO sessions (id, user_id, created_at, expires_at) VALUES (?,?,?,?)")
+SESSION_GET = _stmt("session_get", "SELECT user_id, expires_at FROM sessions WHERE id = ? AND revoked_at IS NULL")
+SESSION_REVOKE = _stmt("session_revoke", "UPDATE sessions SET revoked_at = ? WHERE id = ? AND revoked_at IS NULL")
+SESSIONS_REVOKE_FOR_USERS = _stmt(
+    "sessions_revoke_for_users",
+    "UPDATE sessions SET revoked_at = ? WHERE user_id IN (SELECT value FROM json_each(?)) AND revoked_at IS NULL",
+)
+SESSIONS_PURGE = _stmt("sessions_purge", "DELETE FROM sessions WHERE expires_at <= ? OR revoked_at IS NOT NULL")
+RESUME_INSERT = _stmt("resume_insert", "INSERT INTO session_resumes (id, session_id, expires_at) VALUES (?, ?, ?)")
+RESUME_DELETE = _stmt("resume_delete", "DELETE FROM session_resumes WHERE id = ?")
+# uses up a resume token: the row is gone whether or not it was still valid
+RESUME_TAKE = _stmt(
+    "resume_take",
+    "DELETE FROM session_resumes WHERE id = ? RETURNING session_id, expires_at",
+)
+RESUMES_PURGE = _stmt(
+    "resumes_purge",
+    "DELETE FROM session_resumes WHERE expires_at <= ? OR session_id NOT IN (SELECT id FROM sessions)",
+)
+THROTTLE_GET = _stmt("throttle_get", "SELECT tokens, updated_at FROM login_throttle WHERE key = ?")
+# take one token if the refilled bucket has one; no row comes back when it is empty.
+# params: key, capacity, now, refill per second, refill per second
+THROTTLE_TAKE = _stmt(
+    "throttle_take",
+    "INSERT INTO login_throttle (key, tokens, updated_at) VALUES (?, ? - 1, ?) "
+    "ON CONFLICT(key) DO UPDATE SET "
+    "tokens = MIN(excluded.tokens + 1, tokens + (excluded.updated_at - updated_at) * ?) - 1, "
+    "updated_at = excluded.updated_at "
+    "WHERE MIN(excluded.tokens + 1, tokens + (excluded.updated_at - updated_at) * ?) >= 1 "
+    "RETURNING tokens, updated_at",
+)
+THROTTLE_DELETE = _stmt("throttle_delete", "DELETE FROM login_throttle WHERE key = ?")
+THROTTLE_PURGE = _stmt("throttle_purge", "DELETE FROM login_throttle WHERE updated_at <= ?")
+
+# --- cross-process cache coherence (libs/coherence.py) ----------------------
+
+GENERATION_BUMP = _stmt(
+    "generation_bump",
+    "INSERT INTO cache_generations (name, generation) VALUES (?, 1) "
+    "ON CONFLICT(name) DO UPDATE SET generation = generation + 1",
+)
+GENERATIONS_ALL = _stmt("generations_all", "SELECT name, generation FROM cache_generations")
+
+# --- matches ----------------------------------------------------------------
+
+_MATCH_COLUMNS = "id, match_number, date, opponents_team, home_or_away, place_text, place_parsed_url"
+MATCH_BY_ID = _stmt("match_by_id", f"SELECT {_MATCH_COLUMNS} FROM matches WHERE id = ?")
+MATCH_BY_DATE = _stmt("match_by_date", f"SELECT {_MATCH_COLUMNS} FROM matches WHERE date = ?")
+MATCH_BY_NUMBER = _stmt("match_by_number", f"SELECT {_MATCH_COLUMNS} FROM matches WHERE match_number = ?")
+MATCHES_ALL = _stmt("matches_all", f"SELECT {_MATCH_COLUMNS} FROM matches ORDER BY date")
+MATCHES_BY_DATES = _stmt(
+    "matches_by_dates",
+    f"SELECT {_MATCH_COLUMNS} FROM matches WHERE date IN (SELECT value FROM json_each(?)) ORDER BY date",
+)
+# calendar page in one statement: confirmation count, the latest confirmed names
+# (JSON array, at most ? of them) and the last history change of every match
+MATCHES_CALENDAR = _stmt(
+    "matches_calendar",
+    f"""
+    SELECT m.id, m.match_number, m.date, m.opponents_team, m.home_or_away, m.place_display,
+           (SELECT COUNT(1) FROM attendance a WHERE a.match_id = m.id AND a.status = {STATUS_CONFIRMED}) AS confirmed,
+           (SELECT json_group_array(name) FROM (
+                SELECT COALESCE(u.nickname, u.username) AS name
+                FROM attendance a JOIN users u ON a.user_id = u.id
+                WHERE a.match_id = m.id AND a.status = {STATUS_CONFIRMED}
+                ORDER BY a.updated_at DESC LIMIT ?
+           )) AS names,
+           (SELECT MAX(e.ts) FROM events e
+            WHERE e.entity = m.id AND e.kind IN ({EVENT_CONFIRMED}, {EVENT_CANCELLED})) AS last_change
+    FROM matches m
+    ORDER BY m.date
+    """,
+)
+# matches with their confirmation count, from a date on ('' for all); feeds and the JSON API
+MATCHES_WITH_COUNTS = _stmt(
+    "matches_with_counts",
+    f"""
+    SELECT m.id, m.match_number, m.date, m.opponents_team, m.home_or_away, m.place_text, m.place_parsed_url,
+           m.place_display, COALESCE(m.updated_at, m.created_at) AS changed_at,
+           (SELECT COUNT(1) FROM attendance a WHERE a.match_id = m.id AND a.status = {STATUS_CONFIRMED}) AS confirmed
+    FROM matches m
+    WHERE m.date >= ?
+    ORDER BY m.date
+    """,
+)
+MATCH_COUNT = _stmt("match_count", "SELECT COUNT(1) AS c FROM matches")
+# fingerprint: libs/fingerprints.match_fingerprint() of the written fields (None: computed when needed)
+MATCH_INSERT = _stmt(
+    "match_insert",
+    "INSERT INTO matches (match_number, date, opponents_team, home_or_away, place_text, place_parsed_url, "
+    "place_display, place_host, source_import, created_by, created_at, fingerprint) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+)
+MATCH_UPDATE = _stmt(
+    "match_update",
+    "UPDATE matches SET match_number = ?, date = ?, opponents_team = ?, home_or_away = ?, place_text = ?, "
+    "place_parsed_url = ?, place_display = ?, place_host = ?, updated_at = ?, source_import = ?, fingerprint = ? "
+    "WHERE id = ?",
+)
+# calendar editor: edits keep the row's original source_import
+MATCH_EDIT = _stmt(
+    "match_edit",
+    "UPDATE matches SET date = ?, opponents_team = ?, home_or_away = ?, place_text = ?, place_parsed_url = ?, "
+    "place_display = ?, place_host = ?, updated_at = ?, fingerprint = ? WHERE id = ?",
+)
+# the whole calendar with stored fingerprints, for MatchIndex (libs/fingerprints.py)
+MATCH_FINGERPRINTS = _stmt("match_fingerprints", f"SELECT {_MATCH_COLUMNS}, fingerprint FROM matches")
+
+# --- imports (libs/fingerprints.py) -------------------------------------------
+# the generation parameter is the name of the matches generation (libs/coherence.py)
+
+IMPORT_BY_HASH = _stmt(
+    "import_by_hash",
+    """
+    SELECT i.id, i.created_at, i.row_count, i.matches_generation,
+           COALESCE((SELECT g.generation FROM cache_generations g WHERE g.name = ?), 0) AS current_generation
+    FROM imports i WHERE i.source_hash = ?
+    ORDER BY i.id DESC LIMIT 1
+    """,
+)
+IMPORT_INSERT = _stmt(
+    "import_insert",
+    "INSERT INTO imports (uploader_id, source_text, source_hash, row_count, created_at, matches_generation) "
+    "VALUES (?, ?, ?, ?, ?, COALESCE((SELECT g.generation FROM cache_generations g WHERE g.name = ?), 0))",
+)
+MATCH_DELETE_BY_NUMBER = _stmt("match_delete_by_number", "DELETE FROM matches WHERE match_number = ?")
+
+# --- attendance -------------------------------------------------------------
+
+ATTENDANCE_CONFIRMED_ID = _stmt(
+    "attendance_confirmed_id",
+    f"SELECT id FROM attendance WHERE match_id = ? AND user_id = ? AND status = {STATUS_CONFIRMED}",
+)
+ATTENDANCE_CONFIRMED_MATCHES = _stmt(
+    "attendance_confirmed_matches", f"SELECT match_id FROM attendance WHERE user_id = ? AND status = {STATUS_CONFIRMED}"
+)
+ATTENDANCE_INSERT = _stmt(
+    "attendance_insert",
+    "INSERT INTO attendance (match_id, user_id, status, updated_at, updated_by, nickname_at_time) VALUES (?,?,?,?,?,?)",
+)
+ATTENDANCE_DELETE = _stmt("attendance_delete", "DELETE FROM attendance WHERE id = ?")
+
+# --- event log (libs/events.py) ---------------------------------------------
+# match kinds are below EVENT_USER_CREATED and their entity is a match id; user
+# kinds start there and their entity is a user id
+
+EVENT_INSERT = _stmt("event_insert", "INSERT INTO events (ts, kind, entity, subject, actor, data) VALUES (?,?,?,?,?,?)")
+EVENTS_MAX_ID = _stmt("events_max_id", "SELECT COALESCE(MAX(id), 0) AS m FROM events")
+# newest events of the given kinds (JSON array): one backward scan of idx_events_timeline
+EVENTS_RECENT = _stmt(
+    "events_recent",
+    f"""
+    SELECT e.id, e.ts, e.kind, e.data,
+           m.match_number, m.date AS match_date, m.opponents_team,
+           COALESCE(u.username, target.username) AS username,
+           actor.username AS actor_username
+    FROM events e
+    LEFT JOIN matches m ON e.kind < {EVENT_USER_CREATED} AND m.id = e.entity
+    LEFT JOIN users target ON e.kind >= {EVENT_USER_CREATED} AND target.id = e.entity
+    LEFT JOIN users u ON u.id = e.subject
+    LEFT JOIN users actor ON actor.id = e.actor
+    WHERE e.kind IN (SELECT value FROM json_each(?))
+    ORDER BY e.ts DESC
+    LIMIT ?
+    """,
+)
+
+# --- full-text search (libs/search.py) ---------------------------------------
+# each takes an FTS5 query (the event ones also a JSON array of kinds); results
+# come best match first (bm25 rank), with `text` holding the indexed columns
+# for the fuzzy re-scoring
+
+SEARCH_MATCHES_COUNT = _stmt("search_matches_count", "SELECT COUNT(1) AS c FROM matches_fts WHERE matches_fts MATCH ?")
+SEARCH_MATCHES = _stmt(
+    "search_matches",
+    """
+    SELECT m.id, m.match_number, m.date, m.opponents_team, m.home_or_away, m.place_display,
+           COALESCE(m.opponents_team, '') || ' ' || COALESCE(m.place_text, '') AS text
+    FROM matches_fts JOIN matches m ON m.id = matches_fts.rowid
+    WHERE matches_fts MATCH ?
+    ORDER BY matches_fts.rank
+    LIMIT ? OFFSET ?
+    """,
+)
+SEARCH_USERS_COUNT = _stmt("search_users_count", "SELECT COUNT(1) AS c FROM users_fts WHERE users_fts MATCH ?")
+SEARCH_USERS = _stmt(
+    "search_users",
+    """
+    SELECT u.id, u.username, u.nickname, u.role, u.created_at,
+           u.username || ' ' || COALESCE(u.nickname, '') AS text
+    FROM users_fts JOIN users u ON u.id = users_fts.rowid
+    WHERE users_fts MATCH ?
+    ORDER BY users_fts.rank
+    LIMIT ? OFFSET ?
+    """,
+)
+SEARCH_EVENTS_COUNT = _stmt(
+    "search_events_count",
+    "SELECT COUNT(1) AS c FROM events_fts JOIN events e ON e.id = events_fts.rowid "
+    "WHERE events_fts MATCH ? AND e.kind IN (SELECT value FROM json_each(?))",
+)
+SEARCH_EVENTS = _stmt(
+    "search_events",
+    f"""
+    SELECT e.id, e.ts, e.kind, e.data,
+           m.match_number, m.date AS match_date, m.opponents_team,
+           COALESCE(u.username, target.username) AS username,
+           actor.username AS actor_username,
+           e.data AS text
+    FROM events_fts
+    JOIN events e ON e.id = events_fts.rowid
+    LEFT JOIN matches m ON e.kind < {EVENT_USER_CREATED} AND m.id = e.entity
+    LEFT JOIN users target ON e.kind >= {EVENT_USER_CREATED} AND target.id = e.entity
+    LEFT JOIN users u ON u.id = e.subject
+    LEFT JOIN users actor ON actor.id = e.actor
+    WHERE events_fts MATCH ? AND e.kind IN (SELECT value FROM json_each(?))
+    ORDER BY events_fts.rank
+    LIMIT ? OFFSET ?
+    """,
+)
+
+# --- exports (libs/export.py) -------------------------------------------------
+# rows with id > ? (the incremental watermark) in a date range, in id order;
+# matches and attendance filter on the match date (ISO text), events on ts (epoch)
+
+_EXPORT_MATCHES_WHERE = "m.date >= ? AND m.date <= ? AND m.id > ?"
+EXPORT_MATCHES_COUNT = _stmt("export_matches_count", f"SELECT COUNT(1) AS c FROM matches m WHERE {_EXPORT_MATCHES_WHERE}")
+EXPORT_MATCHES = _stmt(
+    "export_matches",
+    f"""
+    SELECT m.id, m.match_number, m.date, m.opponents_team, m.home_or_away, m.place_text, m.place_parsed_url,
+           m.place_display, m.source_import, m.created_by, m.created_at, m.updated_at
+    FROM matches m
+    WHERE {_EXPORT_MATCHES_WHERE}
+    ORDER BY m.id
+    """,
+)
+_EXPORT_ATTENDANCE_WHERE = "m.date >= ? AND m.date <= ? AND a.id > ?"
+EXPORT_ATTENDANCE_COUNT = _stmt(
+    "export_attendance_count",
+    f"SELECT COUNT(1) AS c FROM attendance a JOIN matches m ON m.id = a.match_id WHERE {_EXPORT_ATTENDANCE_WHERE}",
+)
+EXPORT_ATTENDANCE = _stmt(
+    "export_attendance",
+    f"""
+    SELECT a.id, a.match_id, m.match_number, m.date AS match_date, a.user_id, u.username,
+           a.nickname_at_time, a.status, a.updated_at, a.updated_by
+    FROM attendance a JOIN matches m ON m.id = a.match_id LEFT JOIN users u ON u.id = a.user_id
+    WHERE {_EXPORT_ATTENDANCE_WHERE}
+    ORDER BY a.id
+    """,
+)
+_EXPORT_EVENTS_WHERE = "e.ts >= ? AND e.ts < ? AND e.id > ?"
+EXPORT_EVENTS_COUNT = _stmt("export_events_count", f"SELECT COUNT(1) AS c FROM events e WHERE {_EXPORT_EVENTS_WHERE}")
+EXPORT_EVENTS = _stmt(
+    "export_events",
+    f"SELECT e.id, e.ts, e.kind, e.entity, e.subject, e.actor, e.data FROM events e WHERE {_EXPORT_EVENTS_WHERE} ORDER BY e.id",
+)
+EXPORT_WATERMARK = _stmt("export_watermark", "SELECT last_id, exported_at FROM export_state WHERE name = ?")
+EXPORT_WATERMARK_SET = _stmt(
+    "export_watermark_set",
+    "INSERT INTO export_state (name, last_id, exported_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET last_id = MAX(last_id, excluded.last_id), exported_at = excluded.exported_at",
+)
+
+# --- threshold alerts and outbox (libs/alerts.py) ----------------------------
+
+_MATCH_CONFIRMED = f"(SELECT COUNT(1) FROM attendance a WHERE a.match_id = m.id AND a.status = {STATUS_CONFIRMED})"
+# matches dated from ? to ? (ISO) with fewer than ? confirmations
+ALERT_MATCHES_BELOW = _stmt(
+    "alert_matches_below",
+    f"""
+    SELECT m.id, m.match_number, m.date, m.opponents_team, m.home_or_away, m.place_display,
+           {_MATCH_CONFIRMED} AS confirmed
+    FROM matches m
+    WHERE m.date >= ? AND m.date <= ? AND confirmed < ?
+    ORDER BY m.date
+    """,
+)
+# matches from date ? on, still below ? confirmations, where a cancellation among
+# the events after < id <= upto took the count from the threshold (?) to one less;
+# last_cancel is the latest such cancellation. The count after each event is
+# rebuilt from the current one and a running sum over the window.
+ALERT_MATCHES_DROPPED = _stmt(
+    "alert_matches_dropped",
+    f"""
+    WITH w AS (
+        SELECT e.id, e.entity, e.kind,
+               SUM(CASE WHEN e.kind = {EVENT_CONFIRMED} THEN 1 ELSE -1 END)
+                   OVER (PARTITION BY e.entity ORDER BY e.id ROWS UNBOUNDED PRECEDING) AS running,
+               SUM(CASE WHEN e.kind = {EVENT_CONFIRMED} THEN 1 ELSE -1 END) OVER (PARTITION BY e.entity) AS net
+        FROM events e
+        WHERE e.id > ? AND e.id <= ? AND e.kind IN ({EVENT_CONFIRMED}, {EVENT_CANCELLED})
+    )
+    SELECT m.id, m.match_number, m.date, m.opponents_team, m.home_or_away, m.place_display,
+           {_MATCH_CONFIRMED} AS confirmed, MAX(w.id) AS last_cancel
+    FROM w JOIN matches m ON m.id = w.entity
+    WHERE m.date >= ? AND confirmed < ? AND w.kind = {EVENT_CANCELLED} AND confirmed - w.net + w.running = ? - 1
+    GROUP BY m.id
+    ORDER BY m.date
+    """,
+)
+OUTBOX_ENQUEUE = _stmt(
+    "outbox_enqueue",
+    "INSERT INTO outbox (dedup_key, match_id, recipient, subject, body, next_attempt_at, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(dedup_key) DO NOTHING",
+)
+# pending messages due at ? (oldest first), at most ?
+OUTBOX_DUE = _stmt(
+    "outbox_due",
+    f"""
+    SELECT id, recipient, subject, body, attempts FROM outbox
+    WHERE status = {OUTBOX_PENDING} AND next_attempt_at <= ?
+    ORDER BY next_attempt_at LIMIT ?
+    """,
+)
+OUTBOX_MARK_SENT = _stmt(
+    "outbox_mark_sent",
+    f"UPDATE outbox SET status = {OUTBOX_SENT}, attempts = attempts + 1, sent_at = ?, last_error = NULL "
+    "WHERE id IN (SELECT value FROM json_each(?))",
+)
+# params: error, next attempt time, max attempts (then the message is given up), id
+OUTBOX_MARK_RETRY = _stmt(
+    "outbox_mark_retry",
+    f"""
+    UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?,
+           status = CASE WHEN attempts + 1 >= ? THEN {OUTBOX_FAILED} ELSE {OUTBOX_PENDING} END
+    WHERE id = ?
+    """,
+)
+OUTBOX_COUNTS = _stmt("outbox_counts", "SELECT status, COUNT(1) AS c FROM outbox GROUP BY status")
+
+# --- analytics rollups (libs/analytics.py) -----------------------------------
+# the apply statements fold attendance events with after < id <= upto into the rollups;
+# the player one also takes the late-cancellation window (days) and needs the
+# season() SQL function registered on the connection
+
+_ATTENDANCE = f"e.kind IN ({EVENT_CONFIRMED}, {EVENT_CANCELLED})"
+_CONFIRMED = f"e.kind = {EVENT_CONFIRMED}"
+_CANCELLED = f"e.kind = {EVENT_CANCELLED}"
+ROLLUP_WATERMARK = _stmt("rollup_watermark", "SELECT last_event_id FROM rollup_state WHERE name = ?")
+ROLLUP_WATERMARK_SET = _stmt(
+    "rollup_watermark_set",
+    "INSERT INTO rollup_state (name, last_event_id) VALUES (?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET last_event_id = excluded.last_event_id",
+)
+ROLLUP_PLAYER_SEASON_APPLY = _stmt(
+    "rollup_player_season_apply",
+    f"""
+    INSERT INTO rollup_player_season (user_id, season, confirmations, cancellations, late_cancellations)
+    SELECT e.subject, season(m.date),
+           SUM(CASE WHEN {_CONFIRMED} THEN 1 ELSE 0 END),
+           SUM(CASE WHEN {_CANCELLED} THEN 1 ELSE 0 END),
+           SUM(CASE WHEN {_CANCELLED} AND (strftime('%s', m.date) - e.ts) / 86400.0 < ? THEN 1 ELSE 0 END)
+    FROM events e JOIN matches m ON m.id = e.entity
+    WHERE e.id > ? AND e.id <= ? AND {_ATTENDANCE}
+    GROUP BY e.subject, season(m.date)
+    ON CONFLICT(user_id, season) DO UPDATE SET
+        confirmations = confirmations + excluded.confirmations,
+        cancellations = cancellations + excluded.cancellations,
+        late_cancellations = late_cancellations + excluded.late_cancellations
+    """,
+)
+ROLLUP_MATCH_APPLY = _stmt(
+    "rollup_match_apply",
+    f"""
+    INSERT INTO rollup_match (match_id, confirmations, cancellations, last_change_at)
+    SELECT e.entity,
+           SUM(CASE WHEN {_CONFIRMED} THEN 1 ELSE 0 END),
+           SUM(CASE WHEN {_CANCELLED} THEN 1 ELSE 0 END),
+           MAX(e.ts)
+    FROM events e JOIN matches m ON m.id = e.entity
+    WHERE e.id > ? AND e.id <= ? AND {_ATTENDANCE}
+    GROUP BY e.entity
+    ON CONFLICT(match_id) DO UPDATE SET
+        confirmations = confirmations + excluded.confirmations,
+        cancellations = cancellations + excluded.cancellations,
+        last_change_at = MAX(COALESCE(last_change_at, 0), excluded.last_change_at)
+    """,
+)
+ROLLUP_PLAYER_SEASONS = _stmt(
+    "rollup_player_seasons",
+    """
+    SELECT r.user_id, COALESCE(u.nickname, u.username, '#' || r.user_id) AS player, r.season,
+           r.confirmations, r.cancellations, r.late_cancellations
+    FROM rollup_player_season r LEFT JOIN users u ON u.id = r.user_id
+    """,
+)
+ROLLUP_MATCHES = _stmt(
+    "rollup_matches",
+    """
+    SELECT m.id AS match_id, m.match_number, m.date, m.opponents_team, m.home_or_away,
+           COALESCE(r.confirmations, 0) AS confirmations, COALESCE(r.cancellations, 0) AS cancellations
+    FROM matches m LEFT JOIN rollup_match r ON r.match_id = m.id
+    """,
+)
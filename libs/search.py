@@ -0,0 +1,91 @@
+import os
+from difflib import SequenceMatcher
+from typing import NamedTuple
+from libs import queries as q
+from libs.db import get_read_conn
+from libs.events import EVENT_LABELS
+
+# Full-text search over matches, users and the event log.
+#
+# The *_fts tables (libs/db.py) use FTS5's trigram tokenizer, so a query of at
+# least MIN_QUERY_LENGTH characters matches any substring of the indexed
+# columns (prefixes included), case-insensitively, through the index. When the
+# text appears nowhere, search() falls back to fuzzy matching: the query's
+# trigrams are OR-ed, the best FUZZY_CANDIDATES hits by bm25 are re-scored
+# against their closest substring, and those reaching FUZZY_MIN_SIMILARITY are
+# kept, so "barbra" still finds "Barbara" and "madirllo" "Real Madrillo".
+
+MIN_QUERY_LENGTH = 3
+SEARCH_PAGE_SIZE = int(os.environ.get("BARBARAPP_SEARCH_PAGE_SIZE", 20))
+FUZZY_CANDIDATES = int(os.environ.get("BARBARAPP_SEARCH_FUZZY_CANDIDATES", 200))
+FUZZY_MIN_SIMILARITY = float(os.environ.get("BARBARAPP_SEARCH_FUZZY_MIN", 0.75))
+
+# scope -> (page statement, count statement)
+SCOPES = {
+    "matches": (q.SEARCH_MATCHES, q.SEARCH_MATCHES_COUNT),
+    "users": (q.SEARCH_USERS, q.SEARCH_USERS_COUNT),
+    "events": (q.SEARCH_EVENTS, q.SEARCH_EVENTS_COUNT),
+}
+
+
+class SearchResult(NamedTuple):
+    rows: list  # dicts, best match first
+    total: int  # matches over all pages
+    fuzzy: bool  # True when no exact match was found and rows are approximate
+
+
+def _trigrams(text: str) -> set:
+    t = text.lower()
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+def _similarity(query: str, text: str) -> float:
+    """Best difflib ratio between query and a same-length window of text (both lowercased)."""
+    query, text = query.lower(), text.lower()
+    n = len(query)
+    matcher = SequenceMatcher(None, b=query, autojunk=False)
+    best = 0.0
+    for i in range(max(1, len(text) - n + 1)):
+        matcher.set_seq1(text[i:i + n])
+        best = max(best, matcher.ratio())
+    return best
+
+
+def _phrase(text: str) -> str:
+    """text as one FTS5 string token (no query syntax)."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def search(scope: str, text: str, page: int = 1, page_size: int = None, kinds=None) -> SearchResult:
+    """Ranked page (1-based) of rows in scope ('matches', 'users', 'events') containing text.
+
+    kinds restricts 'events' to those event kinds (default: all).
+    """
+    text = " ".join((text or "").split())
+    if len(text) < MIN_QUERY_LENGTH:
+        return SearchResult([], 0, False)
+    stmt, count_stmt = SCOPES[scope]
+    page_size = page_size or SEARCH_PAGE_SIZE
+    offset = (max(1, int(page)) - 1) * page_size
+    grams = _trigrams(text)
+    # statement parameters after the FTS5 query
+    extra = (q.json_list(EVENT_LABELS if kinds is None else kinds),) if scope == "events" else ()
+    conn = get_read_conn()
+    try:
+        total = q.fetch_one(conn, count_stmt, (_phrase(text),) + extra)["c"]
+        if total:
+            rows = q.fetch_all(conn, stmt, (_phrase(text),) + extra + (page_size, offset))
+            return SearchResult([dict(r) for r in rows], total, False)
+        fuzzy = " OR ".join(_phrase(g) for g in sorted(grams))
+        candidates = q.fetch_all(conn, stmt, (fuzzy,) + extra + (FUZZY_CANDIDATES, 0))
+    finally:
+        conn.close()
+    scored = []
+    for r in candidates:
+        similarity = _similarity(text, r["text"] or "")
+        if similarity >= FUZZY_MIN_SIMILARITY:
+            scored.append((similarity, dict(r)))
+    # stable sort: equal scores keep the bm25 order
+    scored.sort(key=lambda s: -s[0])
+    rows = [r for _, r in scored]
+    return SearchResult(rows[offset:offset + page_size], len(rows), True)
@@ -0,0 +1,278 @@
+import hashlib
+import hmac
+import os
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from libs import coherence, queries as q
+from libs.db import get_conn, get_read_conn, DEFAULT_DB
+from libs.tenancy import DEFAULT_TENANT, current_tenant, is_served, tenant_db_path, tenant_exists
+
+# Server-side login sessions.
+#
+# A token is "<team>.<session id>.<hmac>": the id is random and stored in the
+# `sessions` table of the team's database, the HMAC (keyed with a server secret,
+# covering the team too) lets us reject forged or mangled tokens without
+# touching the database. Tokens without a team belong to the default team. Valid sessions are kept in a small
+# in-memory TTL cache so a reconnect or a new tab costs a dict lookup instead of
+# another argon2 verification. Revocations bump the "sessions" generation
+# (libs/coherence.py), so other app processes drop their cached entries too.
+#
+# A session token is a long-lived bearer secret, so it never goes into a URL:
+# the app keeps it in st.session_state, and its `s` query parameter carries a
+# resume token instead, "<team>.<resume id>.<hmac>" for a row of
+# `session_resumes`. A resume token lives RESUME_TTL seconds and is used up by
+# the reconnect (worker restart, another worker, new tab) that exchanges it for
+# the session token; the app then puts a fresh one in the URL, and replaces it
+# every RESUME_TTL / 2 while the session is in use.
+
+SESSION_TTL = int(os.environ.get("BARBARAPP_SESSION_TTL", 30 * 86400))
+RESUME_TTL = int(os.environ.get("BARBARAPP_RESUME_TTL", 12 * 3600))
+# how long a resolved session is trusted before the DB row is checked again
+CACHE_TTL = int(os.environ.get("BARBARAPP_SESSION_CACHE_TTL", 60))
+CACHE_MAX_ENTRIES = 4096
+SECRET_FILE = DEFAULT_DB.parent / ".session_secret"
+
+_cache = OrderedDict()  # (team, session id) -> (user_id, expires_at, cached_until)
+_cache_lock = threading.Lock()
+_secret = None
+
+
+def _load_secret() -> bytes:
+    env = os.environ.get("BARBARAPP_SESSION_SECRET")
+    if env:
+        return env.encode()
+    SECRET_FILE.parent.mkdir(exist_ok=True)
+    if SECRET_FILE.exists():
+        return _read_secret()
+    # written in full to a private file, then linked into place: concurrent first
+    # starts agree on whichever link lands first and never read a partial secret
+    fd, tmp = tempfile.mkstemp(dir=SECRET_FILE.parent, prefix=".session_secret.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(32))
+        os.link(tmp, SECRET_FILE)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+    return _read_secret()
+
+
+def _read_secret() -> bytes:
+    secret = SECRET_FILE.read_bytes()
+    if len(secret) < 32:
+        raise RuntimeError(f"session secret {SECRET_FILE} is truncated; delete it and restart every worker")
+    return secret
+
+
+def _sign(sid: str) -> str:
+    global _secret
+    if _secret is None:
+        _secret = _load_secret()
+    return hmac.new(_secret, sid.encode(), hashlib.sha256).hexdigest()
+
+
+def _split_token(token: str):
+    """Return (team, session id) if the token signature is valid, else None."""
+    if not token or not isinstance(token, str) or "." not in token:
+        return None
+    signed, sig = token.rsplit(".", 1)
+    if not hmac.compare_digest(sig, _sign(signed)):
+        return None
+    tenant, _, sid = signed.rpartition(".")
+    return (tenant or DEFAULT_TENANT, sid)
+
+
+def feed_key(tenant: str) -> str:
+    """Signed key that grants read-only access to a team's feeds (ICS)."""
+    return _sign(f"feed:{tenant}")[:32]
+
+
+def check_feed_key(tenant: str, key: str) -> bool:
+    return isinstance(key, str) and hmac.compare_digest(key, feed_key(tenant))
+
+
+def token_tenant(token: str):
+    """Team of a validly signed token served by this process, else None."""
+    key = _split_token(token)
+    if key is None or not is_served(key[0]) or not tenant_exists(key[0]):
+        return None
+    return key[0]
+
+
+def _cache_put(key: tuple, user_id: int, expires_at: int):
+    with _cache_lock:
+        _cache[key] = (user_id, expires_at, time.time() + CACHE_TTL)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def _drop_cached(predicate):
+    with _cache_lock:
+        for key in [k for k, v in _cache.items() if predicate(k, v)]:
+            _cache.pop(key, None)
+
+
+def clear_cache():
+    """Forget every cached session, so the next lookups read the sessions table."""
+    _drop_cached(lambda key, value: True)
+
+
+def create_session(user_id: int, conn=None) -> str:
+    """Create a new session for user_id in the active team and return its signed token."""
+    tenant = current_tenant()
+    sid = secrets.token_urlsafe(24)
+    now = int(time.time())
+    expires_at = now + SESSION_TTL
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        q.execute(conn, q.SESSION_INSERT, (sid, user_id, now, expires_at))
+        if own:
+            conn.commit()
+    finally:
+        if own:
+            conn.close()
+    _cache_put((tenant, sid), user_id, expires_at)
+    signed = f"{tenant}.{sid}"
+    return f"{signed}.{_sign(signed)}"
+
+
+def resolve_session(token: str):
+    """Return the user id for a valid, unexpired, unrevoked token, else None.
+
+    The lookup goes to the token's own team database.
+    """
+    if token_tenant(token) is None:
+        return None
+    key = _split_token(token)
+    tenant, sid = key
+    path = tenant_db_path(tenant)
+    if coherence.changed(coherence.SESSIONS, path):
+        # revoked somewhere, possibly by another process: drop this team's cached sessions
+        _drop_cached(lambda k, v: k[0] == tenant)
+    now = time.time()
+    with _cache_lock:
+        hit = _cache.get(key)
+    if hit and hit[2] > now:
+        return hit[0] if hit[1] > now else None
+    conn = get_read_conn(path)
+    try:
+        row = q.fetch_one(conn, q.SESSION_GET, (sid,))
+    finally:
+        conn.close()
+    if not row or row["expires_at"] <= now:
+        with _cache_lock:
+            _cache.pop(key, None)
+        return None
+    _cache_put(key, row["user_id"], row["expires_at"])
+    return row["user_id"]
+
+
+def _split_resume(resume: str):
+    """Return (team, resume id) if the resume token signature is valid, else None."""
+    if not resume or not isinstance(resume, str) or "." not in resume:
+        return None
+    signed, sig = resume.rsplit(".", 1)
+    # signed apart from session tokens, so neither passes for the other
+    if not hmac.compare_digest(sig, _sign(f"resume:{signed}")):
+        return None
+    tenant, _, rid = signed.rpartition(".")
+    return (tenant or DEFAULT_TENANT, rid)
+
+
+def resume_tenant(resume: str):
+    """Team of a validly signed resume token served by this process, else None."""
+    key = _split_resume(resume)
+    if key is None or not is_served(key[0]) or not tenant_exists(key[0]):
+        return None
+    return key[0]
+
+
+def issue_resume(token: str, previous: str = None):
+    """A new resume token for session `token`, revoking the resume token `previous`; None for an invalid token."""
+    if token_tenant(token) is None:
+        return None
+    tenant, sid = _split_token(token)
+    rid = secrets.token_urlsafe(24)
+    conn = get_conn(tenant_db_path(tenant))
+    try:
+        q.execute(conn, q.RESUME_INSERT, (rid, sid, int(time.time()) + RESUME_TTL))
+        old = _split_resume(previous)
+        if old and old[0] == tenant:
+            q.execute(conn, q.RESUME_DELETE, (old[1],))
+        conn.commit()
+    finally:
+        conn.close()
+    signed = f"{tenant}.{rid}"
+    return f"{signed}.{_sign(f'resume:{signed}')}"
+
+
+def exchange_resume(resume: str):
+    """Use up a resume token; returns its session token while both are valid, else None."""
+    if resume_tenant(resume) is None:
+        return None
+    tenant, rid = _split_resume(resume)
+    conn = get_conn(tenant_db_path(tenant))
+    try:
+        row = q.fetch_one(conn, q.RESUME_TAKE, (rid,))
+        conn.commit()
+    finally:
+        conn.close()
+    if row is None or row["expires_at"] <= time.time():
+        return None
+    signed = f"{tenant}.{row['session_id']}"
+    token = f"{signed}.{_sign(signed)}"
+    return token if resolve_session(token) is not None else None
+
+
+def revoke_session(token: str):
+    if token_tenant(token) is None:
+        return
+    key = _split_token(token)
+    conn = get_conn(tenant_db_path(key[0]))
+    try:
+        q.execute(conn, q.SESSION_REVOKE, (int(time.time()), key[1]))
+        coherence.bump(conn, coherence.SESSIONS)
+        conn.commit()
+    finally:
+        conn.close()
+    with _cache_lock:
+        _cache.pop(key, None)
+
+
+def revoke_user_sessions(user_id: int, conn=None):
+    """Revoke every active session of a user (password change, deletion).
+
+    When conn is given the update joins the caller's transaction.
+    """
+    revoke_users_sessions([user_id], conn)
+
+
+def revoke_users_sessions(user_ids, conn=None):
+    """Revoke the active sessions of several users of the active team in one statement."""
+    user_ids = [int(u) for u in user_ids]
+    if not user_ids:
+        return
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        q.execute(conn, q.SESSIONS_REVOKE_FOR_USERS, (int(time.time()), q.json_list(user_ids)))
+        coherence.bump(conn, coherence.SESSIONS)
+        if own:
+            conn.commit()
+    finally:
+        if own:
+            conn.close()
+    forget_users(user_ids)
+
+
+def forget_users(user_ids, tenant: str = None):
+    """Drop the cached sessions of users of a team (default: the active one) from this process."""
+    tenant = tenant or current_tenant()
+    targets = {int(u) for u in user_ids}
+    _drop_cached(lambda k, v: k[0] == tenant and v[0] in targets)
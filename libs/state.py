@@ -0,0 +1,162 @@
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Session-state accounting and compaction.
+#
+# Every open browser tab keeps its st.session_state in the server process, so
+# what pages store there is multiplied by the number of sessions. This module
+# keeps that small and measurable:
+#   - the logged-in user is stored as a slim record (SESSION_USER_FIELDS);
+#   - bulky, short-lived objects (CSV import previews) live in a process-wide
+#     store and the session only holds a handle; they expire after PREVIEW_TTL;
+#   - stale versioned widget keys are dropped at the start of each run;
+#   - record_session() measures each session's state, session_stats() sums it.
+
+SESSION_USER_FIELDS = ("id", "username", "nickname", "role")
+# keys written with an increasing version suffix: prefix -> session key naming the live one
+VERSIONED_KEYS = {"matches_confirm_editor_": "calendar.matches_editor_key"}
+
+PREVIEW_TTL = float(os.environ.get("BARBARAPP_PREVIEW_TTL", 900))
+MAX_PREVIEWS = int(os.environ.get("BARBARAPP_MAX_PREVIEWS", 64))
+# sessions not seen for this long (closed tabs) drop out of the totals
+SESSION_STATS_TTL = float(os.environ.get("BARBARAPP_SESSION_STATS_TTL", 3600))
+
+_previews = OrderedDict()  # handle -> (expires_at, value)
+_sessions = {}  # streamlit session id -> {"seen", "bytes", "keys", "largest"}
+_lock = threading.Lock()
+
+
+def slim_user(user: dict) -> dict:
+    """The fields pages read from the session user; never the password hash."""
+    return {k: user.get(k) for k in SESSION_USER_FIELDS}
+
+
+def deep_sizeof(obj, _seen=None) -> int:
+    """Approximate retained size of obj in bytes (containers and DataFrames included)."""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    memory_usage = getattr(obj, "memory_usage", None)
+    if callable(memory_usage) and hasattr(obj, "columns"):
+        return int(memory_usage(deep=True).sum())
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    return size
+
+
+# --- server-side preview store ------------------------------------------------
+
+def evict_previews(now: float = None) -> int:
+    """Drop expired previews (abandoned imports); returns how many were removed."""
+    now = now or time.time()
+    with _lock:
+        expired = [h for h, (exp, _) in _previews.items() if exp <= now]
+        for h in expired:
+            del _previews[h]
+    return len(expired)
+
+
+def put_preview(value) -> str:
+    """Keep value for PREVIEW_TTL seconds and return a handle for session state."""
+    evict_previews()
+    handle = secrets.token_urlsafe(12)
+    with _lock:
+        _previews[handle] = (time.time() + PREVIEW_TTL, value)
+        while len(_previews) > MAX_PREVIEWS:
+            _previews.popitem(last=False)
+    return handle
+
+
+def get_preview(handle):
+    if not handle:
+        return None
+    with _lock:
+        item = _previews.get(handle)
+    return item[1] if item and item[0] > time.time() else None
+
+
+def pop_preview(handle):
+    if not handle:
+        return None
+    with _lock:
+        item = _previews.pop(handle, None)
+    return item[1] if item and item[0] > time.time() else None
+
+
+# --- accounting ---------------------------------------------------------------
+
+def compact_state(state):
+    """Remove stale versioned widget keys and dangling preview handles from a session."""
+    for prefix, live_key in VERSIONED_KEYS.items():
+        live = state.get(live_key)
+        for k in [k for k in list(state.keys()) if isinstance(k, str) and k.startswith(prefix) and k != live]:
+            state.pop(k, None)
+    if "_csv_preview" in state and get_preview(state.get("_csv_preview")) is None:
+        state.pop("_csv_preview", None)
+        state.pop("_csv_detected_keys", None)
+
+
+def page_for(state, key: str, query, pages: int = None) -> int:
+    """Page of the paginator widget `key`, back to 1 whenever `query` (what it pages through) changes.
+
+    One fixed key per paginator, with the query it belongs to stored next to it,
+    instead of a key per query that would stay in the session for good. With
+    `pages` the page is also kept within the last one (e.g. after deletions).
+    """
+    if state.get(f"{key}_query") != query:
+        state[f"{key}_query"] = query
+        state[key] = 1
+    elif pages and state.get(key, 1) > pages:
+        state[key] = pages
+    return state.get(key, 1)
+
+
+def record_session(session_id: str, state) -> dict:
+    """Measure a session's state (per key) and remember it for session_stats()."""
+    sizes = {str(k): deep_sizeof(v) for k, v in list(state.items())}
+    entry = {
+        "seen": time.time(),
+        "bytes": sum(sizes.values()),
+        "keys": len(sizes),
+        "largest": max(sizes.items(), key=lambda kv: kv[1]) if sizes else None,
+    }
+    with _lock:
+        _sessions[session_id] = entry
+    return entry
+
+
+def session_stats() -> dict:
+    """Totals over the sessions seen recently in this process, plus the preview store."""
+    evict_previews()
+    cutoff = time.time() - SESSION_STATS_TTL
+    with _lock:
+        for sid in [s for s, e in _sessions.items() if e["seen"] < cutoff]:
+            del _sessions[sid]
+        sessions = {sid: dict(e) for sid, e in _sessions.items()}
+        previews = [v for _, v in _previews.values()]
+    return {
+        "sessions": len(sessions),
+        "total_bytes": sum(e["bytes"] for e in sessions.values()),
+        "per_session": sessions,
+        "previews": len(previews),
+        "preview_bytes": sum(deep_sizeof(v) for v in previews),
+    }
+
+
+def track_current_session():
+    """Compact and measure the running Streamlit session (call once per run)."""
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None
+    compact_state(st.session_state)
+    return record_session(ctx.session_id, st.session_state)
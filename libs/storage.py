@@ -0,0 +1,465 @@
+# Storage abstraction over SQLAlchemy Core.
+#
+# Repository interfaces (users, matches, attendance, events) describe
+# what the app needs from the database; the Sql*Repository classes implement
+# them with SQLAlchemy Core, so the same code runs on the default SQLite file,
+# on an in-memory engine for local checks, or on a multi-writer server database
+# once write concurrency demands it (set BARBARAPP_DATABASE_URL).
+#
+# The tables used here are declared below as portable SQLAlchemy metadata, a
+# column-for-column copy of the DDL in libs.db (scripts/check_storage.py fails
+# when the two drift apart). create_schema() creates them with that DDL on
+# SQLite, where the full-text search tables, triggers and migrations of libs.db
+# come along, and from the metadata on other databases. Writers store
+# what the app's own writers store: JSON event details, place fields and
+# fingerprints on matches. They also bump the coherence generations
+# (libs/coherence.py) in the same transaction, and revoke sessions rather than
+# deleting them, so every app process drops its cached frames and sessions.
+
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Iterable, List, Optional, Protocol
+
+from sqlalchemy import (Column, ForeignKey, Index, Integer, MetaData, Table, Text, and_, bindparam, create_engine, delete,
+                        event, func, insert, select, text, update)
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
+
+from libs import coherence
+from libs.db import (EVENT_CANCELLED, EVENT_CONFIRMED, EVENT_USER_DELETED, STATUS_CONFIRMED, apply_schema,
+                     get_db_path, now_epoch)
+from libs.events import encode_data
+from libs.fingerprints import row_fingerprint
+from libs.places import normalize_place
+from libs.sessions import forget_users
+
+# matches columns the place fields and the fingerprint are derived from
+_MATCH_FIELDS = ("match_number", "date", "opponents_team", "home_or_away", "place_text")
+
+METADATA = MetaData()
+
+Table(
+    "users", METADATA,
+    Column("id", Integer, primary_key=True),
+    Column("username", Text, unique=True, nullable=False),
+    Column("password_hash", Text, nullable=False),
+    Column("nickname", Text),
+    Column("role", Text, nullable=False, server_default=text("'giocatore'")),
+    Column("force_password_change", Integer, server_default=text("0")),
+    Column("created_at", Integer),
+    Column("updated_at", Integer),
+    sqlite_autoincrement=True,
+)
+Table(
+    "matches", METADATA,
+    Column("id", Integer, primary_key=True),
+    Column("match_number", Integer, unique=True, nullable=False),
+    Column("date", Text, unique=True, nullable=False),
+    Column("opponents_team", Text, nullable=False),
+    Column("home_or_away", Text, nullable=False),
+    Column("place_text", Text),
+    Column("place_parsed_url", Text),
+    Column("place_display", Text),
+    Column("place_host", Text),
+    Column("source_import", Text),
+    Column("created_by", Integer),
+    Column("created_at", Integer),
+    Column("updated_at", Integer),
+    Column("fingerprint", Text),
+    sqlite_autoincrement=True,
+)
+Table(
+    "attendance", METADATA,
+    Column("id", Integer, primary_key=True),
+    Column("match_id", Integer, ForeignKey("matches.id"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("status", Integer, nullable=False),
+    Column("comment", Text),
+    Column("nickname_at_time", Text),
+    Column("updated_at", Integer),
+    Column("updated_by", Integer),
+    Index("idx_attendance_match", "match_id", "status"),
+    sqlite_autoincrement=True,
+)
+Table(
+    "events", METADATA,
+    Column("id", Integer, primary_key=True),
+    Column("ts", Integer, nullable=False),
+    Column("kind", Integer, nullable=False),
+    Column("entity", Integer),
+    Column("subject", Integer),
+    Column("actor", Integer),
+    Column("data", Text),
+    Index("idx_events_timeline", "ts", "kind", "entity"),
+    Index("idx_events_entity", "entity", "kind", "ts"),
+    sqlite_autoincrement=True,
+)
+Table(
+    "sessions", METADATA,
+    Column("id", Text, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("created_at", Integer, nullable=False),
+    Column("expires_at", Integer, nullable=False),
+    Column("revoked_at", Integer),
+    Index("idx_sessions_user", "user_id"),
+)
+Table(
+    "cache_generations", METADATA,
+    Column("name", Text, primary_key=True),
+    Column("generation", Integer, nullable=False, server_default=text("0")),
+)
+
+_TABLES = SimpleNamespace(**METADATA.tables)
+
+
+def _now() -> int:
+    return now_epoch()
+
+
+def _with_derived(row: dict) -> dict:
+    """A matches row with its place fields and fingerprint computed as the app's writers do."""
+    place = normalize_place(row.get("place_text"))
+    row = dict(row, place_text=row.get("place_text"), place_parsed_url=place.url, place_display=place.display,
+               place_host=place.host)
+    return dict(row, fingerprint=row_fingerprint(row))
+
+
+# --- repository interfaces -------------------------------------------------
+
+class UserRepository(Protocol):
+    def get(self, user_id: int) -> Optional[dict]: ...
+    def get_by_username(self, username: str) -> Optional[dict]: ...
+    def list(self) -> List[dict]: ...
+    def add_many(self, rows: Iterable[dict]) -> int: ...
+    def set_password_hash(self, user_id: int, password_hash: str, force_change: bool = False) -> None: ...
+    def delete_many(self, user_ids: Iterable[int], actor: int = None) -> int: ...
+
+
+class MatchRepository(Protocol):
+    def get(self, match_id: int) -> Optional[dict]: ...
+    def list(self) -> List[dict]: ...
+    def get_by_date(self, date: str) -> Optional[dict]: ...
+    def get_by_number(self, match_number: int) -> Optional[dict]: ...
+    def add_many(self, rows: Iterable[dict]) -> int: ...
+    def update(self, match_id: int, values: dict) -> None: ...
+    def delete_by_numbers(self, match_numbers: Iterable[int]) -> int: ...
+
+
+class EventRepository(Protocol):
+    def append_many(self, rows: Iterable[dict]) -> int: ...
+    def recent(self, kinds: Iterable[int] = None, limit: int = 200) -> List[dict]: ...
+
+
+class AttendanceRepository(Protocol):
+    def confirmed_counts(self) -> dict: ...
+    def confirmed_match_ids(self, user_id: int) -> set: ...
+    def set_confirmations(self, user: dict, wanted: dict) -> tuple: ...
+
+
+# --- SQLAlchemy Core implementations ---------------------------------------
+
+class _SqlRepository:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.t = _TABLES
+
+    def _all(self, stmt, params=None) -> List[dict]:
+        with self.engine.connect() as conn:
+            return [dict(r) for r in conn.execute(stmt, params or {}).mappings()]
+
+    def _one(self, stmt, params=None) -> Optional[dict]:
+        with self.engine.connect() as conn:
+            r = conn.execute(stmt, params or {}).mappings().first()
+        return dict(r) if r else None
+
+    def _insert_many(self, table, rows, *generations) -> int:
+        rows = list(rows)
+        if not rows:
+            return 0
+        # executemany needs the same keys in every parameter set
+        keys = set().union(*rows)
+        rows = [{k: r.get(k) for k in keys} for r in rows]
+        # a list of parameter sets runs as a single executemany in one transaction
+        with self.engine.begin() as conn:
+            conn.execute(insert(table), rows)
+            self._bump(conn, *generations)
+        return len(rows)
+
+    def _bump(self, conn, *names):
+        """Advance generations in the caller's transaction, like coherence.bump."""
+        gens = self.t.cache_generations
+        for name in names:
+            if not conn.execute(update(gens).where(gens.c.name == name).values(generation=gens.c.generation + 1)).rowcount:
+                conn.execute(insert(gens).values(name=name, generation=1))
+
+    def _revoke_sessions(self, conn, user_ids, now: int):
+        """Revoke the active sessions of users, like sessions.revoke_users_sessions (the caller forgets them after commit)."""
+        sessions = self.t.sessions
+        conn.execute(
+            update(sessions).where(and_(sessions.c.user_id.in_(user_ids), sessions.c.revoked_at.is_(None)))
+            .values(revoked_at=now)
+        )
+        self._bump(conn, coherence.SESSIONS)
+
+
+class SqlUserRepository(_SqlRepository):
+    def get(self, user_id):
+        users = self.t.users
+        return self._one(select(users).where(users.c.id == user_id))
+
+    def get_by_username(self, username):
+        users = self.t.users
+        return self._one(select(users).where(users.c.username == username))
+
+    def list(self):
+        users = self.t.users
+        return self._all(
+            select(users.c.id, users.c.username, users.c.role, users.c.nickname, users.c.created_at).order_by(users.c.id)
+        )
+
+    def add_many(self, rows):
+        now = _now()
+        return self._insert_many(self.t.users, (
+            {"role": "giocatore", "force_password_change": 0, "created_at": now, "updated_at": now, **r} for r in rows
+        ), coherence.USERS)
+
+    def set_password_hash(self, user_id, password_hash, force_change=False):
+        """Store a new password hash and revoke the user's sessions, like auth.update_password."""
+        users = self.t.users
+        now = _now()
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(users).where(users.c.id == user_id).values(
+                    password_hash=password_hash, force_password_change=int(force_change), updated_at=now
+                )
+            )
+            self._revoke_sessions(conn, [user_id], now)
+        forget_users([user_id])
+
+    def delete_many(self, user_ids, actor=None):
+        """Delete users like auth.delete_users_bulk: sessions revoked, attendance kept as history, one event each."""
+        users, events = self.t.users, self.t.events
+        now = _now()
+        with self.engine.begin() as conn:
+            gone = conn.execute(
+                select(users.c.id, users.c.username).where(users.c.id.in_([int(u) for u in user_ids]))
+            ).mappings().all()
+            if not gone:
+                return 0
+            ids = [u["id"] for u in gone]
+            conn.execute(delete(users).where(users.c.id.in_(ids)))
+            self._revoke_sessions(conn, ids, now)
+            self._bump(conn, coherence.USERS)
+            # the username is kept in the event: the users row is gone
+            conn.execute(insert(events), [
+                {"ts": now, "kind": EVENT_USER_DELETED, "entity": u["id"], "subject": None, "actor": actor,
+                 "data": encode_data({"username": u["username"]})}
+                for u in gone
+            ])
+        forget_users(ids)
+        return len(ids)
+
+
+class SqlMatchRepository(_SqlRepository):
+    def get(self, match_id):
+        matches = self.t.matches
+        return self._one(select(matches).where(matches.c.id == match_id))
+
+    def list(self):
+        matches = self.t.matches
+        return self._all(select(matches).order_by(matches.c.date))
+
+    def get_by_date(self, date):
+        matches = self.t.matches
+        return self._one(select(matches).where(matches.c.date == date))
+
+    def get_by_number(self, match_number):
+        matches = self.t.matches
+        return self._one(select(matches).where(matches.c.match_number == match_number))
+
+    def add_many(self, rows):
+        now = _now()
+        return self._insert_many(self.t.matches, (_with_derived({"created_at": now, **r}) for r in rows), coherence.MATCHES)
+
+    def update(self, match_id, values):
+        matches = self.t.matches
+        with self.engine.begin() as conn:
+            if any(f in values for f in _MATCH_FIELDS):
+                current = conn.execute(
+                    select(*(matches.c[f] for f in _MATCH_FIELDS)).where(matches.c.id == match_id)
+                ).mappings().first()
+                if current is not None:
+                    values = _with_derived({**current, **values})
+            conn.execute(update(matches).where(matches.c.id == match_id).values(updated_at=_now(), **values))
+            self._bump(conn, coherence.MATCHES)
+
+    def delete_by_numbers(self, match_numbers):
+        nums = [int(n) for n in match_numbers]
+        if not nums:
+            return 0
+        matches, attendance = self.t.matches, self.t.attendance
+        with self.engine.begin() as conn:
+            ids = select(matches.c.id).where(matches.c.match_number.in_(nums)).scalar_subquery()
+            conn.execute(delete(attendance).where(attendance.c.match_id.in_(ids)))
+            deleted = conn.execute(delete(matches).where(matches.c.match_number.in_(nums))).rowcount
+            if deleted:
+                self._bump(conn, coherence.MATCHES, coherence.ATTENDANCE)
+        return deleted
+
+
+class SqlAttendanceRepository(_SqlRepository):
+    def confirmed_counts(self):
+        attendance = self.t.attendance
+        stmt = (
+            select(attendance.c.match_id, func.count().label("c"))
+            .where(attendance.c.status == STATUS_CONFIRMED)
+            .group_by(attendance.c.match_id)
+        )
+        return {r["match_id"]: r["c"] for r in self._all(stmt)}
+
+    def confirmed_match_ids(self, user_id):
+        attendance = self.t.attendance
+        stmt = select(attendance.c.match_id).where(
+            and_(attendance.c.user_id == user_id, attendance.c.status == STATUS_CONFIRMED)
+        )
+        return {r["match_id"] for r in self._all(stmt)}
+
+    def set_confirmations(self, user, wanted):
+        """Apply {match_id: bool} for a user, writing attendance and events in one transaction.
+
+        Returns (inserted, deleted) with the same semantics as the calendar save.
+        """
+        attendance, events = self.t.attendance, self.t.events
+        now = _now()
+        inserted = deleted = 0
+        with self.engine.begin() as conn:
+            current = {
+                r["match_id"]: r["id"] for r in conn.execute(
+                    select(attendance.c.id, attendance.c.match_id).where(
+                        and_(attendance.c.user_id == user["id"], attendance.c.status == STATUS_CONFIRMED)
+                    )
+                ).mappings()
+            }
+            logged = []
+            removed = []
+            for match_id, want in wanted.items():
+                match_id = int(match_id)
+                if want and match_id not in current:
+                    conn.execute(insert(attendance).values(
+                        match_id=match_id, user_id=user["id"], status=STATUS_CONFIRMED, updated_at=now,
+                        updated_by=user["id"], nickname_at_time=user.get("nickname"),
+                    ))
+                    logged.append(dict(kind=EVENT_CONFIRMED, entity=match_id))
+                    inserted += 1
+                elif not want and match_id in current:
+                    removed.append({"aid": current[match_id]})
+                    logged.append(dict(kind=EVENT_CANCELLED, entity=match_id))
+                    deleted += 1
+            if removed:
+                conn.execute(delete(attendance).where(attendance.c.id == bindparam("aid")), removed)
+            if logged:
+                conn.execute(insert(events), [
+                    {**e, "ts": now, "subject": user["id"], "actor": user["id"], "data": None} for e in logged
+                ])
+                self._bump(conn, coherence.ATTENDANCE)
+        return inserted, deleted
+
+
+class SqlEventRepository(_SqlRepository):
+    def append_many(self, rows):
+        """Append events; `data` is a details dict (stored as JSON, like EventBatch) or None."""
+        now = _now()
+        return self._insert_many(self.t.events, (
+            {"ts": now, **r, "data": encode_data(r.get("data"))} for r in rows
+        ))
+
+    def recent(self, kinds=None, limit=200):
+        events = self.t.events
+        stmt = select(events).order_by(events.c.ts.desc(), events.c.id.desc()).limit(limit)
+        if kinds is not None:
+            stmt = stmt.where(events.c.kind.in_([int(k) for k in kinds]))
+        return self._all(stmt)
+
+
+@dataclass
+class Storage:
+    engine: Engine
+    users: UserRepository
+    matches: MatchRepository
+    attendance: AttendanceRepository
+    events: EventRepository
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    # foreign keys stay unenforced as on libs.db connections: deleted users keep their attendance history
+    cur.execute("PRAGMA busy_timeout = 5000")
+    cur.close()
+
+
+def create_engine_for(url: str = None) -> Engine:
+    """Build a pooled engine; defaults to BARBARAPP_DATABASE_URL or the local SQLite file.
+
+    `sqlite://` (no path) gives a single shared in-memory database, handy for
+    local checks.
+    """
+    url = url or os.environ.get("BARBARAPP_DATABASE_URL") or f"sqlite:///{get_db_path()}"
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        engine = create_engine(url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    elif url.startswith("sqlite"):
+        engine = create_engine(url, pool_size=8, max_overflow=8, connect_args={"check_same_thread": False})
+    else:
+        engine = create_engine(url, pool_size=10, max_overflow=20, pool_pre_ping=True)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+def create_schema(engine: Engine):
+    """Create the app schema on an engine that did not go through init_db.
+
+    SQLite gets libs.db's DDL and migrations (STRICT tables, full-text search,
+    triggers); other databases get the tables declared in METADATA.
+    """
+    if engine.dialect.name != "sqlite":
+        METADATA.create_all(engine)
+        return
+    raw = engine.raw_connection()
+    try:
+        conn = raw.driver_connection
+        row_factory, conn.row_factory = conn.row_factory, sqlite3.Row
+        try:
+            apply_schema(conn)
+            conn.commit()
+        finally:
+            conn.row_factory = row_factory
+    finally:
+        raw.close()
+
+
+def create_storage(url: str = None, engine: Engine = None) -> Storage:
+    engine = engine or create_engine_for(url)
+    return Storage(
+        engine=engine,
+        users=SqlUserRepository(engine),
+        matches=SqlMatchRepository(engine),
+        attendance=SqlAttendanceRepository(engine),
+        events=SqlEventRepository(engine),
+    )
+
+
+_storages = {}  # team db path -> Storage
+_storages_lock = threading.Lock()
+
+
+def storage_for(path: str = None) -> Storage:
+    """Storage of a team database (default: the active team's), one pooled engine per file and process."""
+    p = str(path or get_db_path())
+    with _storages_lock:
+        storage = _storages.get(p)
+        if storage is None:
+            storage = _storages[p] = create_storage(f"sqlite:///{p}")
+    return storage
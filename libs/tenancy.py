@@ -0,0 +1,161 @@
+import argparse
+import contextvars
+import os
+import re
+import threading
+from pathlib import Path
+from libs import queries as q
+from libs.db import DEFAULT_DB, get_read_conn, init_db, set_active_db
+
+# Multi-team tenancy: one SQLite file per team.
+#
+# The "default" team keeps data/data.db; every other team lives in
+# data/teams/<slug>.db. Each Streamlit run activates one tenant (from the session
+# token, or ?team= before login), which routes get_conn()/get_read_conn() to that
+# team's file, so read pools, WAL and maintenance are per team and one busy team
+# never locks or bloats another. BARBARAPP_TENANTS limits the teams a process
+# serves, so teams can be split across processes behind a proxy.
+
+DEFAULT_TENANT = "default"
+TENANT_PARAM = "team"
+TENANT_DIR = Path(os.environ.get("BARBARAPP_TENANT_DIR", DEFAULT_DB.parent / "teams"))
+# comma-separated slugs served by this process, "*" for all
+SERVED_TENANTS = os.environ.get("BARBARAPP_TENANTS", "*").strip() or "*"
+
+_SLUG = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+_current = contextvars.ContextVar("tenant", default=DEFAULT_TENANT)
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def valid_slug(slug) -> bool:
+    return isinstance(slug, str) and bool(_SLUG.match(slug))
+
+
+def tenant_db_path(slug: str) -> str:
+    if slug == DEFAULT_TENANT:
+        return str(DEFAULT_DB)
+    if not valid_slug(slug):
+        raise ValueError(f"invalid team name: {slug!r}")
+    return str(TENANT_DIR / f"{slug}.db")
+
+
+def list_tenants() -> list:
+    """Every team with a database on disk, default first."""
+    others = sorted(p.stem for p in TENANT_DIR.glob("*.db") if valid_slug(p.stem)) if TENANT_DIR.exists() else []
+    return [DEFAULT_TENANT] + [t for t in others if t != DEFAULT_TENANT]
+
+
+def is_served(slug: str) -> bool:
+    if SERVED_TENANTS == "*":
+        return True
+    return slug in {s.strip() for s in SERVED_TENANTS.split(",")}
+
+
+def tenant_for_path(path) -> str:
+    """Team owning a database file (inverse of tenant_db_path)."""
+    p = Path(path).resolve()
+    return DEFAULT_TENANT if p == DEFAULT_DB.resolve() else p.stem
+
+
+def tenant_exists(slug: str) -> bool:
+    return slug == DEFAULT_TENANT or (valid_slug(slug) and Path(tenant_db_path(slug)).exists())
+
+
+def served_tenants() -> list:
+    """Teams this process can route to."""
+    return [t for t in list_tenants() if is_served(t)]
+
+
+def default_tenant() -> str:
+    served = served_tenants()
+    return served[0] if served else DEFAULT_TENANT
+
+
+def create_tenant(slug: str) -> str:
+    """Create (or re-initialize) a team database and return its path."""
+    path = tenant_db_path(slug)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    init_db(path)
+    with _init_lock:
+        _initialized.add(slug)
+    return path
+
+
+def ensure_tenant(slug: str) -> str:
+    """Initialize an existing team database once per process (schema + migrations)."""
+    if slug not in _initialized:
+        if not tenant_exists(slug):
+            raise ValueError(f"unknown team: {slug!r}")
+        create_tenant(slug)
+    return tenant_db_path(slug)
+
+
+def activate(slug: str) -> str:
+    """Make slug the active tenant for this thread and return its database path."""
+    if not is_served(slug):
+        raise ValueError(f"team {slug!r} is not served by this process")
+    path = ensure_tenant(slug)
+    _current.set(slug)
+    set_active_db(path)
+    return path
+
+
+def current_tenant() -> str:
+    return _current.get()
+
+
+def tenant_stats(slug: str) -> dict:
+    path = Path(tenant_db_path(slug))
+    wal = Path(f"{path}-wal")
+    conn = get_read_conn(str(path))
+    try:
+        users = q.fetch_one(conn, q.USER_COUNT)["c"]
+        matches = q.fetch_one(conn, q.MATCH_COUNT)["c"]
+    finally:
+        conn.close()
+    return {
+        "team": slug,
+        "path": str(path),
+        "bytes": path.stat().st_size,
+        "wal_bytes": wal.stat().st_size if wal.exists() else 0,
+        "users": users,
+        "matches": matches,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m libs.tenancy", description="Manage team databases")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="list teams with size, user and match counts")
+    c = sub.add_parser("create", help="create a team database")
+    c.add_argument("slug")
+    sub.add_parser("migrate", help="apply schema and migrations to every team")
+    b = sub.add_parser("backup", help="take a verified snapshot of every team (or the given ones)")
+    b.add_argument("slugs", nargs="*")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "list":
+        for t in list_tenants():
+            if not Path(tenant_db_path(t)).exists():
+                print(f"{t}  (no database yet)")
+                continue
+            s = tenant_stats(t)
+            print(f"{t}  {s['path']}  {s['bytes']} bytes  wal={s['wal_bytes']}  users={s['users']}  matches={s['matches']}")
+    elif args.cmd == "create":
+        if not valid_slug(args.slug):
+            parser.error("team names use lowercase letters, digits, '-' and '_' (max 32)")
+        print(create_tenant(args.slug))
+    elif args.cmd == "migrate":
+        for t in list_tenants():
+            print(t, create_tenant(t))
+    elif args.cmd == "backup":
+        from libs.backup import snapshot
+        for t in args.slugs or list_tenants():
+            path = tenant_db_path(t)
+            if Path(path).exists():
+                print(t, snapshot(source=path))
+
+
+if __name__ == "__main__":
+    main()
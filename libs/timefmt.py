@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+from libs.db import now_epoch
+
+# Display helpers for epoch timestamp columns (UTC seconds, see libs/db.py).
+#
+# They work on whole columns at once, so a page formats every row with a few
+# numpy operations instead of parsing one string per row.
+
+_STEPS = [(60, 1, "s"), (3600, 60, "m"), (86400, 3600, "h")]
+
+
+def relative_times(values, now: int = None, empty: str = "No updates") -> pd.Series:
+    """'42s ago' / '5m ago' / '3h ago' / '2d ago' labels for epoch seconds; `empty` for missing ones."""
+    ts = pd.to_numeric(pd.Series(values), errors="coerce")
+    age = ((now_epoch() if now is None else now) - ts).clip(lower=0).to_numpy()
+    conditions = [age < limit for limit, _, _ in _STEPS]
+    amount = np.select(conditions, [age // div for _, div, _ in _STEPS], age // 86400)
+    unit = np.select(conditions, [u for _, _, u in _STEPS], "d")
+    labels = pd.Series(np.nan_to_num(amount).astype(np.int64).astype(str), index=ts.index) + unit + " ago"
+    return labels.where(ts.notna(), empty)
+
+
+def to_datetimes(values) -> pd.Series:
+    """Epoch seconds as naive UTC datetimes (NaT when missing), for tables and charts."""
+    return pd.to_datetime(pd.to_numeric(pd.Series(values), errors="coerce"), unit="s")
@@ -0,0 +1,153 @@
+"""Mixed read/write load benchmark for the SQLite connection paths.
+
+Seeds a throwaway database, then runs writer threads (attendance toggles with
+event rows, like the calendar save) next to reader threads running the audit
+scan and the calendar aggregates ("scan") or single-row user lookups
+("lookup", where connection setup dominates). Readers run once on the read-write
+connections from get_conn() and once on the read-only pool from get_read_conn(),
+and the report compares read latency and throughput.
+
+    uv run python scripts/bench_db.py --seconds 5 --readers 8 --writers 2
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from libs.db import EVENT_CONFIRMED, STATUS_CONFIRMED, init_db, get_conn, get_read_conn, now_epoch  # noqa: E402
+
+AUDIT_SQL = """
+SELECT e.id, e.ts, e.kind, u.username, m.match_number, m.date, m.opponents_team, actor.username
+FROM events e
+LEFT JOIN users u ON e.subject = u.id
+LEFT JOIN matches m ON e.entity = m.id
+LEFT JOIN users actor ON e.actor = actor.id
+ORDER BY e.ts DESC
+LIMIT 200
+"""
+LOOKUP_SQL = "SELECT * FROM users WHERE username = ?"
+CALENDAR_SQL = f"""
+SELECT m.id, COUNT(a.id) AS confirmed
+FROM matches m LEFT JOIN attendance a ON a.match_id = m.id AND a.status = {STATUS_CONFIRMED}
+GROUP BY m.id ORDER BY m.date
+"""
+
+
+def seed(path: str, users: int, matches: int, history: int):
+    init_db(path)
+    conn = get_conn(path)
+    now = now_epoch()
+    conn.executemany(
+        "INSERT INTO users (username, password_hash, role, created_at) VALUES (?,?,?,?)",
+        [(f"user{i}", "x", "giocatore", now) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT INTO matches (match_number, date, opponents_team, home_or_away, created_at) VALUES (?,?,?,?,?)",
+        [(i, f"2030-{1 + i // 28:02d}-{1 + i % 28:02d}", f"team{i}", "casa", now) for i in range(1, matches + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO events (ts, kind, entity, subject, actor) VALUES (?,?,?,?,?)",
+        [
+            (now - history + i, EVENT_CONFIRMED, random.randint(1, matches), u, u)
+            for i, u in ((i, random.randint(1, users)) for i in range(history))
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _read_scan(conn, users):
+    conn.execute(AUDIT_SQL).fetchall()
+    conn.execute(CALENDAR_SQL).fetchall()
+
+
+def _read_lookup(conn, users):
+    conn.execute(LOOKUP_SQL, (f"user{random.randrange(users)}",)).fetchone()
+
+
+WORKLOADS = {"scan": _read_scan, "lookup": _read_lookup}
+
+
+def run(path: str, read_factory, workload, seconds: float, readers: int, writers: int, users: int, matches: int) -> dict:
+    stop = time.monotonic() + seconds
+    latencies = []
+    writes = [0]
+    lock = threading.Lock()
+
+    def reader():
+        local = []
+        while time.monotonic() < stop:
+            t = time.perf_counter()
+            conn = read_factory(path)
+            workload(conn, users)
+            conn.close()
+            local.append((time.perf_counter() - t) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    def writer():
+        n = 0
+        while time.monotonic() < stop:
+            conn = get_conn(path)
+            now = now_epoch()
+            mid, uid = random.randint(1, matches), random.randint(1, users)
+            conn.execute(
+                "INSERT INTO attendance (match_id, user_id, status, updated_at, updated_by) VALUES (?,?,?,?,?)",
+                (mid, uid, STATUS_CONFIRMED, now, uid),
+            )
+            conn.execute(
+                "INSERT INTO events (ts, kind, entity, subject, actor) VALUES (?,?,?,?,?)",
+                (now, EVENT_CONFIRMED, mid, uid, uid),
+            )
+            conn.commit()
+            conn.close()
+            n += 1
+        with lock:
+            writes[0] += n
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return {
+        "reads_per_s": round(len(latencies) / seconds, 1),
+        "read_p50_ms": round(statistics.median(latencies), 3) if latencies else None,
+        "read_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3) if latencies else None,
+        "writes_per_s": round(writes[0] / seconds, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--matches", type=int, default=60)
+    parser.add_argument("--history", type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = str(Path(d) / "bench.db")
+        seed(path, args.users, args.matches, args.history)
+        print(f"{'workload':<10}{'readers on':<22}{'reads/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'writes/s':>10}")
+        for wname, workload in WORKLOADS.items():
+            for label, factory in (("get_conn (rw)", get_conn), ("get_read_conn (ro)", get_read_conn)):
+                r = run(path, factory, workload, args.seconds, args.readers, args.writers, args.users, args.matches)
+                print(
+                    f"{wname:<10}{label:<22}{r['reads_per_s']:>10}{r['read_p50_ms']:>10}"
+                    f"{r['read_p95_ms']:>10}{r['writes_per_s']:>10}"
+                )
+
+
+if __name__ == "__main__":
+    main()
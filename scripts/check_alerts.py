@@ -0,0 +1,161 @@
+"""Check threshold alerts and outbox delivery against a local stand-in SMTP server.
+
+    uv run python scripts/check_alerts.py
+
+A throwaway team gets a match close to its date without enough confirmations
+and a later one that a cancellation takes below the threshold. The script
+checks that evaluating enqueues one message per recipient and never twice, that
+delivery to a server refusing connections schedules retries with backoff, that
+the messages arrive once the server accepts them, and that a recipient the
+server rejects is given up after OUTBOX_MAX_ATTEMPTS.
+"""
+import datetime
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts mail, refuses on demand."""
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        if server.refuse:
+            self.reply("421 stand-in: try again later")
+            return
+        self.reply("220 stand-in ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 stand-in")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 ok")
+            elif verb == "RCPT":
+                address = command.split(":", 1)[1].strip().strip("<>")
+                if address in server.rejected:
+                    self.reply("550 no such user")
+                else:
+                    recipients.append(address)
+                    self.reply("250 ok")
+            elif verb == "DATA":
+                self.reply("354 end with .")
+                data = []
+                while (chunk := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(chunk)
+                server.received.append((recipients, b"".join(data)))
+                self.reply("250 queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 ok")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class StandInSmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SmtpHandler)
+        self.refuse = False
+        self.rejected = set()
+        self.received = []
+
+
+def main():
+    workdir = tempfile.TemporaryDirectory()
+    os.environ["BARBARAPP_TENANT_DIR"] = str(Path(workdir.name) / "teams")
+    os.environ["BARBARAPP_MAINTENANCE"] = "0"
+    os.chdir(workdir.name)
+
+    from libs import alerts, queries as q
+    from libs.attendance import CONFIRM_THRESHOLD, save_confirmations
+    from libs.db import get_conn, now_epoch
+    from libs.tenancy import activate, create_tenant
+
+    server = StandInSmtpServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    transport = alerts.SmtpTransport("127.0.0.1", server.server_address[1], timeout=5)
+    captains = ["capitano@example.org", "vice@example.org"]
+
+    create_tenant("alerts-check")
+    activate("alerts-check")
+    today = datetime.date.today()
+    now = now_epoch()
+    conn = get_conn()
+    try:
+        admin_id = q.execute(conn, q.USER_INSERT, ("admin", "x", None, "admin", 0, now, now)).lastrowid
+        q.executemany(conn, q.USER_INSERT, [(f"p{i}", "x", f"P{i}", "giocatore", 0, now, now) for i in range(CONFIRM_THRESHOLD)])
+        q.executemany(conn, q.MATCH_INSERT, [
+            (1, (today + datetime.timedelta(days=1)).isoformat(), "Vicini", "casa", "Bar Sport", None, "Bar Sport", None,
+             "check", admin_id, now, None),
+            (2, (today + datetime.timedelta(days=30)).isoformat(), "Lontani", "trasferta", "Pub", None, "Pub", None,
+             "check", admin_id, now, None),
+        ])
+        conn.commit()
+        players = [dict(r) for r in conn.execute("SELECT id, nickname FROM users WHERE role = 'giocatore'")]
+        near, far = (r[0] for r in conn.execute("SELECT id FROM matches ORDER BY match_number"))
+        save_confirmations(conn, players[0], {near: True})
+        for p in players:
+            save_confirmations(conn, p, {far: True})
+
+        first = alerts.evaluate(conn, recipients=captains)
+        assert first == {"alerts_below": 1, "alerts_dropped": 0, "outbox_enqueued": 2}, first
+        save_confirmations(conn, players[-1], {far: False})
+        second = alerts.evaluate(conn, recipients=captains)
+        assert second == {"alerts_below": 1, "alerts_dropped": 1, "outbox_enqueued": 2}, second
+        again = alerts.evaluate(conn, recipients=captains)
+        assert again["outbox_enqueued"] == 0, again
+        print(f"evaluate: ok ({first['outbox_enqueued'] + second['outbox_enqueued']} enqueued, none twice)")
+
+        server.refuse = True
+        refused = alerts.deliver(conn, transport=transport)
+        assert refused == {"outbox_sent": 0, "outbox_retry": 4}, refused
+        assert alerts.deliver(conn, transport=transport)["outbox_retry"] == 0, "retried before the backoff"
+        print("delivery while the server refuses: ok (4 retries scheduled)")
+
+        server.refuse = False
+        later = now_epoch() + int(alerts.OUTBOX_RETRY_SECONDS) + 1
+        delivered = alerts.deliver(conn, now=later, transport=transport)
+        assert delivered == {"outbox_sent": 4, "outbox_retry": 0}, delivered
+        assert sorted(r for rs, _ in server.received for r in rs) == sorted(captains * 2), server.received
+        assert alerts.outbox_stats(conn) == {"pending": 0, "sent": 4, "failed": 0}
+        print(f"delivery: ok ({len(server.received)} messages received)")
+
+        server.rejected.add("nessuno@example.org")
+        # back to the threshold and below again within one evaluation
+        save_confirmations(conn, players[-1], {far: True})
+        save_confirmations(conn, players[-2], {far: False})
+        enqueued = alerts.evaluate(conn, recipients=["nessuno@example.org"])["outbox_enqueued"]
+        assert enqueued == 2, enqueued  # the near match for a new recipient, the new cancellation
+        t = later
+        for _ in range(alerts.OUTBOX_MAX_ATTEMPTS):
+            t += int(alerts.OUTBOX_RETRY_SECONDS * 2 ** alerts.OUTBOX_MAX_ATTEMPTS)
+            alerts.deliver(conn, now=t, transport=transport)
+        stats = alerts.outbox_stats(conn)
+        assert stats == {"pending": 0, "sent": 4, "failed": 2}, stats
+        print(f"rejected recipient: ok (given up after {alerts.OUTBOX_MAX_ATTEMPTS} attempts)")
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+    workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
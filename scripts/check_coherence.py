@@ -0,0 +1,108 @@
+"""Check cross-process cache coherence with several worker processes on one database.
+
+    uv run python scripts/check_coherence.py --workers 4
+
+Every worker warms its session cache, then each revokes a share of the
+sessions while the others keep serving from cache; all workers must see every
+revocation within BARBARAPP_COHERENCE_POLL (well before the 60 s session cache
+TTL). The workers then bump the "users" generation concurrently from
+concurrent write transactions and no increment may be lost.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+BUMPS_PER_WORKER = 200
+
+
+def _worker(index, workers, tokens, barrier, results):
+    from libs import coherence, queries as q
+    from libs.db import get_conn, now_epoch
+    from libs.sessions import resolve_session, revoke_session
+
+    warm = sum(resolve_session(t) is not None for t in tokens)
+    barrier.wait()
+    for t in tokens[index::workers]:
+        revoke_session(t)
+    barrier.wait()
+
+    started = time.perf_counter()
+    deadline = started + coherence.COHERENCE_POLL + 2
+    stale = len(tokens)
+    while time.perf_counter() < deadline:
+        stale = sum(resolve_session(t) is not None for t in tokens)
+        if not stale:
+            break
+        time.sleep(0.01)
+    converged_ms = (time.perf_counter() - started) * 1000
+
+    barrier.wait()
+    for i in range(BUMPS_PER_WORKER):
+        conn = get_conn()
+        try:
+            q.execute(conn, q.USER_SET_NICKNAME, (f"w{index}-{i}", now_epoch(), 1))
+            coherence.bump(conn, coherence.USERS)
+            conn.commit()
+        finally:
+            conn.close()
+    barrier.wait()
+    time.sleep(coherence.COHERENCE_POLL)
+    results.put({
+        "worker": index,
+        "warm_hits": warm,
+        "stale_after": stale,
+        "converged_ms": round(converged_ms, 1),
+        "users_generation": coherence.generation(coherence.USERS),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=40)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="coherence-")
+    os.chdir(tmp)  # data/ is relative to the working directory; children inherit it
+    os.environ["BARBARAPP_MAINTENANCE"] = "0"
+    os.environ.setdefault("BARBARAPP_SESSION_SECRET", "coherence-check")
+
+    from libs.auth import create_user
+    from libs.db import get_db_path, init_db
+    from libs.sessions import create_session
+
+    init_db(get_db_path())
+    uid = create_user("coherence", "x")
+    tokens = [create_session(uid) for _ in range(args.sessions)]
+
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(args.workers)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker, args=(i, args.workers, tokens, barrier, results))
+        for i in range(args.workers)
+    ]
+    for p in procs:
+        p.start()
+    rows = [results.get(timeout=120) for _ in procs]
+    for p in procs:
+        p.join()
+
+    expected = args.workers * BUMPS_PER_WORKER
+    ok = True
+    for r in sorted(rows, key=lambda r: r["worker"]):
+        print(r)
+        ok &= r["warm_hits"] == len(tokens) and r["stale_after"] == 0 and r["users_generation"] == expected
+    print(f"sessions revoked across {args.workers} workers, {expected} concurrent bumps:", "ok" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Exercise the storage repositories against an in-memory engine and a SQLite file.
+
+Also checks that the portable table metadata of libs/storage.py matches the
+SQLite schema of libs/db.py, and that it compiles for a server database.
+
+    uv run python scripts/check_storage.py
+"""
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import inspect, text  # noqa: E402
+from sqlalchemy.dialects import postgresql  # noqa: E402
+from sqlalchemy.schema import CreateIndex, CreateTable  # noqa: E402
+
+from libs import coherence  # noqa: E402
+from libs.db import EVENT_CANCELLED, EVENT_CONFIRMED, EVENT_USER_DELETED, EVENT_USER_OTHER, init_db  # noqa: E402
+from libs.storage import METADATA, create_storage, create_schema  # noqa: E402
+
+
+def generations(storage) -> dict:
+    with storage.engine.connect() as conn:
+        return dict(conn.execute(text("SELECT name, generation FROM cache_generations")).all())
+
+
+def check(storage, label: str):
+    storage.users.add_many([
+        {"username": "alice", "password_hash": "x", "role": "admin"},
+        {"username": "bob", "password_hash": "x", "nickname": "Bobby"},
+    ])
+    bob = storage.users.get_by_username("bob")
+    assert bob and bob["nickname"] == "Bobby"
+    storage.matches.add_many([
+        {"match_number": 1, "date": "2030-01-10", "opponents_team": "Red", "home_or_away": "casa"},
+        {"match_number": 2, "date": "2030-01-17", "opponents_team": "Blue", "home_or_away": "trasferta"},
+    ])
+    m1, m2 = (m["id"] for m in storage.matches.list())
+    assert storage.attendance.set_confirmations(bob, {m1: True, m2: True}) == (2, 0)
+    assert storage.attendance.set_confirmations(bob, {m1: True, m2: False}) == (0, 1)
+    assert storage.attendance.confirmed_counts() == {m1: 1}
+    assert storage.attendance.confirmed_match_ids(bob["id"]) == {m1}
+    assert len(storage.events.recent([EVENT_CONFIRMED, EVENT_CANCELLED])) == 3
+    storage.events.append_many([{"kind": EVENT_USER_OTHER, "entity": bob["id"], "actor": 1, "data": {"note": label}}])
+    assert json.loads(storage.events.recent([EVENT_USER_OTHER])[0]["data"]) == {"note": label}
+    with storage.engine.begin() as conn:
+        conn.execute(text("INSERT INTO sessions (id, user_id, created_at, expires_at) VALUES ('s', :u, 0, 1)"),
+                     {"u": bob["id"]})
+    assert storage.users.delete_many([bob["id"]], actor=1) == 1
+    with storage.engine.connect() as conn:
+        # revoked like auth.delete_users_bulk does; the attendance history stays
+        assert conn.execute(text("SELECT revoked_at FROM sessions WHERE id = 's'")).scalar() is not None
+        assert conn.execute(text("SELECT count(*) FROM attendance WHERE user_id = :u"), {"u": bob["id"]}).scalar() == 1
+    assert json.loads(storage.events.recent([EVENT_USER_DELETED])[0]["data"]) == {"username": "bob"}
+    assert storage.matches.delete_by_numbers([1, 2]) == 2
+    gens = generations(storage)
+    for name in (coherence.USERS, coherence.MATCHES, coherence.ATTENDANCE, coherence.SESSIONS):
+        assert gens.get(name, 0) > 0, f"{name} generation not bumped"
+    print(f"{label}: ok")
+
+
+def _declared(table, dialect) -> dict:
+    pk = {c.name for c in table.primary_key}
+    return {
+        "columns": [(c.name, c.type.compile(dialect), c.nullable or c.name in pk) for c in table.columns],
+        "primary_key": pk,
+        "unique": {c.name for c in table.columns if c.unique},
+        "indexes": {i.name: [c.name for c in i.columns] for i in table.indexes},
+    }
+
+
+def _reflected(insp, name) -> dict:
+    pk = set(insp.get_pk_constraint(name)["constrained_columns"])
+    unique = {u["column_names"][0] for u in insp.get_unique_constraints(name) if len(u["column_names"]) == 1}
+    return {
+        # SQLite reports an INTEGER PRIMARY KEY as nullable
+        "columns": [(c["name"], str(c["type"]), c["nullable"] or c["name"] in pk) for c in insp.get_columns(name)],
+        "primary_key": pk,
+        "unique": unique,
+        "indexes": {i["name"]: i["column_names"] for i in insp.get_indexes(name) if not i.get("unique")},
+    }
+
+
+def check_metadata(storage):
+    insp = inspect(storage.engine)
+    for name, table in METADATA.tables.items():
+        declared, actual = _declared(table, storage.engine.dialect), _reflected(insp, name)
+        for key in declared:
+            assert declared[key] == actual[key], f"{name}.{key}: metadata {declared[key]} != libs.db {actual[key]}"
+    dialect = postgresql.dialect()
+    for table in METADATA.sorted_tables:
+        str(CreateTable(table).compile(dialect=dialect))
+        for index in table.indexes:
+            str(CreateIndex(index).compile(dialect=dialect))
+    print("metadata matches libs.db: ok")
+
+
+def main():
+    memory = create_storage("sqlite://")
+    create_schema(memory.engine)
+    check(memory, "in-memory")
+
+    with tempfile.TemporaryDirectory() as d:
+        path = str(Path(d) / "check.db")
+        init_db(path)
+        storage = create_storage(f"sqlite:///{path}")
+        check_metadata(storage)
+        check(storage, "sqlite file")
+        storage.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Query-count and latency budgets for every page, rendered with Streamlit's AppTest.
+
+    uv run python scripts/page_budgets.py --sizes 10,200
+
+For each size n a throwaway team database is seeded with n players and n
+matches (every player confirms a third of them, through the normal save path),
+then each page in app_pages/ is rendered once as an admin while every SQL
+statement run on get_conn()/get_read_conn() connections is recorded (see
+set_statement_tracer() in libs/db.py). Each render starts with the
+in-process generation snapshot (libs/coherence.py) and session cache
+(libs/sessions.py) expired, so their reads are counted as on a rerun after
+BARBARAPP_COHERENCE_POLL / BARBARAPP_SESSION_CACHE_TTL seconds. Not traced:
+the backup connections (libs/backup.py, maintenance thread only) and the
+SQLAlchemy engines of libs/storage.py (only the JSON API uses them). A page
+fails its budget when it
+
+  - runs more statements than `statements` at any size,
+  - runs more than `scaling` extra statements at the largest size than at the
+    smallest one (an N+1 pattern: one query per row),
+  - takes longer than `ms` to render at the largest size,
+  - or raises.
+
+The report lists every page and size, then each exceeded budget with the
+statements that grew with the data. Exits with status 1 when a budget is exceeded.
+"""
+import argparse
+import datetime
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import NamedTuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+class Budget(NamedTuple):
+    statements: int  # statements per render, at any size
+    scaling: int = 0  # extra statements at the largest size compared to the smallest
+    ms: float = 1000  # render time at the largest size
+
+
+# a little headroom over today's counts; raise a budget only with a reason
+DEFAULT_BUDGET = Budget(statements=10)
+PAGE_BUDGETS = {
+    "app_pages/home.py": Budget(statements=3),
+    "app_pages/calendar.py": Budget(statements=6),
+    "app_pages/profile.py": Budget(statements=4),
+    "app_pages/admin.py": Budget(statements=10, ms=1500),
+    "app_pages/audit.py": Budget(statements=5),
+    "app_pages/analytics.py": Budget(statements=14),
+}
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\bNULL\b")
+
+
+def _shape(sql: str) -> str:
+    """Statement text with literal values replaced by '?' (bound parameters come back expanded)."""
+    return " ".join(_LITERALS.sub("?", sql).split())
+
+
+class StatementRecorder:
+    """Counts statements by shape; statements run by triggers repeat the parent's text and are folded into it."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._last = None
+        self._lock = threading.Lock()
+
+    def __call__(self, sql: str):
+        with self._lock:
+            if sql != self._last:
+                self.counts[_shape(sql)] += 1
+            self._last = sql
+
+    def reset(self):
+        with self._lock:
+            self.counts = Counter()
+            self._last = None
+
+
+def seed(slug: str, n: int) -> str:
+    """Create team `slug` with an admin, n players and n matches; returns an admin session token."""
+    from libs import queries as q
+    from libs.attendance import save_confirmations
+    from libs.db import get_conn, now_epoch
+    from libs.sessions import create_session
+    from libs.tenancy import activate, create_tenant
+
+    create_tenant(slug)
+    activate(slug)
+    now = now_epoch()
+    first = datetime.date.today() - datetime.timedelta(weeks=n // 2)
+    conn = get_conn()
+    try:
+        admin_id = q.execute(conn, q.USER_INSERT, ("admin", "x", None, "admin", 0, now, now)).lastrowid
+        q.executemany(conn, q.USER_INSERT, [(f"player{i}", "x", f"Player {i}", "giocatore", 0, now, now) for i in range(n)])
+        q.executemany(conn, q.MATCH_INSERT, [
+            (i + 1, (first + datetime.timedelta(weeks=i)).isoformat(), f"Team {i % 12}", "casa" if i % 2 else "trasferta",
+             f"Via Roma {i}", None, f"Via Roma {i}", None, "seed", admin_id, now, None)
+            for i in range(n)
+        ])
+        conn.commit()
+        players = [dict(r) for r in conn.execute("SELECT id, nickname FROM users WHERE role = 'giocatore'")]
+        match_ids = [r[0] for r in conn.execute("SELECT id FROM matches ORDER BY id")]
+        for i, player in enumerate(players):
+            save_confirmations(conn, player, {m: True for j, m in enumerate(match_ids) if (i + j) % 3 == 0})
+    finally:
+        conn.close()
+    return create_session(admin_id)
+
+
+def render(page: str, token: str, recorder: StatementRecorder) -> dict:
+    from streamlit.testing.v1 import AppTest
+    from libs.auth import SESSION_PARAM
+    from libs.coherence import expire_snapshots
+    from libs.sessions import clear_cache, issue_resume
+
+    at = AppTest.from_file(str(ROOT / "app.py"), default_timeout=120)
+    # a logged-in browser session (resuming through the URL would add its one-time exchange)
+    resume = issue_resume(token)
+    at.session_state["session_token"] = token
+    at.session_state["resume_token"] = resume
+    at.session_state["_resume_issued_at"] = time.time()
+    at.query_params[SESSION_PARAM] = resume
+    at.switch_page(page)
+    # count the generation and session reads the in-process caches would skip on a quick rerun
+    expire_snapshots()
+    clear_cache()
+    recorder.reset()
+    started = time.perf_counter()
+    at.run()
+    ms = (time.perf_counter() - started) * 1000
+    return {
+        "counts": Counter(recorder.counts),
+        "ms": ms,
+        "errors": [str(e.value) for e in at.exception],
+    }
+
+
+def check(page: str, runs: dict, budget: Budget, names: dict) -> list:
+    """Budget violations of one page; runs maps size -> render() result."""
+    sizes = sorted(runs)
+    problems = []
+    for n in sizes:
+        total = sum(runs[n]["counts"].values())
+        if total > budget.statements:
+            problems.append(f"{total} statements at n={n} (budget {budget.statements})")
+        for err in runs[n]["errors"]:
+            problems.append(f"exception at n={n}: {err}")
+    if len(sizes) > 1:
+        small, large = runs[sizes[0]]["counts"], runs[sizes[-1]]["counts"]
+        grown = {s: large[s] - small.get(s, 0) for s in large if large[s] > small.get(s, 0)}
+        extra = sum(grown.values())
+        if extra > budget.scaling:
+            problems.append(f"{extra} statements scale with rows from n={sizes[0]} to n={sizes[-1]} (budget {budget.scaling}):")
+            for shape, d in sorted(grown.items(), key=lambda kv: -kv[1]):
+                problems.append(f"    +{d:<5} {names.get(shape) or shape[:100]}")
+    ms = runs[sizes[-1]]["ms"]
+    if ms > budget.ms:
+        problems.append(f"{ms:.0f} ms at n={sizes[-1]} (budget {budget.ms:.0f} ms)")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,200", help="comma-separated player/match counts (default 10,200)")
+    parser.add_argument("--page", action="append", help="only this page (repeatable), e.g. app_pages/calendar.py")
+    parser.add_argument("--verbose", action="store_true", help="print every statement shape per render")
+    args = parser.parse_args(argv)
+    sizes = sorted({int(s) for s in args.sizes.split(",") if s.strip()})
+    pages = args.page or sorted(str(p.relative_to(ROOT)) for p in (ROOT / "app_pages").glob("*.py"))
+
+    workdir = tempfile.TemporaryDirectory()
+    os.environ["BARBARAPP_TENANT_DIR"] = str(Path(workdir.name) / "teams")
+    os.environ["BARBARAPP_MAINTENANCE"] = "0"
+    # the app keeps its default data/ directory relative to the working directory
+    os.chdir(workdir.name)
+
+    from libs import queries as q
+    from libs.db import set_statement_tracer
+
+    names = {_shape(s.sql): name for name, s in q.STATEMENTS.items()}
+    recorder = StatementRecorder()
+    set_statement_tracer(recorder)
+    try:
+        # first renders pay for imports and Streamlit setup: warm up on a separate team
+        warmup = seed("budget-warmup", sizes[0])
+        for page in pages:
+            render(page, warmup, recorder)
+
+        results = {page: {} for page in pages}
+        for n in sizes:
+            token = seed(f"budget-{n}", n)
+            for page in pages:
+                results[page][n] = render(page, token, recorder)
+    finally:
+        set_statement_tracer(None)
+
+    print("statements on get_conn()/get_read_conn() connections, generation and session caches expired;")
+    print("not traced: backup connections (libs/backup.py), SQLAlchemy engines (libs/storage.py)\n")
+    print(f"{'page':<26}{'n':>6}{'statements':>12}{'ms':>9}")
+    for page in pages:
+        for n in sizes:
+            r = results[page][n]
+            print(f"{page:<26}{n:>6}{sum(r['counts'].values()):>12}{r['ms']:>9.0f}")
+            if args.verbose:
+                for shape, c in r["counts"].most_common():
+                    print(f"{'':<8}{c:>5}  {names.get(shape) or shape[:100]}")
+
+    failed = False
+    for page in pages:
+        problems = check(page, results[page], PAGE_BUDGETS.get(page, DEFAULT_BUDGET), names)
+        if problems:
+            failed = True
+            print(f"\nOVER BUDGET {page}")
+            for p in problems:
+                print(f"  {p}")
+    print("\nall pages within budget" if not failed else "")
+    workdir.cleanup()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
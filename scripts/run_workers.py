@@ -0,0 +1,54 @@
+"""Start several Streamlit workers on consecutive ports, sharing data/ (see deploy/nginx.conf).
+
+    uv run python scripts/run_workers.py --workers 4 --base-port 8601
+
+The workers only listen on 127.0.0.1 behind the local proxy, so unless
+BARBARAPP_TRUSTED_PROXIES is set they trust X-Forwarded-For from loopback.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--base-port", type=int, default=8601)
+    args = parser.parse_args()
+
+    env = {**os.environ, "BARBARAPP_TRUSTED_PROXIES": os.environ.get("BARBARAPP_TRUSTED_PROXIES", "127.0.0.1,::1")}
+    procs = []
+    for i in range(args.workers):
+        port = args.base_port + i
+        cmd = [
+            sys.executable, "-m", "streamlit", "run", "app.py",
+            "--server.port", str(port), "--server.address", "127.0.0.1", "--server.headless", "true",
+        ]
+        procs.append(subprocess.Popen(cmd, cwd=ROOT, env=env))
+        print(f"worker {i} on 127.0.0.1:{port} (pid {procs[-1].pid})")
+
+    def _stop(*_):
+        for p in procs:
+            p.terminate()
+
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        while all(p.poll() is None for p in procs):
+            time.sleep(1)
+        print("a worker exited; stopping the others")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _stop()
+        for p in procs:
+            p.wait()
+
+
+if __name__ == "__main__":
+    main()
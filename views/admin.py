@@ -1,10 +1,60 @@
 import streamlit as st
-from libs.auth import list_users, generate_temp_password, update_password, current_user, is_admin, require_login, create_user, find_user_by_username
-from libs.csv_utils import parse_pasted_csv, validate_row
-from libs.db import get_conn
+from libs.auth import current_user, is_admin, require_login, create_user, find_user_by_username, create_users_bulk
+from libs.auth import count_users, search_users, reset_passwords_bulk, delete_users_bulk, set_role_bulk
+from libs.csv_utils import parse_pasted_csv, validate_row, parse_users_csv, validate_user_row, to_csv_text, USER_ROLES
+from libs import coherence, frames, queries as q
+from libs.db import EVENT_MATCH_CREATED, EVENT_MATCH_DELETED, EVENT_MATCH_UPDATED, EVENT_MATCHES_IMPORTED
+from libs.db import get_conn, get_read_conn, now_epoch
+from libs.events import EventBatch
+from libs.export import FORMATS, export_to_file, watermark
+from libs.fingerprints import MatchIndex, match_fingerprint, previous_import, record_import, row_fingerprint, source_hash
+from libs.import_preview import ACTIONS, DIFF_FIELDS, IMPORT_PREVIEW_PAGE_SIZE, action_counts, build_preview
+from libs.places import normalize_place
+from libs.search import MIN_QUERY_LENGTH, SEARCH_PAGE_SIZE, search
+from libs.state import get_preview, page_for, pop_preview, put_preview, session_stats
 from datetime import datetime
-import validators
-from st_diff_viewer import diff_viewer
+from pathlib import Path
+
+MATCHES_EDITOR_SCHEMA = {
+    "id": frames.INT,
+    "match_number": frames.INT,
+    "date": frames.TEXT,
+    "opponents_team": frames.TEXT,
+    "home_or_away": frames.TEXT,
+    "place_text": frames.TEXT,
+    "place_parsed_url": frames.TEXT,
+}
+# fields of a parsed CSV row the approve step needs (no _orig_* copies, no existing rows)
+PREVIEW_FIELDS = ("_row_no", "_errors", "_action", "match_number", "date", "opponents_team", "home_or_away", "place")
+USERS_GRID_SCHEMA = {
+    "id": frames.INT,
+    "username": frames.TEXT,
+    "role": frames.CATEGORY,
+    "nickname": frames.TEXT,
+    "created_at": frames.EPOCH,
+}
+
+IMPORT_ACTION_LABELS = {"insert": "🟢 Nuova", "update": "🟡 Modifica", "skip": "⚪ Invariata", "error": "🔴 Errore"}
+IMPORT_ACTION_CSS = {
+    "insert": "background-color: rgba(33, 195, 84, 0.2)",
+    "update": "background-color: rgba(255, 189, 69, 0.25)",
+    "skip": "",
+    "error": "background-color: rgba(255, 43, 43, 0.2)",
+}
+IMPORT_CHANGED_CSS = "background-color: rgba(255, 189, 69, 0.35)"
+IMPORT_PREVIEW_COLUMNS = {"match_number": "Match #", "date": "Data", "opponents_team": "Avversari",
+                          "home_or_away": "Casa/Trasferta", "place": "Luogo"}
+
+EXPORT_DATASETS = {"Partite": "matches", "Presenze": "attendance", "Eventi": "events"}
+EXPORT_FORMATS = {"csv": "CSV", "jsonl": "JSON Lines", "parquet": "Parquet"}
+EXPORT_MODES = ["Tutto", "Intervallo di date", "Dalla precedente esportazione"]
+
+SEARCH_SCOPES = {"Partite": "matches", "Utenti": "users"}
+SEARCH_COLUMNS = {
+    "matches": {"match_number": "Match #", "date": "Data", "opponents_team": "Avversari",
+                "home_or_away": "Casa/Trasferta", "place_display": "Luogo"},
+    "users": {"username": "Nome utente", "nickname": "Soprannome", "role": "Ruolo"},
+}
 
 
 class MatchOperator:
@@ -12,11 +62,15 @@ class MatchOperator:
 
     Provides a single static method `apply_row` that performs an upsert using
     the same logic as manual inserts and CSV imports. Returns a tuple
-    (action, id) where action is one of 'inserted' or 'updated'.
+    (action, id) where action is one of 'inserted', 'updated' or 'skipped';
+    inserts and updates are added to `events` (an EventBatch) when given.
+    With a MatchIndex (libs/fingerprints.py) the existing row is looked up in
+    memory and kept current, instead of one SELECT per row.
     """
 
     @staticmethod
-    def apply_row(conn, match_number, date, opponents, hoa, place, source='manual', created_by=None):
+    def apply_row(conn, match_number, date, opponents, hoa, place, source='manual', created_by=None, events=None,
+                  index=None):
         # normalize match_number
         try:
             match_number = int(match_number)
@@ -29,45 +83,154 @@ class MatchOperator:
                 date_norm = datetime.fromisoformat(str(date)).date().isoformat()
             except Exception:
                 date_norm = str(date).strip()
-        place_url = place if validators.url(str(place or '')) else None
-        now = datetime.utcnow().isoformat()
+        np = normalize_place(place)
+        place_url = np.url
+        now = now_epoch()
+
+        fingerprint = match_fingerprint(match_number, date_norm, opponents, hoa, place, place_url)
+        written = {"match_number": match_number, "date": date_norm, "opponents_team": opponents, "home_or_away": hoa,
+                   "place_text": place, "place_parsed_url": place_url, "fingerprint": fingerprint}
 
         # prefer matching by date (import rule), otherwise use match_number
-        existing = None
-        if date_norm:
-            existing = conn.execute(
-                "SELECT id, match_number, date, opponents_team, home_or_away, place_text, place_parsed_url FROM matches WHERE date = ?", 
-                (date_norm,)
-            ).fetchone()
-        if not existing:
-            existing = conn.execute(
-                "SELECT id, match_number, date, opponents_team, home_or_away, place_text, place_parsed_url FROM matches WHERE match_number = ?", 
-                (match_number,)
-            ).fetchone()
+        if index is not None:
+            existing = index.find(date_norm, match_number)
+        else:
+            existing = None
+            if date_norm:
+                existing = q.fetch_one(conn, q.MATCH_BY_DATE, (date_norm,))
+            if not existing:
+                existing = q.fetch_one(conn, q.MATCH_BY_NUMBER, (match_number,))
 
         if existing:
-            # Check if values are identical - if so, skip update
-            if (existing['match_number'] == match_number and
-                existing['date'] == date_norm and
-                existing['opponents_team'] == opponents and
-                existing['home_or_away'] == hoa and
-                existing['place_text'] == place and
-                existing['place_parsed_url'] == place_url):
+            # identical values (same fingerprint): skip the update
+            stored = existing['fingerprint'] if index is not None else row_fingerprint(existing)
+            if stored == fingerprint:
                 return 'skipped', existing['id']
-            
-            conn.execute(
-                "UPDATE matches SET match_number=?, date=?, opponents_team=?, home_or_away=?, place_text=?, place_parsed_url=?, updated_at=?, source_import=? WHERE id=?",
-                (match_number, date_norm, opponents, hoa, place, place_url, now, source, existing['id']),
+
+            q.execute(
+                conn, q.MATCH_UPDATE,
+                (match_number, date_norm, opponents, hoa, place, place_url, np.display, np.host, now, source,
+                 fingerprint, existing['id']),
             )
+            if index is not None:
+                index.put(dict(written, id=existing['id']))
+            if events is not None:
+                events.add(EVENT_MATCH_UPDATED, entity=existing['id'], data={"match_number": match_number, "source": source})
             return 'updated', existing['id']
         else:
-            cur = conn.execute(
-                "INSERT INTO matches (match_number, date, opponents_team, home_or_away, place_text, place_parsed_url, source_import, created_by, created_at) VALUES (?,?,?,?,?,?,?,?,?)",
-                (match_number, date_norm, opponents, hoa, place, place_url, source, created_by, now),
+            cur = q.execute(
+                conn, q.MATCH_INSERT,
+                (match_number, date_norm, opponents, hoa, place, place_url, np.display, np.host, source, created_by, now,
+                 fingerprint),
             )
+            if index is not None:
+                index.put(dict(written, id=cur.lastrowid))
+            if events is not None:
+                events.add(EVENT_MATCH_CREATED, entity=cur.lastrowid, data={"match_number": match_number, "source": source})
             return 'inserted', cur.lastrowid
 
 
+def show_import_preview(diff, handle: str):
+    """Summary counts, action filter and one paginated table of the import diff, changed cells highlighted."""
+    import pandas as pd
+    counts = action_counts(diff)
+    for col, (action, n) in zip(st.columns(len(counts)), counts.items()):
+        col.metric(IMPORT_ACTION_LABELS[action], n)
+    if counts["error"] == len(diff):
+        st.warning("All parsed rows have validation errors. Check column names and formats. Use headers like: match_number,date,opponents_team,home_or_away,place")
+    # unchanged rows (same fingerprint) are counted but hidden unless asked for
+    shown = st.multiselect("Mostra", list(ACTIONS), default=[a for a in ACTIONS if a != "skip"],
+                           format_func=IMPORT_ACTION_LABELS.get, key="import_preview_actions")
+    view = diff[diff["action"].isin(shown)]
+    pages = max(1, -(-len(view) // IMPORT_PREVIEW_PAGE_SIZE))
+    page = page_for(st.session_state, "import_preview_page", (handle, tuple(shown)), pages)
+    if pages > 1:
+        page = st.number_input(f"Pagina (di {pages})", min_value=1, max_value=pages, step=1,
+                               key="import_preview_page")
+    rows = view.iloc[(page - 1) * IMPORT_PREVIEW_PAGE_SIZE:page * IMPORT_PREVIEW_PAGE_SIZE]
+
+    # updated cells read "old → new"; the rest shows the incoming value
+    table = pd.DataFrame({"Riga": rows["row_no"], "Azione": rows["action"].map(IMPORT_ACTION_LABELS)})
+    css = pd.DataFrame({"Riga": "", "Azione": rows["action"].map(IMPORT_ACTION_CSS)}, index=rows.index)
+    for field, old in DIFF_FIELDS.items():
+        label, changed = IMPORT_PREVIEW_COLUMNS[field], rows[f"changed_{field}"]
+        new = rows[field].fillna("")
+        table[label] = new.mask(changed, rows[old].astype("string").fillna("") + " → " + new)
+        css[label] = changed.map({True: IMPORT_CHANGED_CSS, False: ""})
+    table["Errori"], css["Errori"] = rows["errors"], ""
+    st.dataframe(table.style.apply(lambda _: css, axis=None), use_container_width=True, hide_index=True)
+    st.caption(f"{len(view)} righe su {len(diff)} · Rows will **overwrite existing matches that share the same `date`**")
+
+
+def show_search():
+    """Ranked full-text search over matches or users (libs/search.py), one page at a time."""
+    s1, s2 = st.columns([3, 1], vertical_alignment="bottom")
+    text = s1.text_input("Testo", placeholder="avversari, luogo, nome utente o soprannome", key="admin_search")
+    scope = SEARCH_SCOPES[s2.radio("In", list(SEARCH_SCOPES), horizontal=True, key="admin_search_scope")]
+    if len(text.strip()) < MIN_QUERY_LENGTH:
+        st.caption(f"Scrivi almeno {MIN_QUERY_LENGTH} caratteri: trova anche parti di parole e piccoli errori di battitura.")
+        return
+    page = page_for(st.session_state, "admin_search_page", (scope, text))
+    result = search(scope, text, page=page)
+    if not result.total:
+        st.info("Nessun risultato")
+        return
+    if result.fuzzy:
+        st.caption("Nessuna corrispondenza esatta: risultati simili")
+    columns = SEARCH_COLUMNS[scope]
+    import pandas as pd
+    st.dataframe(
+        pd.DataFrame(result.rows, columns=list(columns)).rename(columns=columns),
+        use_container_width=True,
+        hide_index=True,
+    )
+    pages = max(1, -(-result.total // SEARCH_PAGE_SIZE))
+    if pages > 1:
+        st.number_input(f"Pagina (di {pages})", min_value=1, max_value=pages, step=1,
+                        key="admin_search_page")
+    st.caption(f"{result.total} risultati")
+
+
+def show_export():
+    e1, e2 = st.columns(2)
+    dataset = EXPORT_DATASETS[e1.selectbox("Dati", list(EXPORT_DATASETS), key="export_dataset")]
+    fmt = e2.radio("Formato", [f for f in EXPORT_FORMATS if f in FORMATS], format_func=EXPORT_FORMATS.get,
+                   horizontal=True, key="export_format")
+    mode = st.radio("Righe", EXPORT_MODES, horizontal=True, key="export_mode")
+    kwargs = {}
+    if mode == EXPORT_MODES[1]:
+        d1, d2 = st.columns(2)
+        kwargs["date_from"] = d1.date_input("Dal", value=None, key="export_from")
+        kwargs["date_to"] = d2.date_input("Al", value=None, key="export_to")
+    elif mode == EXPORT_MODES[2]:
+        kwargs["incremental"] = True
+        last = watermark(dataset)
+        if last:
+            st.caption(f"Ultima esportazione: {datetime.fromtimestamp(last[1]).strftime('%d/%m/%Y %H:%M')} "
+                       f"(fino alla riga {last[0]})")
+        else:
+            st.caption("Nessuna esportazione precedente: verranno esportate tutte le righe.")
+    if st.button("Esporta", use_container_width=True, key="export_run"):
+        bar = st.progress(0.0, text="Esportazione in corso...")
+        try:
+            stats = export_to_file(dataset, fmt, progress=lambda done, total: bar.progress(
+                done / total, text=f"{done} / {total} righe"), **kwargs)
+        except Exception as e:
+            bar.empty()
+            st.error(f"Esportazione non riuscita: {e}")
+        else:
+            bar.progress(1.0, text=f"{stats['rows']} righe esportate")
+            st.session_state._export_result = stats
+    stats = st.session_state.get("_export_result")
+    if stats:
+        path = Path(stats["path"])
+        if path.exists():
+            # read only when clicked, not on every rerun of the admin page
+            st.download_button(f"⬇️ Scarica {path.name}", path.read_bytes, file_name=path.name,
+                               mime=FORMATS[stats["format"]][1], on_click="ignore", use_container_width=True)
+        st.caption(f"{stats['rows']} righe, {stats['bytes'] / 1024:.1f} KiB in {stats['duration_s']} s")
+
+
 def show():
     require_login()
     if not is_admin():
@@ -76,128 +239,71 @@ def show():
 
     # st.header("Admin")
 
-    tab_matches, tab_users = st.tabs(["Calendario Partite", "Utenti"])
+    with st.expander("🔎 Cerca partite e utenti"):
+        show_search()
+
+    tab_matches, tab_users, tab_export = st.tabs(["Calendario Partite", "Utenti", "Esportazione"])
 
     with tab_matches:
         st.subheader("Importazione partite da CSV")
         st.info("Incolla CSV con intestazioni: match_number,date,opponents_team,home_or_away,place")
         txt = st.text_area("Incolla il CSV qui", height=200)
         if st.button("Anteprima CSV", use_container_width=True):
+            # the same text was imported before and the calendar has not changed since: nothing to do
+            conn = get_read_conn()
             try:
-                rows = parse_pasted_csv(txt)
-            except Exception as e:
-                st.error(f"Parse error: {e}")
-                return
-            if not rows:
-                st.warning("Nessuna riga analizzata. Assicurati che il tuo CSV abbia una riga di intestazione con le colonne: match_number, date, opponents_team, home_or_away, place")
-                return
-
-            # show what header keys we detected (helpful for debugging mismatched headers)
-            detected_keys = sorted(list(rows[0].keys())) if rows else []
-            st.info(f"Detected columns: {detected_keys}")
-
-            # Validate rows and check if they will insert or update
-            preview = []
-            conn = get_conn()
-            for i, r in enumerate(rows, start=1):
-                errs = validate_row(r)
-                r['_row_no'] = i
-                r['_errors'] = errs
-                
-                # Check if this row will insert or update, and get existing data if updating
-                action = 'insert'
-                existing_data = None
-                if not errs and r.get('date'):
-                    try:
-                        date_norm = datetime.fromisoformat(str(r['date'])).date().isoformat()
-                        place_url = r.get('place') if validators.url(str(r.get('place') or '')) else None
-                        existing = conn.execute(
-                            "SELECT match_number, date, opponents_team, home_or_away, place_text, place_parsed_url FROM matches WHERE date = ?", 
-                            (date_norm,)
-                        ).fetchone()
-                        if existing:
-                            # Check if values are identical
-                            if (existing['match_number'] == int(r.get('match_number')) and
-                                existing['date'] == date_norm and
-                                existing['opponents_team'] == r.get('opponents_team') and
-                                existing['home_or_away'] == r.get('home_or_away') and
-                                existing['place_text'] == r.get('place') and
-                                existing['place_parsed_url'] == place_url):
-                                action = 'skip'
-                            else:
-                                action = 'update'
-                            existing_data = dict(existing)
-                    except Exception:
-                        pass
-                r['_action'] = action
-                r['_existing'] = existing_data
-                preview.append(r)
-            conn.close()
-            
-            # Display as a formatted diff-like preview
-            st.markdown("### Preview of changes")
-            for r in preview:
-                if r['_errors']:
-                    # Red for errors
-                    st.markdown(f"**Row {r['_row_no']}** - VALIDATION ERROR")
-                    st.error(", ".join(r['_errors']))
-                    st.code(f"match_number={r.get('match_number')} date={r.get('date')} opponents={r.get('opponents_team')} home_or_away={r.get('home_or_away')} place={r.get('place')}", language=None)
-                else:
-                    # Green for inserts, yellow for updates with diff, gray for skipped
-                    if r['_action'] == 'insert':
-                        st.markdown(f"**Row {r['_row_no']}** - NEW MATCH")
-                        st.success(f"**{r.get('match_number')}** · {r.get('date')} · **{r.get('opponents_team')}** · {r.get('home_or_away')} · {r.get('place')}")
-                    elif r['_action'] == 'skip':
-                        st.markdown(f"**Row {r['_row_no']}** - ALREADY UP TO DATE (will skip)")
-                        st.info(f"**{r.get('match_number')}** · {r.get('date')} · **{r.get('opponents_team')}** · {r.get('home_or_away')} · {r.get('place')}")
-                    else:
-                        st.markdown(f"**Row {r['_row_no']}** - UPDATE EXISTING")
-                        
-                        # Show diff for updates
-                        existing = r['_existing']
-                        old_text = f"""Match Number: {existing['match_number']}
-Date: {existing['date']}
-Opponents: {existing['opponents_team']}
-Home/Away: {existing['home_or_away']}
-Place: {existing['place_text'] or '(none)'}"""
-                        
-                        new_text = f"""Match Number: {r.get('match_number')}
-Date: {r.get('date')}
-Opponents: {r.get('opponents_team')}
-Home/Away: {r.get('home_or_away')}
-Place: {r.get('place') or '(none)'}"""
-                        
-                        diff_viewer(
-                            old_text, 
-                            new_text, 
-                            split_view=True,
-                            left_title="Current",
-                            right_title="New",
-                            hide_line_numbers=True,
-                            key=f"diff_{r['_row_no']}"
-                        )
-
-            # persist preview and detected keys so the Approve step survives reruns
-            st.session_state['_csv_preview'] = preview
-            st.session_state['_csv_detected_keys'] = detected_keys
-
-            # If all rows have errors, show a hint
-            if all(r['_errors'] for r in preview):
-                st.warning("All parsed rows have validation errors. Check column names and formats. Use headers like: match_number,date,opponents_team,home_or_away,place")
+                previous = previous_import(conn, source_hash(txt))
+            finally:
+                conn.close()
+            if previous and previous['unchanged']:
+                pop_preview(st.session_state.pop('_csv_preview', None))
+                st.success(
+                    f"Questo CSV è già stato importato il {datetime.fromtimestamp(previous['created_at']).strftime('%d/%m/%Y %H:%M')} "
+                    "e il calendario non è cambiato da allora: nessuna modifica da applicare."
+                )
             else:
-                valid_count = sum(1 for r in preview if not r['_errors'])
-                insert_count = sum(1 for r in preview if not r['_errors'] and r['_action'] == 'insert')
-                update_count = sum(1 for r in preview if not r['_errors'] and r['_action'] == 'update')
-                skip_count = sum(1 for r in preview if not r['_errors'] and r['_action'] == 'skip')
-                st.info(f"{valid_count} valid rows: {insert_count} new, {update_count} updates, {skip_count} unchanged · Rows will **overwrite existing matches that share the same `date`**")
+                try:
+                    rows = parse_pasted_csv(txt)
+                except Exception as e:
+                    st.error(f"Parse error: {e}")
+                    return
+                if not rows:
+                    st.warning("Nessuna riga analizzata. Assicurati che il tuo CSV abbia una riga di intestazione con le colonne: match_number, date, opponents_team, home_or_away, place")
+                    return
+
+                # show what header keys we detected (helpful for debugging mismatched headers)
+                detected_keys = sorted(list(rows[0].keys())) if rows else []
+
+                # Validate rows, then diff them against the calendar in one pass (insert/update/skip/error)
+                for i, r in enumerate(rows, start=1):
+                    r['_row_no'] = i
+                    r['_errors'] = validate_row(r)
+                diff = build_preview(rows)
+                for r, action in zip(rows, diff['action'].astype(str)):
+                    r['_action'] = action
+
+                # persist preview and detected keys so the Approve step survives reruns; the rows
+                # are slimmed and kept server-side (expiring), the session only holds a handle
+                st.session_state['_csv_preview'] = put_preview({
+                    "rows": [{k: r.get(k) for k in PREVIEW_FIELDS} for r in rows],
+                    "diff": diff,
+                    "source_text": txt,
+                })
+                st.session_state['_csv_detected_keys'] = detected_keys
+
+        pending = get_preview(st.session_state.get('_csv_preview'))
+        if pending:
+            st.info(f"Detected columns: {st.session_state.get('_csv_detected_keys')}")
+            show_import_preview(pending["diff"], st.session_state['_csv_preview'])
 
         # Approve import button OUTSIDE the parse preview button scope
-        if st.session_state.get('_csv_preview'):
+        if pending:
             if st.button("Approva importazione", use_container_width=True):
-                preview = st.session_state.pop('_csv_preview', None)
+                pending = pop_preview(st.session_state.pop('_csv_preview', None)) or {}
+                preview = pending.get("rows")
                 detected_keys = st.session_state.pop('_csv_detected_keys', None)
                 if not preview:
-                    st.warning("No preview available. Paste CSV and click 'Parse preview' first.")
+                    st.warning("No preview available (or it expired). Paste CSV and click 'Parse preview' first.")
                 else:
                     # show diagnostic info about the preview to help debug
                     st.info(f"Preview rows: {len(preview)}; Detected keys: {detected_keys}")
@@ -215,13 +321,16 @@ Place: {r.get('place') or '(none)'}"""
 
                     # capture DB counts before/after to help diagnose visibility issues
                     try:
-                        before_count_row = conn.execute("SELECT COUNT(1) as c FROM matches").fetchone()
+                        before_count_row = q.fetch_one(conn, q.MATCH_COUNT)
                         before_count = before_count_row['c'] if before_count_row else 0
                     except Exception:
                         before_count = None
 
                     row_notes = []
                     admin = current_user()
+                    events = EventBatch(conn, actor=(admin['id'] if admin else None))
+                    # the calendar with fingerprints, in one query: unchanged rows are skipped in memory
+                    index = MatchIndex.load(conn)
 
                     # Also collect the target filters we will query after apply (dates and match_numbers)
                     dates = set()
@@ -240,6 +349,8 @@ Place: {r.get('place') or '(none)'}"""
                                 r.get('place'),
                                 source='csv-paste',
                                 created_by=(admin['id'] if admin else None),
+                                events=events,
+                                index=index,
                             )
                             if action == 'inserted':
                                 inserted += 1
@@ -255,11 +366,22 @@ Place: {r.get('place') or '(none)'}"""
                             row_notes.append((r.get('_row_no'), 'error', str(e)))
 
                     try:
-                        after_count_row = conn.execute("SELECT COUNT(1) as c FROM matches").fetchone()
+                        after_count_row = q.fetch_one(conn, q.MATCH_COUNT)
                         after_count = after_count_row['c'] if after_count_row else 0
                     except Exception:
                         after_count = None
 
+                    if inserted or updated or errors:
+                        events.add(EVENT_MATCHES_IMPORTED, data={
+                            "source": "csv-paste", "inserted": inserted, "updated": updated,
+                            "skipped": skipped, "errors": len(errors),
+                        })
+                        events.flush()
+                    if inserted or updated:
+                        coherence.bump(conn, coherence.MATCHES)
+                    if valid_rows:
+                        # after the bump: the same text is recognized until the calendar changes again
+                        record_import(conn, admin['id'] if admin else None, pending.get("source_text") or "", len(valid_rows))
                     conn.commit()
                     conn.close()
                     
@@ -278,20 +400,17 @@ Place: {r.get('place') or '(none)'}"""
 
                     # Re-query the matches and display only those matching imported dates or match_numbers
                     try:
-                        conn2 = get_conn()
-                        placeholders_dates = ','.join('?' for _ in dates) if dates else ''
-                        filtered_rows = []
-                        if dates:
-                            q = f"SELECT id, match_number, date, opponents_team, home_or_away, place_text FROM matches WHERE date IN ({placeholders_dates}) ORDER BY date"
-                            filtered_rows = conn2.execute(q, tuple(dates)).fetchall()
+                        conn2 = get_read_conn()
+                        filtered_rows = q.fetch_all(conn2, q.MATCHES_BY_DATES, (q.json_list(sorted(dates)),)) if dates else []
                         import pandas as pd
-                        df_new = pd.DataFrame(filtered_rows) if filtered_rows else pd.DataFrame(columns=["id","match_number","date","opponents_team","home_or_away","place_text"])
+                        match_columns = ["id", "match_number", "date", "opponents_team", "home_or_away", "place_text", "place_parsed_url"]
+                        df_new = pd.DataFrame(filtered_rows, columns=match_columns) if filtered_rows else pd.DataFrame(columns=match_columns)
                         st.markdown("**Matches matching imported rows:**")
                         st.dataframe(df_new)
 
                         # also show full table for completeness
-                        new_rows = conn2.execute("SELECT id, match_number, date, opponents_team, home_or_away, place_text FROM matches ORDER BY date").fetchall()
-                        df_full = pd.DataFrame(new_rows) if new_rows else pd.DataFrame(columns=["id","match_number","date","opponents_team","home_or_away","place_text"])
+                        new_rows = q.fetch_all(conn2, q.MATCHES_ALL)
+                        df_full = pd.DataFrame(new_rows, columns=match_columns) if new_rows else pd.DataFrame(columns=match_columns)
                         st.markdown("**Full matches table:**")
                         st.dataframe(df_full)
                         conn2.close()
@@ -317,7 +436,9 @@ Place: {r.get('place') or '(none)'}"""
                     conn = get_conn()
                     admin = current_user()
                     try:
-                        action, mid = MatchOperator.apply_row(conn, int(match_number), date_val.isoformat(), opponents, home_or_away, place, source='manual', created_by=admin['id'])
+                        with EventBatch(conn, actor=admin['id']) as events:
+                            action, mid = MatchOperator.apply_row(conn, int(match_number), date_val.isoformat(), opponents, home_or_away, place, source='manual', created_by=admin['id'], events=events)
+                        coherence.bump(conn, coherence.MATCHES)
                         conn.commit()
                         st.success("Partita aggiunta" if action == 'inserted' else "Partita aggiornata")
                     except Exception as e:
@@ -329,11 +450,12 @@ Place: {r.get('place') or '(none)'}"""
         st.subheader("Calendario attuale")
         import pandas as pd
 
-        conn = get_conn()
-        rows = conn.execute("SELECT id, match_number, date, opponents_team, home_or_away, place_text, place_parsed_url FROM matches ORDER BY date").fetchall()
+        conn = get_read_conn()
+        rows = q.fetch_all(conn, q.MATCHES_ALL)
         conn.close()
 
-        df = pd.DataFrame(rows, columns=["id", "match_number", "date", "opponents_team", "home_or_away", "place_text", "place_parsed_url"]) if rows else pd.DataFrame(columns=["id", "match_number", "date", "opponents_team", "home_or_away", "place_text", "place_parsed_url"])
+        # typed columns; text stays plain strings (not categoricals) so any value can be typed in
+        df = frames.typed_frame(rows, MATCHES_EDITOR_SCHEMA)
         # expose editable copy; hide the internal id in the editor but keep it for saves
         df_display = df[["match_number", "date", "opponents_team", "home_or_away", "place_text", "place_parsed_url"]].copy()
         # add a delete checkbox
@@ -343,39 +465,57 @@ Place: {r.get('place') or '(none)'}"""
 
         if st.button("Salva modifiche", use_container_width=True):
             conn = get_conn()
+            admin = current_user()
+            events = EventBatch(conn, actor=(admin['id'] if admin else None))
             inserted = 0
             updated = 0
             deleted = 0
             errors = []
             for i, row in edited.iterrows():
+                # empty cells of typed columns are pd.NA; the database wants None
+                row = {k: (None if pd.isna(v) else v) for k, v in row.items()}
                 try:
                     if row["delete"]:
                         # delete by match_number
-                        conn.execute("DELETE FROM matches WHERE match_number = ?", (int(row["match_number"]),))
+                        gone = q.fetch_one(conn, q.MATCH_BY_NUMBER, (int(row["match_number"]),))
+                        q.execute(conn, q.MATCH_DELETE_BY_NUMBER, (int(row["match_number"]),))
+                        if gone:
+                            events.add(EVENT_MATCH_DELETED, entity=gone["id"], data={
+                                "match_number": gone["match_number"], "date": gone["date"],
+                                "opponents_team": gone["opponents_team"],
+                            })
                         deleted += 1
                         continue
                     match_number = int(row["match_number"])
-                    date = str(row["date"]) if not pd.isna(row["date"]) else None
+                    date = str(row["date"]) if row["date"] is not None else None
                     opponents = row["opponents_team"]
                     hoa = row["home_or_away"]
                     place = row["place_text"]
-                    place_url = place if validators.url(str(place)) else None
-                    now = datetime.utcnow().isoformat()
-                    existing = conn.execute("SELECT id FROM matches WHERE match_number = ?", (match_number,)).fetchone()
+                    np = normalize_place(place)
+                    now = now_epoch()
+                    existing = q.fetch_one(conn, q.MATCH_BY_NUMBER, (match_number,))
                     if existing:
-                        conn.execute(
-                            "UPDATE matches SET date=?, opponents_team=?, home_or_away=?, place_text=?, place_parsed_url=?, updated_at=? WHERE match_number=?",
-                            (date, opponents, hoa, place, place_url, now, match_number),
+                        q.execute(
+                            conn, q.MATCH_EDIT,
+                            (date, opponents, hoa, place, np.url, np.display, np.host, now,
+                             match_fingerprint(match_number, date, opponents, hoa, place, np.url), existing["id"]),
                         )
+                        # the editor saves every row: only log the ones that changed
+                        if (existing["date"], existing["opponents_team"], existing["home_or_away"], existing["place_text"]) != (date, opponents, hoa, place):
+                            events.add(EVENT_MATCH_UPDATED, entity=existing["id"], data={"match_number": match_number, "source": "editor"})
                         updated += 1
                     else:
-                        conn.execute(
-                            "INSERT INTO matches (match_number, date, opponents_team, home_or_away, place_text, place_parsed_url, source_import, created_at) VALUES (?,?,?,?,?,?,?)",
-                            (match_number, date, opponents, hoa, place, place_url, 'manual', now),
+                        cur = q.execute(
+                            conn, q.MATCH_INSERT,
+                            (match_number, date, opponents, hoa, place, np.url, np.display, np.host, 'manual', None, now,
+                             match_fingerprint(match_number, date, opponents, hoa, place, np.url)),
                         )
+                        events.add(EVENT_MATCH_CREATED, entity=cur.lastrowid, data={"match_number": match_number, "source": "editor"})
                         inserted += 1
                 except Exception as e:
                     errors.append(str(e))
+            events.flush()
+            coherence.bump(conn, coherence.MATCHES)
             conn.commit()
             conn.close()
             msg = f"Inserted={inserted} Updated={updated} Deleted={deleted}"
@@ -417,74 +557,141 @@ Place: {r.get('place') or '(none)'}"""
                     else:
                         st.warning("Utente già esistente")
 
+        st.markdown("---")
+        st.subheader("Importazione utenti da CSV")
+        st.info("Incolla CSV con intestazioni: username,role,nickname (role: giocatore o admin). Le password temporanee vengono generate automaticamente.")
+        users_txt = st.text_area("Incolla il CSV utenti qui", height=150, key="bulk_users_csv")
+        if st.button("Crea utenti", use_container_width=True):
+            entries = parse_users_csv(users_txt)
+            invalid = [(i, validate_user_row(r)) for i, r in enumerate(entries, start=1)]
+            invalid = [(i, errs) for i, errs in invalid if errs]
+            if not entries:
+                st.warning("Nessuna riga analizzata. Usa intestazioni come: username,role,nickname")
+            elif invalid:
+                st.error("Righe non valide: " + "; ".join(f"Row {i}: {', '.join(errs)}" for i, errs in invalid))
+            else:
+                admin = current_user()
+                with st.spinner(f"Creazione di {len(entries)} utenti..."):
+                    results = create_users_bulk(entries, admin_id=(admin['id'] if admin else None))
+                created = [r for r in results if r['status'] == 'created']
+                skipped = [r for r in results if r['status'] != 'created']
+                st.success(f"Creati={len(created)} Esistenti={len(skipped)}")
+                if skipped:
+                    st.warning("Già esistenti (saltati): " + ", ".join(r['username'] for r in skipped))
+                if created:
+                    st.session_state._last_action = f"{len(created)} utenti creati da CSV"
+                    columns = ["username", "role", "nickname", "temp_password"]
+                    st.dataframe([{c: r[c] for c in columns} for r in created], use_container_width=True, hide_index=True)
+                    st.download_button(
+                        "Scarica credenziali",
+                        data=to_csv_text(created, columns),
+                        file_name="credenziali.csv",
+                        mime="text/csv",
+                        on_click="ignore",
+                        use_container_width=True,
+                    )
+                    st.caption("Le password temporanee non vengono salvate: scarica il foglio ora.")
+
         st.markdown("---")
         st.subheader("Utenti attivi")
-        conn = get_conn()
-        users = list_users()
+        # one grid for all users: filtering and pagination happen in SQL, actions apply to the selection
+        f1, f2, f3 = st.columns([2, 1, 1], vertical_alignment="bottom")
+        search = f1.text_input("Cerca", placeholder="nome utente o soprannome", key="users_search")
+        role_filter = f2.selectbox("Ruolo", ["tutti"] + USER_ROLES, key="users_role_filter")
+        page_size = f3.selectbox("Per pagina", [25, 50, 100, 200], index=1, key="users_page_size")
+        role_arg = None if role_filter == "tutti" else role_filter
+        total = count_users(search, role_arg)
+        pages = max(1, -(-total // page_size))
+        page_for(st.session_state, "users_page", (search, role_filter, page_size), pages)
+        page = st.number_input(f"Pagina (di {pages})", min_value=1, max_value=pages, step=1, key="users_page")
+        users = search_users(search, role_arg, limit=page_size, offset=(int(page) - 1) * page_size)
         if not users:
-            st.info("No users yet")
+            st.info("No users yet" if not search and role_filter == "tutti" else "Nessun utente trovato")
         else:
-            # header row (allocate more space for username and actions)
-            cols = st.columns([1, 1, 1, 2], vertical_alignment="center")
-            cols[0].markdown("**Nome utente**")
-            cols[1].markdown("**Ruolo**")
-            cols[2].markdown("**Soprannome**")
-            cols[3].markdown("")
-            for u in users:
-                cols = st.columns([1, 1, 1, 2], vertical_alignment="center")
-                cols[0].write(u["username"])
-                cols[1].write(u["role"])
-                cols[2].write(u.get("nickname") or "N/A")
-
-                # Actions: Reset password + Delete (with safety checks)
-                action_cols = cols[3].columns([1, 1], vertical_alignment="center")
-                if action_cols[0].button("Reset PWD", key=f"reset_pwd_{u['id']}"):
-                    temp = generate_temp_password()
-                    update_password(u["id"], temp)
-                    # record audit
-                    admin = current_user()
-                    now = datetime.utcnow().isoformat()
-                    conn.execute(
-                        "INSERT INTO user_audit (admin_id, target_user_id, action, details, created_at) VALUES (?,?,?,?,?)",
-                        (admin["id"], u["id"], 'password_reset', f'Temporary password generated', now),
+            import pandas as pd
+
+            grid = frames.typed_frame(users, USERS_GRID_SCHEMA).set_index("id")
+            grid.insert(0, "selected", False)
+            # one fixed editor key; its edits (the selection) are dropped when the grid shows other rows
+            view = (search, role_filter, page_size, int(page))
+            if st.session_state.get("users_grid_view") != view:
+                st.session_state.users_grid_view = view
+                st.session_state.pop("users_grid", None)
+            edited_users = st.data_editor(
+                grid,
+                hide_index=True,
+                use_container_width=True,
+                disabled=["username", "role", "nickname", "created_at"],
+                column_config={
+                    "selected": st.column_config.CheckboxColumn("✔", width="small"),
+                    "username": "Nome utente",
+                    "role": "Ruolo",
+                    "nickname": "Soprannome",
+                    "created_at": st.column_config.DatetimeColumn("Creato il", format="DD/MM/YYYY HH:mm"),
+                },
+                key="users_grid",
+            )
+            selected_ids = [int(i) for i in edited_users.index[edited_users["selected"]]]
+            st.caption(f"{total} utenti · {len(selected_ids)} selezionati")
+
+            a1, a2, a3 = st.columns([2, 1, 1], vertical_alignment="bottom")
+            action = a1.selectbox("Azione", ["Reset password", "Cambia ruolo", "Elimina"], key="users_bulk_action")
+            new_role_bulk = a2.selectbox("Nuovo ruolo", USER_ROLES, key="users_bulk_role", disabled=action != "Cambia ruolo")
+            confirmed = a3.checkbox("Confermo", key="users_bulk_confirm", help="Le eliminazioni sono irreversibili")
+            if st.button("Applica ai selezionati", use_container_width=True, disabled=not selected_ids):
+                admin = current_user()
+                admin_id = admin['id'] if admin else None
+                if not confirmed:
+                    st.warning("Spunta 'Confermo' per applicare l'azione.")
+                elif action == "Reset password":
+                    with st.spinner(f"Reset di {len(selected_ids)} password..."):
+                        reset = reset_passwords_bulk(selected_ids, admin_id=admin_id)
+                    st.session_state._last_action = f"Password reimpostate per {len(reset)} utenti"
+                    columns = ["username", "temp_password"]
+                    st.dataframe([{c: u[c] for c in columns} for u in reset], use_container_width=True, hide_index=True)
+                    st.download_button(
+                        "Scarica credenziali",
+                        data=to_csv_text(reset, columns),
+                        file_name="credenziali_reset.csv",
+                        mime="text/csv",
+                        on_click="ignore",
+                        use_container_width=True,
                     )
-                    conn.commit()
-                    st.info(f"Temporary password for {u['username']}: {temp}")
-
-                # When Delete is clicked, set a per-user confirm flag and show confirm/cancel buttons
-                confirm_key = f"confirm_delete_{u['id']}"
-                if action_cols[1].button("Delete", key=f"delete_user_{u['id']}", type="primary"):
-                    st.session_state[confirm_key] = True
-
-                if st.session_state.get(confirm_key):
-                    st.warning(f"Sei sicuro di voler eliminare l'utente **{u['username']}** (id={u['id']})? Questa azione è irreversibile.")
-                    c1, c2 = st.columns([1, 1])
-                    if c1.button("Conferma", key=f"confirm_yes_{u['id']}"):
-                        admin = current_user()
-                        # prevent self-deletion
-                        if admin and admin['id'] == u['id']:
-                            st.error("Non puoi eliminare il tuo account mentre sei loggato.")
-                            st.session_state.pop(confirm_key, None)
-                        else:
-                            # don't allow deleting the last admin
-                            if u.get('role') == 'admin':
-                                admin_count_row = conn.execute("SELECT COUNT(1) as c FROM users WHERE role = 'admin'").fetchone()
-                                if admin_count_row and admin_count_row['c'] <= 1:
-                                    st.error("Impossibile eliminare l'ultimo amministratore.")
-                                    st.session_state.pop(confirm_key, None)
-                                    continue
-                            # perform delete and audit
-                            conn.execute("DELETE FROM users WHERE id = ?", (u['id'],))
-                            now = datetime.utcnow().isoformat()
-                            conn.execute(
-                                "INSERT INTO user_audit (admin_id, target_user_id, action, details, created_at) VALUES (?,?,?,?,?)",
-                                (admin['id'] if admin else None, u['id'], 'delete_user', f"Deleted user {u['username']}", now),
-                            )
-                            conn.commit()
-                            st.success(f"User {u['username']} deleted")
-                            st.session_state._last_action = f"User '{u['username']}' deleted (id={u['id']})"
-                            st.session_state.pop(confirm_key, None)
-                            st.rerun()
-                    if c2.button("Annulla", key=f"confirm_no_{u['id']}"):
-                        st.session_state.pop(confirm_key, None)
-        conn.close()
+                elif action == "Cambia ruolo":
+                    changed, err = set_role_bulk(selected_ids, new_role_bulk, admin_id=admin_id)
+                    if err:
+                        st.error(err)
+                    else:
+                        st.session_state._last_action = f"Ruolo '{new_role_bulk}' assegnato a {len(changed)} utenti"
+                        st.rerun()
+                else:
+                    deleted, err = delete_users_bulk(selected_ids, admin_id=admin_id)
+                    if err:
+                        st.error(err)
+                    else:
+                        st.session_state._last_action = f"{len(deleted)} utenti eliminati: " + ", ".join(u['username'] for u in deleted)
+                        st.rerun()
+
+    with tab_export:
+        show_export()
+
+    with st.expander("Memoria sessioni"):
+        stats = session_stats()
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Sessioni attive", stats["sessions"])
+        c2.metric("Stato totale", f"{stats['total_bytes'] / 1024:.1f} KiB")
+        c3.metric("Anteprime in memoria", stats["previews"], help=f"{stats['preview_bytes'] / 1024:.1f} KiB")
+        if stats["per_session"]:
+            st.dataframe(
+                [
+                    {
+                        "Sessione": sid[:8],
+                        "KiB": round(e["bytes"] / 1024, 1),
+                        "Chiavi": e["keys"],
+                        "Chiave più grande": e["largest"][0] if e["largest"] else "",
+                    }
+                    for sid, e in sorted(stats["per_session"].items(), key=lambda kv: -kv[1]["bytes"])
+                ],
+                use_container_width=True,
+                hide_index=True,
+            )
@@ -0,0 +1,67 @@
+import streamlit as st
+from libs.analytics import LATE_CANCEL_DAYS, load_rollups, refresh_rollups
+from libs.attendance import CONFIRM_THRESHOLD
+from libs.auth import is_admin, require_login
+
+
+def show():
+    require_login()
+    if not is_admin():
+        st.error("Admin access required")
+        return
+
+    # fold events recorded since the last refresh (cheap: only new history rows)
+    refresh_rollups()
+    players, matches = load_rollups()
+    if matches.empty:
+        st.info("Nessuna partita in calendario")
+        return
+
+    seasons = sorted(matches["season"].dropna().unique(), reverse=True)
+    season = st.selectbox("Stagione", seasons)
+    p = players[players["season"] == season]
+    m = matches[matches["season"] == season]
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Partite", len(m))
+    col2.metric(f"Con almeno {CONFIRM_THRESHOLD} conferme", int(m["reached"].sum()))
+    col3.metric("Cancellazioni", int(p["cancellations"].sum()))
+    col4.metric("Cancellazioni tardive", int(p["late_cancellations"].sum()),
+                help=f"Meno di {LATE_CANCEL_DAYS:g} giorni prima della partita")
+
+    st.markdown("#### Partecipazione per giocatore")
+    if p.empty:
+        st.info("Nessuna conferma registrata in questa stagione")
+    else:
+        st.bar_chart(p.set_index("player")["rate"].sort_values(ascending=False) * 100, y_label="% partite confermate")
+        st.dataframe(
+            p.sort_values("rate", ascending=False)[
+                ["player", "confirmed", "rate", "cancellations", "late_cancellations"]
+            ].rename(columns={
+                "player": "Giocatore", "confirmed": "Conferme", "rate": "Partecipazione",
+                "cancellations": "Cancellazioni", "late_cancellations": "Tardive",
+            }),
+            column_config={"Partecipazione": st.column_config.ProgressColumn(format="percent", min_value=0, max_value=1)},
+            use_container_width=True,
+            hide_index=True,
+        )
+
+    st.markdown(f"#### Partite sotto soglia (meno di {CONFIRM_THRESHOLD} conferme)")
+    below = m[~m["reached"]].sort_values("date")
+    if below.empty:
+        st.success("Tutte le partite hanno raggiunto la soglia")
+    else:
+        st.dataframe(
+            below[["match_number", "date", "opponents_team", "home_or_away", "confirmed"]].rename(columns={
+                "match_number": "Match #", "date": "Data", "opponents_team": "Avversari",
+                "home_or_away": "Casa/Trasferta", "confirmed": "Confermati",
+            }),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+    if players.empty:
+        return
+    st.markdown("#### Cancellazioni per stagione")
+    trend = players.groupby("season")[["cancellations", "late_cancellations"]].sum()
+    st.bar_chart(trend.rename(columns={"cancellations": "Cancellazioni", "late_cancellations": "Tardive"}), stack=False)
@@ -1,78 +1,99 @@
+import json
 import streamlit as st
-from libs.db import get_conn
-import pandas as pd
+from libs import frames, queries as q
+from libs.db import EVENT_CANCELLED, EVENT_CONFIRMED, get_read_conn
+from libs.events import ATTENDANCE_EVENTS, EVENT_LABELS, MATCH_EVENTS, USER_EVENTS
+from libs.search import MIN_QUERY_LENGTH, SEARCH_PAGE_SIZE, search
+from libs.state import page_for
+
+EVENT_GROUPS = {'Presenze': ATTENDANCE_EVENTS, 'Partite': MATCH_EVENTS, 'Utenti': USER_EVENTS}
+EVENTS_LIMIT = 200
+EVENTS_SCHEMA = {
+    'id': frames.INT,
+    'ts': frames.EPOCH,
+    'kind': frames.INT,
+    'data': frames.TEXT,
+    'match_number': frames.INT,
+    'match_date': frames.TEXT,
+    'opponents_team': frames.CATEGORY,
+    'username': frames.CATEGORY,
+    'actor_username': frames.CATEGORY,
+}
+EVENTS_COLUMNS = {
+    'id': 'ID', 'ts': 'Data/Ora', 'kind': 'Codice Evento', 'data': 'Dati', 'match_number': 'Match #',
+    'match_date': 'Data Match', 'opponents_team': 'Avversari', 'username': 'Utente',
+    'actor_username': 'Modificato Da',
+}
+
+
+def _details(data) -> str:
+    """'key: value' summary of an event's JSON details."""
+    try:
+        values = json.loads(data)
+    except (TypeError, ValueError):
+        return ''
+    return ', '.join(f"{k}: {v}" for k, v in values.items() if v not in (None, ''))
 
 
 def show():
-    st.subheader("Cronologia Conferme")
-    
-    conn = get_conn()
-    
-    # Get attendance history with user and match details
-    query = """
-    SELECT 
-        ah.id,
-        ah.changed_at,
-        u.username,
-        m.match_number,
-        m.date as match_date,
-        m.opponents_team,
-        ah.old_status,
-        ah.new_status,
-        ah.comment,
-        changer.username as changed_by_user
-    FROM attendance_history ah
-    LEFT JOIN users u ON ah.user_id = u.id
-    LEFT JOIN matches m ON ah.match_id = m.id
-    LEFT JOIN users changer ON ah.changed_by = changer.id
-    ORDER BY ah.changed_at DESC 
-    LIMIT 200
-    """
-    
-    rows = conn.execute(query).fetchall()
-    conn.close()
-    
+    st.subheader("Registro Eventi")
+
+    f1, f2 = st.columns([1, 2])
+    text = f1.text_input("Cerca nei dettagli", placeholder="commento, nome utente, ruolo…", key="audit_search").strip()
+    groups = f2.multiselect("Eventi", list(EVENT_GROUPS), default=list(EVENT_GROUPS))
+    kinds = [k for g in groups for k in EVENT_GROUPS[g]]
+
+    if len(text) >= MIN_QUERY_LENGTH:
+        # ranked full-text matches over the event details (libs/search.py), one page at a time
+        page = page_for(st.session_state, "audit_search_page", (text, tuple(kinds)))
+        result = search("events", text, page=page, kinds=kinds)
+        rows = result.rows
+        pages = max(1, -(-result.total // SEARCH_PAGE_SIZE))
+        caption = f"{result.total} eventi trovati" + (" (risultati simili)" if result.fuzzy else "")
+    else:
+        conn = get_read_conn()
+        # one indexed scan of the event log, newest first
+        rows = q.fetch_all(conn, q.EVENTS_RECENT, (q.json_list(kinds), EVENTS_LIMIT))
+        conn.close()
+        pages, caption = 1, None
+
     if not rows:
-        st.info("Nessun evento registrato")
+        st.info("Nessun evento trovato" if caption else "Nessun evento registrato")
         return
-    
-    # Convert to pandas for better display
-    df = pd.DataFrame(rows, columns=[
-        'ID', 'Data/Ora', 'Utente', 'Match #', 'Data Match', 
-        'Avversari', 'Stato Precedente', 'Nuovo Stato', 'Commento', 'Modificato Da'
-    ])
-    
-    # Format action description
-    df['Azione'] = df.apply(lambda row: 
-        '✅ Confermato' if row['Stato Precedente'] is None and row['Nuovo Stato'] == 'confirmed'
-        else '❌ Cancellato' if row['Stato Precedente'] == 'confirmed' and row['Nuovo Stato'] is None
-        else f"{row['Stato Precedente']} → {row['Nuovo Stato']}"
-    , axis=1)
-    
-    # Display in a clean format
+
+    # Load into typed columns (datetimes, categoricals) for a cheap Arrow conversion
+    df = frames.typed_frame(rows, EVENTS_SCHEMA).rename(columns=EVENTS_COLUMNS)
+    df['Evento'] = df['Codice Evento'].map(EVENT_LABELS).fillna('?').astype('category')
+    df['Dettagli'] = df['Dati'].map(_details, na_action='ignore').fillna('').astype('string')
+
     display_df = df[[
-        'Data/Ora', 'Utente', 'Azione', 'Match #', 
-        'Data Match', 'Avversari', 'Modificato Da'
-    ]].copy()
-    
+        'Data/Ora', 'Evento', 'Utente', 'Match #',
+        'Data Match', 'Avversari', 'Dettagli', 'Modificato Da'
+    ]]
+
     st.dataframe(
         display_df,
         use_container_width=True,
-        hide_index=True
+        hide_index=True,
+        column_config={'Data/Ora': st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm:ss")},
     )
-    
+    if pages > 1:
+        st.number_input(f"Pagina (di {pages})", min_value=1, max_value=pages, step=1, key="audit_search_page")
+    if caption:
+        st.caption(caption)
+
     # Summary stats
     st.markdown("---")
     col1, col2, col3 = st.columns(3)
-    
+
     with col1:
-        confirmations = len(df[df['Nuovo Stato'] == 'confirmed'])
+        confirmations = int((df['Codice Evento'] == EVENT_CONFIRMED).sum())
         st.metric("Conferme", confirmations)
-    
+
     with col2:
-        cancellations = len(df[(df['Stato Precedente'] == 'confirmed') & (df['Nuovo Stato'].isna())])
+        cancellations = int((df['Codice Evento'] == EVENT_CANCELLED).sum())
         st.metric("Cancellazioni", cancellations)
-    
+
     with col3:
-        unique_users = df['Utente'].nunique()
+        unique_users = df.loc[df['Codice Evento'].isin(ATTENDANCE_EVENTS), 'Utente'].nunique()
         st.metric("Utenti Attivi", unique_users)
@@ -1,19 +1,39 @@
 import streamlit as st
-from libs.auth import find_user_by_username, verify_password, create_user
+from libs.auth import authenticate, client_address, create_user, start_session
 from libs.auth import generate_temp_password
-from libs.db import get_conn
+from libs import queries as q
+from libs.db import get_read_conn
+from libs.tenancy import TENANT_PARAM, current_tenant, served_tenants
+
+
+def _client_id():
+    """Best-effort identifier of the remote client, used for login throttling."""
+    ctx = getattr(st, "context", None)
+    if ctx is None:
+        return "unknown"
+    # Streamlit reports loopback connections (such as the local reverse proxy) as None
+    peer = getattr(ctx, "ip_address", None) or "127.0.0.1"
+    return client_address(peer, getattr(ctx, "headers", None))
 
 
 def show():
     st.header("Login")
     col1, col2 = st.columns(2)
     with col1:
+        teams = served_tenants()
+        if len(teams) > 1:
+            team = st.selectbox("Squadra", teams, index=teams.index(current_tenant()) if current_tenant() in teams else 0)
+            if team != current_tenant():
+                # the next run activates the chosen team's database
+                st.session_state.tenant = team
+                st.query_params[TENANT_PARAM] = team
+                st.rerun()
         username = st.text_input("Nome utente")
         password = st.text_input("Password", type="password")
         if st.button("Accedi"):
-            user = find_user_by_username(username)
-            if user and verify_password(password, user["password_hash"]):
-                st.session_state.user = user
+            user, error = authenticate(username, password, client=_client_id())
+            if user:
+                start_session(user)
                 st.success("Accesso effettuato")
                 # programmatic navigation using st.switch_page
                 try:
@@ -21,12 +41,14 @@ def show():
                 except Exception:
                     # fallback: force a rerun so the main navigation can pick up the new user
                     st.rerun()
+            elif error == "throttled":
+                st.error("Troppi tentativi di accesso, riprova tra qualche minuto")
             else:
                 st.error("Credenziali non valide")
 
     # First-run bootstrap: create admin if no users exist
-    conn = get_conn()
-    row = conn.execute("SELECT COUNT(1) as c FROM users").fetchone()
+    conn = get_read_conn()
+    row = q.fetch_one(conn, q.USER_COUNT)
     conn.close()
     if row and row["c"] == 0:
         st.info("Nessun utente trovato — crea l'amministratore iniziale")
@@ -1,6 +1,9 @@
 import streamlit as st
-from libs.auth import require_login, current_user, update_password
-from libs.db import get_conn
+from libs.auth import require_login, current_user, update_password, start_session
+from libs import coherence, queries as q
+from libs.db import get_conn, now_epoch
+from libs.ics import feed_url
+from libs.tenancy import current_tenant
 
 
 def show():
@@ -11,11 +14,16 @@ def show():
     nick = st.text_input("Soprannome", value=user.get('nickname') or '')
     if st.button("Salva soprannome"):
         conn = get_conn()
-        conn.execute("UPDATE users SET nickname = ?, updated_at = datetime('now') WHERE id = ?", (nick, user['id']))
+        q.execute(conn, q.USER_SET_NICKNAME, (nick, now_epoch(), user['id']))
+        coherence.bump(conn, coherence.USERS)
         conn.commit()
         conn.close()
         st.success("Soprannome aggiornato")
     st.markdown("---")
+    st.subheader("Calendario")
+    st.caption("Aggiungi questo indirizzo al tuo calendario (Google, Apple, Outlook) per vedere le partite senza aprire l'app.")
+    st.code(feed_url(current_tenant()), language=None)
+    st.markdown("---")
     st.subheader("Cambio password")
     cur = st.text_input("Password attuale", type='password')
     new = st.text_input("Nuova password", type='password')
@@ -27,6 +35,8 @@ def show():
             u = find_user_by_username(user['username'])
             if verify_password(cur, u['password_hash']):
                 update_password(u['id'], new)
+                # other sessions are revoked by update_password; keep this one logged in
+                start_session(u)
                 st.success("Password cambiata")
             else:
                 st.error("Password attuale errata")